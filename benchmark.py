@@ -0,0 +1,167 @@
+from synthetic_data import generate_dataset
+import argparse
+import resource
+import time
+import json
+import os
+from etl import Etl
+
+
+# Measures the throughput of Etl.load_from_file and Etl.save on a synthetic dataset, see synthetic_data.py.
+# Reports the rows loaded per second and the save time for each entity, the total time, and the peak resident memory.
+# Results can be written as json, and compared against a baseline run to catch throughput regressions.
+
+ENTITIES = ["customers", "products", "transactions"]
+
+
+# An Etl process which times the loading and saving of each entity.
+# Only the outermost call is timed, as the per-file methods call each other.
+class TimedEtl(Etl):
+    def __init__(self, **etl_options):
+        super().__init__(**etl_options)
+        self.load_seconds = {entity: 0.0 for entity in ENTITIES + ["erasure_requests"]}
+        self.save_seconds = {entity: 0.0 for entity in ENTITIES + ["rejected_input"]}
+        self.timing = False
+
+    def timed(self, seconds: dict, entity: str, method, *args):
+        if self.timing:
+            return method(*args)
+        self.timing = True
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            seconds[entity] += time.perf_counter() - start
+            self.timing = False
+
+    def load_customers_from_gzip_file(self, zipped_input_filepath: str):
+        self.timed(self.load_seconds, "customers", super().load_customers_from_gzip_file, zipped_input_filepath)
+
+    def load_products_from_gzip_file(self, zipped_input_filepath: str):
+        self.timed(self.load_seconds, "products", super().load_products_from_gzip_file, zipped_input_filepath)
+
+    def load_transactions_from_gzip_file(self, zipped_input_filepath: str):
+        self.timed(self.load_seconds, "transactions", super().load_transactions_from_gzip_file, zipped_input_filepath)
+
+    def load_erasure_request_from_gzip_file(self, zipped_input_filepath: str):
+        self.timed(self.load_seconds, "erasure_requests", super().load_erasure_request_from_gzip_file, zipped_input_filepath)
+
+    # With decode_workers, files are decoded in worker processes, so this is the time spent waiting on and loading them.
+    def load_decoding_file(self, zipped_input_filepath, decoding):
+        entity = zipped_input_filepath.name.split(".")[0].replace("-", "_")
+        self.timed(self.load_seconds, entity, super().load_decoding_file, zipped_input_filepath, decoding)
+
+    def save_customers(self, customers_filepath: str):
+        self.timed(self.save_seconds, "customers", super().save_customers, customers_filepath)
+
+    def save_products(self, products_filepath: str):
+        self.timed(self.save_seconds, "products", super().save_products, products_filepath)
+
+    def save_transactions(self, transactions_filepath: str):
+        self.timed(self.save_seconds, "transactions", super().save_transactions, transactions_filepath)
+
+    # In streaming mode, rows are saved as they're flushed.
+    def flush_customers(self):
+        self.timed(self.save_seconds, "customers", super().flush_customers)
+
+    def flush_products(self):
+        self.timed(self.save_seconds, "products", super().flush_products)
+
+    def flush_transactions(self):
+        self.timed(self.save_seconds, "transactions", super().flush_transactions)
+
+    def save_rejected_input(self, rejected_input_filepath: str):
+        self.timed(self.save_seconds, "rejected_input", super().save_rejected_input, rejected_input_filepath)
+
+
+def run_benchmark(input_folder: str, output_folder: str, stream: bool = False, **etl_options):
+    if stream:
+        os.makedirs(output_folder, exist_ok=True)
+        etl_options["stream_output_folder"] = output_folder
+    etl = TimedEtl(**etl_options)
+
+    start = time.perf_counter()
+    etl.load_from_file(input_folder)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    etl.save(output_folder)
+    save_seconds = time.perf_counter() - start
+
+    row_counts = {"customers": etl.customer_count(), "products": etl.product_count(), "transactions": etl.transaction_count()}
+    results = {
+        "entities": {
+            entity: {
+                "rows": row_counts[entity],
+                "load_seconds": etl.load_seconds[entity],
+                "rows_per_second": row_counts[entity] / etl.load_seconds[entity] if etl.load_seconds[entity] > 0 else 0.0,
+                "save_seconds": etl.save_seconds[entity]
+            }
+            for entity in ENTITIES
+        },
+        "erasure_requests": etl.erasure_request_count(),
+        "rejected_input": etl.rejected_input_count(),
+        "load_seconds": load_seconds,
+        "save_seconds": save_seconds,
+        # Linux reports the peak resident set size in kilobytes.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    }
+    return results
+
+
+# Returns a description of each entity whose load throughput fell by more than `tolerance`, relative to the baseline.
+def find_regressions(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for entity in ENTITIES:
+        rows_per_second = results["entities"][entity]["rows_per_second"]
+        baseline_rows_per_second = baseline["entities"][entity]["rows_per_second"]
+        if rows_per_second < baseline_rows_per_second * (1 - tolerance):
+            regressions.append(f"{entity}: {rows_per_second:,.0f} rows/s, down from {baseline_rows_per_second:,.0f} rows/s")
+    return regressions
+
+
+def print_results(results: dict):
+    print(f"{'entity':<14}{'rows':>12}{'rows/s':>12}{'load s':>10}{'save s':>10}")
+    for entity, entity_results in results["entities"].items():
+        print(f"{entity:<14}{entity_results['rows']:>12,}{entity_results['rows_per_second']:>12,.0f}"
+              f"{entity_results['load_seconds']:>10.2f}{entity_results['save_seconds']:>10.2f}")
+    print(f"Loaded in {results['load_seconds']:.2f}s, saved in {results['save_seconds']:.2f}s, "
+          f"{results['rejected_input']:,} rejected, {results['erasure_requests']:,} erasure requests.")
+    print(f"Peak RSS {results['peak_rss_mb']:,.0f} MB, worker processes {results['peak_worker_rss_mb']:,.0f} MB.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the etl process on a synthetic dataset.")
+    parser.add_argument("--data-folder", default="benchmark-data", help="Synthetic input data, generated if missing.")
+    parser.add_argument("--output-folder", default="benchmark-output")
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vectorized-ingest", action="store_true")
+    parser.add_argument("--decode-workers", type=int, default=0)
+    parser.add_argument("--defer-erasure-requests", action="store_true")
+    parser.add_argument("--stream", action="store_true", help="Stream the output, in row groups.")
+    parser.add_argument("--json", help="Write the results to this json file.")
+    parser.add_argument("--baseline", help="Fail if throughput regressed against the results in this json file.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_folder):
+        start = time.perf_counter()
+        generate_dataset(args.data_folder, args.transactions, days=args.days, seed=args.seed)
+        print(f"Generated {args.transactions:,} transactions in {time.perf_counter() - start:.1f}s.")
+
+    results = run_benchmark(args.data_folder, args.output_folder, vectorized_ingest=args.vectorized_ingest,
+                            decode_workers=args.decode_workers, defer_erasure_requests=args.defer_erasure_requests,
+                            stream=args.stream)
+    print_results(results)
+    if args.json:
+        with open(args.json, mode='w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if len(regressions) > 0:
+            raise SystemExit(1)
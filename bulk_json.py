@@ -0,0 +1,358 @@
+from transaction import Transaction, Purchases
+from dataclasses import dataclass, field
+from rejection import INVALID_RECORD, rejection_reason
+from money import decimal_to_unscaled_int64
+from record_store import RecordStore
+from customer import Customer
+from decimal import Decimal
+from product import Product
+import pyarrow.compute as pc
+import pyarrow.json as pj
+import pyarrow as pa
+import numpy as np
+from time import perf_counter
+import gzip
+import io
+import os
+
+
+# Decodes and validates a whole gzipped json file at once, using pyarrow.json and vectorized compute kernels,
+# rather than calling json.loads and building one object per line.
+# Only the checks that depend on a single row are made here. The primary and foreign key checks, which depend on
+# the rows already loaded, are left to Etl.
+# When a file holds anything the vectorized checks can't be sure to treat the same as the per-line parsers (eg a
+# column of an unexpected type), the file is decoded line by line with the per-line parsers instead.
+
+
+# Smaller gzipped files are better loaded line by line, as the fixed cost of the vectorized checks outweighs their gain.
+MIN_BULK_FILE_SIZE = 32 * 1024
+# The same, for uncompressed newline delimited json data.
+MIN_BULK_DATA_SIZE = 256 * 1024
+
+
+# The json fields decoded as strings. Left to itself, pyarrow.json would decode any string that looks like a date as a
+# timestamp. The other fields are left for it to infer, as eg ids may be given as either numbers or strings.
+CUSTOMER_JSON_SCHEMA = pa.schema(
+    [(name, pa.string()) for name in ["first_name", "last_name", "email", "date_of_birth", "phone_number", "address", "city",
+                                      "country", "postcode", "last_change", "segment"]]
+)
+PRODUCT_JSON_SCHEMA = pa.schema([("name", pa.string()), ("price", pa.string()), ("category", pa.string())])
+TRANSACTION_JSON_SCHEMA = pa.schema(
+    [
+        ("transaction_id", pa.string()),
+        ("transaction_time", pa.string()),
+        ("delivery_address", pa.struct([(name, pa.string()) for name in ["address", "city", "country", "postcode"]])),
+        ("purchases", pa.struct(
+            [
+                ("products", pa.list_(pa.struct([("price", pa.string()), ("total", pa.string())]))),
+                ("total_cost", pa.string())
+            ]
+        ))
+    ]
+)
+
+
+class UnsupportedBulkInput(Exception):
+    pass
+
+
+@dataclass
+class DecodedFile:
+    # The input file path, or a description of where other input data came from.
+    filepath: str
+    # Every input line, so rejected rows can be reported with their original line.
+    lines: list
+    # The rows which passed validation, in the parquet schema of the entity.
+    table: pa.Table
+    # The input line number of each table row.
+    row_numbers: list
+    # (line number, message, rejection reason) of each input line which failed validation, see rejection.py.
+    rejections: list = field(default_factory=list)
+    # Wall time spent reading and decompressing the file, and decoding and validating its rows.
+    read_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    # Bytes of input read, compressed if the input was.
+    input_bytes: int = 0
+
+
+def read_gzip_file(zipped_input_filepath: str):
+    with gzip.open(zipped_input_filepath) as input_file:
+        data = input_file.read()
+    return data, io.BytesIO(data).readlines()
+
+
+def decode_customers_gzip_file(zipped_input_filepath: str, vectorized: bool = True):
+    return decode_gzip_file(zipped_input_filepath, CUSTOMER_JSON_SCHEMA, customers_from_json_table, Customer, vectorized)
+
+
+def decode_products_gzip_file(zipped_input_filepath: str, vectorized: bool = True):
+    return decode_gzip_file(zipped_input_filepath, PRODUCT_JSON_SCHEMA, products_from_json_table, Product, vectorized)
+
+
+def decode_transactions_gzip_file(zipped_input_filepath: str, vectorized: bool = True):
+    return decode_gzip_file(zipped_input_filepath, TRANSACTION_JSON_SCHEMA, transactions_from_json_table, Transaction, vectorized)
+
+
+def decode_customers_data(source: str, data: bytes, vectorized: bool = True):
+    return decode_data(source, data, CUSTOMER_JSON_SCHEMA, customers_from_json_table, Customer, vectorized)
+
+
+def decode_products_data(source: str, data: bytes, vectorized: bool = True):
+    return decode_data(source, data, PRODUCT_JSON_SCHEMA, products_from_json_table, Product, vectorized)
+
+
+def decode_transactions_data(source: str, data: bytes, vectorized: bool = True):
+    return decode_data(source, data, TRANSACTION_JSON_SCHEMA, transactions_from_json_table, Transaction, vectorized)
+
+
+# Decodes the customers, products or transactions file, chosen by its file name.
+# Etl runs this in worker processes to decode files in parallel.
+def decode_gzip_file_by_name(zipped_input_filepath: str, vectorized: bool = True):
+    decoders = {
+        "customers.json.gz": decode_customers_gzip_file,
+        "products.json.gz": decode_products_gzip_file,
+        "transactions.json.gz": decode_transactions_gzip_file
+    }
+    return decoders[os.path.basename(zipped_input_filepath)](zipped_input_filepath, vectorized)
+
+
+def decode_gzip_file(zipped_input_filepath: str, json_schema: pa.Schema, from_json_table, record_class, vectorized: bool = True):
+    start = perf_counter()
+    data, lines = read_gzip_file(zipped_input_filepath)
+    read_seconds = perf_counter() - start
+    decoded = decode_lines_in_bulk(zipped_input_filepath, data, lines, json_schema, from_json_table, record_class, vectorized)
+    decoded.read_seconds = read_seconds
+    decoded.input_bytes = os.path.getsize(zipped_input_filepath)
+    return decoded
+
+
+# Decodes newline delimited json data, described by `source` when its lines are rejected.
+def decode_data(source: str, data: bytes, json_schema: pa.Schema, from_json_table, record_class, vectorized: bool = True):
+    decoded = decode_lines_in_bulk(source, data, io.BytesIO(data).readlines(), json_schema, from_json_table, record_class, vectorized)
+    decoded.input_bytes = len(data)
+    return decoded
+
+
+# Decodes the lines in bulk if `vectorized`, otherwise decodes them line by line.
+def decode_lines_in_bulk(source: str, data: bytes, lines: list, json_schema: pa.Schema, from_json_table, record_class,
+                         vectorized: bool = True):
+    start = perf_counter()
+    try:
+        if not vectorized:
+            raise UnsupportedBulkInput("Decoding line by line.")
+        # pyarrow.json skips blank lines, which would misalign its rows with the input lines.
+        if any(len(line.strip()) == 0 for line in lines):
+            raise UnsupportedBulkInput("Blank input line.")
+        json_table = pj.read_json(pa.BufferReader(data), read_options=pj.ReadOptions(use_threads=False),
+                                  parse_options=pj.ParseOptions(explicit_schema=json_schema))
+        if json_table.num_rows != len(lines):
+            raise UnsupportedBulkInput("Rows do not match input lines.")
+        table, row_numbers, rejections = from_json_table(json_table)
+    except (UnsupportedBulkInput, pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        table, row_numbers, rejections = decode_lines(lines, record_class)
+    return DecodedFile(source, lines, table, row_numbers, rejections, decode_seconds=perf_counter() - start)
+
+
+# Decode each line with the per-line parser of the record class.
+def decode_lines(lines: list, record_class):
+    records = RecordStore(pa.schema(record_class.parquet_struct()), column_converters=record_class.column_converters())
+    row_numbers = []
+    rejections = []
+    for line_number, line in enumerate(lines):
+        try:
+            record = record_class.from_string(line)
+        except Exception as e:
+            rejections.append((line_number, str(e), rejection_reason(e)))
+            continue
+        records.append(record.to_parquet_row())
+        row_numbers.append(line_number)
+    return records.to_table(), row_numbers, rejections
+
+
+# Tracks which rows are still valid, and the message each invalid row was rejected with.
+# Each row is rejected for the first check it fails, in the order the checks are made.
+class RowChecks:
+    def __init__(self, row_count: int):
+        self.valid = pa.array(np.ones(row_count, dtype=bool))
+        self.rejections = []
+
+    def require(self, check: pa.Array, message: str):
+        check = pc.fill_null(check, False)
+        failed = pc.and_(self.valid, pc.invert(check))
+        for row in pc.indices_nonzero(failed).to_pylist():
+            self.rejections.append((row, message, INVALID_RECORD))
+        self.valid = pc.and_(self.valid, check)
+
+    def valid_rows(self):
+        return pc.indices_nonzero(self.valid)
+
+
+# Returns the named json column, checking it was decoded as one of the types the per-line parsers would accept.
+# A column missing from every row is returned as all nulls.
+def json_column(json_table, name: str, accepted_types: tuple):
+    if isinstance(json_table, pa.Table):
+        if name not in json_table.column_names:
+            return pa.nulls(json_table.num_rows)
+        column = json_table.column(name).combine_chunks()
+    else:
+        if json_table.type.get_field_index(name) == -1:
+            return pa.nulls(len(json_table))
+        column = json_table.field(name)
+    if not pa.types.is_null(column.type) and not any(type_check(column.type) for type_check in accepted_types):
+        raise UnsupportedBulkInput(f"Column {name} has unsupported type {column.type}.")
+    return column
+
+
+IS_STRING = (pa.types.is_string,)
+IS_STRING_OR_INTEGER = (pa.types.is_string, pa.types.is_integer)
+IS_NUMBER = (pa.types.is_integer, pa.types.is_floating)
+
+
+def customers_from_json_table(json_table: pa.Table):
+    checks = RowChecks(json_table.num_rows)
+    customer_schema = pa.schema(Customer.parquet_struct())
+
+    columns = {}
+    for customer_field in customer_schema:
+        if customer_field.name == "id":
+            columns["id"] = json_column(json_table, "id", IS_STRING_OR_INTEGER).cast(pa.int64())
+        else:
+            columns[customer_field.name] = json_column(json_table, customer_field.name, IS_STRING).cast(pa.string())
+
+    # Mandatory fields
+    for name in ["id", "first_name", "last_name", "email"]:
+        checks.require(pc.is_valid(columns[name]), f"Customer {name} is mandatory.")
+
+    table = pa.Table.from_arrays([columns[name] for name in customer_schema.names], schema=customer_schema)
+    valid_rows = checks.valid_rows()
+    return table.take(valid_rows), valid_rows.to_pylist(), checks.rejections
+
+
+def products_from_json_table(json_table: pa.Table):
+    checks = RowChecks(json_table.num_rows)
+    product_schema = pa.schema(Product.parquet_struct())
+
+    sku = json_column(json_table, "sku", IS_STRING_OR_INTEGER)
+    name = json_column(json_table, "name", IS_STRING)
+    price = json_column(json_table, "price", IS_STRING_OR_INTEGER)
+    category = json_column(json_table, "category", IS_STRING)
+    popularity = json_column(json_table, "popularity", IS_NUMBER)
+
+    # Mandatory fields
+    for column_name, column in [("sku", sku), ("name", name), ("price", price), ("category", category), ("popularity", popularity)]:
+        checks.require(pc.is_valid(column), f"Product {column_name} is mandatory.")
+
+    # Enforce type
+    columns = [
+        sku.cast(pa.int64()),
+        name.cast(pa.string()),
+        price.cast(product_schema.field("price").type),
+        category.cast(pa.string()),
+        popularity.cast(pa.float64())
+    ]
+
+    # Other constraints
+    checks.require(pc.greater_equal(columns[2], pa.scalar(Decimal(0))), "Price must be positive.")
+    checks.require(pc.greater(columns[4], 0), "Popularity must be greater than 0.")
+
+    table = pa.Table.from_arrays(columns, schema=product_schema)
+    valid_rows = checks.valid_rows()
+    return table.take(valid_rows), valid_rows.to_pylist(), checks.rejections
+
+
+def transactions_from_json_table(json_table: pa.Table):
+    checks = RowChecks(json_table.num_rows)
+    transaction_schema = pa.schema(Transaction.parquet_struct())
+
+    transaction_id = json_column(json_table, "transaction_id", IS_STRING).cast(pa.string())
+    customer_id = json_column(json_table, "customer_id", IS_STRING_OR_INTEGER).cast(pa.int64())
+    transaction_time = json_column(json_table, "transaction_time", IS_STRING).cast(pa.timestamp('us'))
+    delivery_address = delivery_addresses_from_json_column(
+        json_column(json_table, "delivery_address", (pa.types.is_struct,)),
+        transaction_schema.field("delivery_address").type)
+
+    # Mandatory fields
+    checks.require(pc.is_valid(transaction_id), "Transaction transaction_id is mandatory.")
+    checks.require(pc.is_valid(customer_id), "Transaction customer_id is mandatory.")
+    checks.require(pc.is_valid(transaction_time), "transaction_time not set.")
+
+    purchases = purchases_from_json_column(json_column(json_table, "purchases", (pa.types.is_struct,)), checks)
+
+    table = pa.Table.from_arrays([transaction_id, customer_id, delivery_address, transaction_time, purchases], schema=transaction_schema)
+    valid_rows = checks.valid_rows()
+    return table.take(valid_rows), valid_rows.to_pylist(), checks.rejections
+
+
+def delivery_addresses_from_json_column(delivery_address: pa.Array, delivery_address_type: pa.StructType):
+    if pa.types.is_null(delivery_address.type):
+        return pa.nulls(len(delivery_address), delivery_address_type)
+    address_fields = [delivery_address_type.field(index) for index in range(delivery_address_type.num_fields)]
+    known_field_names = [address_field.name for address_field in address_fields]
+    for index in range(delivery_address.type.num_fields):
+        if delivery_address.type.field(index).name not in known_field_names:
+            raise UnsupportedBulkInput("Delivery address has unsupported fields.")
+    arrays = [json_column(delivery_address, address_field.name, IS_STRING).cast(pa.string()) for address_field in address_fields]
+    return pa.StructArray.from_arrays(arrays, fields=address_fields, mask=pc.is_null(delivery_address))
+
+
+def purchases_from_json_column(purchases: pa.Array, checks: RowChecks):
+    purchases_type = Purchases.parquet_struct()
+    products_type = purchases_type.field("products").type
+    product_purchase_type = products_type.value_type
+
+    checks.require(pc.is_valid(purchases), "Transaction purchases is mandatory.")
+    if pa.types.is_null(purchases.type):
+        return pa.nulls(len(purchases), purchases_type)
+
+    products = json_column(purchases, "products", (pa.types.is_list,))
+    total_cost = json_column(purchases, "total_cost", IS_STRING_OR_INTEGER).cast(pa.decimal128(12, 2))
+    checks.require(pc.is_valid(products), "Purchases products is mandatory.")
+    checks.require(pc.is_valid(total_cost), "Purchases total_cost is mandatory.")
+    if pa.types.is_null(products.type):
+        return pa.nulls(len(purchases), purchases_type)
+
+    # Product purchases of all transactions, flattened into one array, with the transaction row each belongs to.
+    product_purchases = products.flatten()
+    product_purchase_rows = pc.list_parent_indices(products)
+    if not pa.types.is_struct(product_purchases.type) or product_purchases.null_count > 0:
+        raise UnsupportedBulkInput("Product purchases must all be objects.")
+
+    sku = json_column(product_purchases, "sku", IS_STRING_OR_INTEGER).cast(pa.int64())
+    if product_purchases.type.get_field_index("quantity") != -1 and product_purchases.type.get_field_index("quanitity") != -1:
+        quantity = pc.coalesce(json_column(product_purchases, "quantity", (pa.types.is_integer,)),
+                               json_column(product_purchases, "quanitity", (pa.types.is_integer,)))
+    elif product_purchases.type.get_field_index("quantity") != -1:
+        quantity = json_column(product_purchases, "quantity", (pa.types.is_integer,))
+    else:
+        quantity = json_column(product_purchases, "quanitity", (pa.types.is_integer,))
+    if quantity.null_count > 0:
+        # A missing quantity is rejected, but an explicit null is accepted, which can't be told apart here.
+        raise UnsupportedBulkInput("Product purchase quantity is null.")
+    quantity = quantity.cast(pa.int32())
+    price = json_column(product_purchases, "price", IS_STRING_OR_INTEGER).cast(pa.decimal128(12, 2))
+    total = json_column(product_purchases, "total", IS_STRING_OR_INTEGER).cast(pa.decimal128(12, 2))
+
+    # A transaction is invalid if any of its product purchases are missing a mandatory field.
+    product_purchase_valid = pc.and_(pc.and_(pc.is_valid(sku), pc.is_valid(price)), pc.is_valid(total))
+    invalid_rows = pc.unique(pc.filter(product_purchase_rows, pc.invert(product_purchase_valid)))
+    checks.require(pc.invert(pc.is_in(pa.array(np.arange(len(purchases))), value_set=invalid_rows)),
+                   "Product purchase sku, price and total are mandatory.")
+
+    # `total_cost` should match the total of all products purchased.
+    # The totals are summed per transaction as integer cents, from the differences of their running sum at each list offset.
+    list_lengths = pc.fill_null(pc.list_value_length(products), 0)
+    list_lengths = np.frombuffer(list_lengths.buffers()[1], dtype=np.int32)[list_lengths.offset:list_lengths.offset + len(list_lengths)]
+    offset_values = np.concatenate([[0], np.cumsum(list_lengths)]).astype(np.int32)
+    offsets = pa.array(offset_values)
+    total_running_sum = np.concatenate([[0], np.cumsum(decimal_to_unscaled_int64(total))])
+    cost_sum = total_running_sum[offset_values[1:]] - total_running_sum[offset_values[:-1]]
+    checks.require(pa.array(decimal_to_unscaled_int64(total_cost) == cost_sum),
+                   "`total_cost` should match the total amount that all products purchased total up to.")
+    product_purchases_array = pa.StructArray.from_arrays(
+        [sku, quantity, price, total],
+        fields=[product_purchase_type.field(index) for index in range(product_purchase_type.num_fields)])
+    products_array = pa.ListArray.from_arrays(offsets, product_purchases_array, type=products_type)
+    return pa.StructArray.from_arrays(
+        [total_cost, products_array],
+        fields=[purchases_type.field(index) for index in range(purchases_type.num_fields)],
+        mask=pc.is_null(purchases))
@@ -0,0 +1,9 @@
+import zipfile
+import os
+
+
+# The tests read the test data folder, which is only kept zipped, so unzip it once, if it isn't already.
+def pytest_sessionstart(session):
+    if not os.path.isdir("test-data"):
+        with zipfile.ZipFile("test-data.zip") as test_data_zip:
+            test_data_zip.extractall(".")
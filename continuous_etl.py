@@ -0,0 +1,112 @@
+from landing_watcher import LandingFolderWatcher
+from time import monotonic
+from etl import Etl
+import threading
+import argparse
+import signal
+
+
+# Processes a landing folder continuously, rather than in batch runs over the whole tree.
+# The landing folder is polled for new input files (see landing_watcher.py), which are loaded in the order
+# load_from_file processes them, and the output is saved in micro-batches: once `commit_rows` rows have been loaded
+# since the last commit, or the first file loaded since then is `commit_interval_seconds` old.
+# Each commit is a save() to the output folder, with its input manifest, so a restarted process continues from the last
+# commit, and skips the files already committed. A commit only saves the customer, product and transaction rows new or
+# changed since the last, as change files of the output files, or with partitioned transactions, only rewrites the
+# partitions with new or anonymized transactions. Every `compact_interval_commits` commits, and when stopped, the commit
+# compacts the output instead, rewriting the output files in full without change files. See output_changes.py.
+class ContinuousEtl:
+    def __init__(self, etl: Etl, landing_folder: str, output_folder: str, poll_interval_seconds: float = 1.0,
+                 commit_interval_seconds: float = 10.0, commit_rows: int = 100000, settle_seconds: float = 1.0,
+                 compact_interval_commits: int = 100, log=print):
+        assert etl.stream_output_folder is None, "A streaming Etl can't save more than once, so can't commit micro-batches."
+        self.etl = etl
+        self.output_folder = output_folder
+        self.poll_interval_seconds = poll_interval_seconds
+        self.commit_interval_seconds = commit_interval_seconds
+        self.commit_rows = commit_rows
+        self.compact_interval_commits = compact_interval_commits
+        self.log = log
+        self.watcher = LandingFolderWatcher(landing_folder, settle_seconds)
+        self.stop_event = threading.Event()
+
+        self.etl.load_previous_output(output_folder)
+        self.committed_rows = self.loaded_rows()
+        # Input files loaded since the last commit, and when the first of them was loaded.
+        self.uncommitted_file_count = 0
+        self.uncommitted_since = None
+        self.commit_count = 0
+        # Commits since the output was last compacted, whose change files are waiting to be compacted.
+        self.uncompacted_commit_count = 0
+
+    # Poll and commit until stop() is called, or for `max_polls` polls, then commit any remaining input, and compact the
+    # output.
+    def run(self, max_polls: int = None):
+        poll_count = 0
+        while not self.stop_event.is_set() and (max_polls is None or poll_count < max_polls):
+            self.poll()
+            poll_count += 1
+            self.stop_event.wait(self.poll_interval_seconds)
+        self.commit(compact=True)
+
+    def stop(self):
+        self.stop_event.set()
+
+    # Load the input files added since the last poll, committing whenever a trigger is reached.
+    # Returns the number of files loaded.
+    def poll(self):
+        # Files committed before a restart are found again, but skipped.
+        input_filepaths = [input_filepath for input_filepath in self.watcher.poll() if not self.etl.input_manifest.is_loaded(input_filepath)]
+        for input_filepath in input_filepaths:
+            self.etl.load_from_file(str(input_filepath))
+            self.uncommitted_file_count += 1
+            if self.uncommitted_since is None:
+                self.uncommitted_since = monotonic()
+            if self.loaded_rows() - self.committed_rows >= self.commit_rows:
+                self.commit()
+        if self.uncommitted_since is not None and monotonic() - self.uncommitted_since >= self.commit_interval_seconds:
+            self.commit()
+        return len(input_filepaths)
+
+    # Save the input loaded since the last commit to the output folder, compacting it if `compact`, or if due.
+    def commit(self, compact: bool = False):
+        if self.uncommitted_file_count == 0 and (not compact or self.uncompacted_commit_count == 0):
+            return
+        compact = compact or self.uncompacted_commit_count + 1 >= self.compact_interval_commits
+        self.etl.save(self.output_folder, compact=compact)
+        self.log(f"Committed {self.uncommitted_file_count} input files, {self.loaded_rows() - self.committed_rows} rows"
+                 f"{', and compacted the output' if compact else ''}.")
+        self.committed_rows = self.loaded_rows()
+        self.uncommitted_file_count = 0
+        self.uncommitted_since = None
+        self.commit_count += 1
+        self.uncompacted_commit_count = 0 if compact else self.uncompacted_commit_count + 1
+
+    # The input rows loaded so far, accepted or rejected.
+    def loaded_rows(self):
+        return self.etl.customer_count() + self.etl.product_count() + self.etl.transaction_count() + \
+            self.etl.erasure_request_count() + self.etl.rejected_input_count()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process the input files added to a landing folder, as they arrive.")
+    parser.add_argument("landing_folder")
+    parser.add_argument("output_folder")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of the landing folder.")
+    parser.add_argument("--commit-interval", type=float, default=10.0, help="Most seconds loaded input waits to be committed.")
+    parser.add_argument("--commit-rows", type=int, default=100000, help="Rows loaded which trigger a commit.")
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds a new file is left unchanged before it is read.")
+    parser.add_argument("--compact-interval", type=int, default=100, help="Commits between compactions of the output.")
+    parser.add_argument("--partition-transactions", action="store_true")
+    parser.add_argument("--vectorized-ingest", action="store_true")
+    parser.add_argument("--upsert", action="store_true")
+    args = parser.parse_args()
+
+    continuous_etl = ContinuousEtl(Etl(partition_transactions=args.partition_transactions, vectorized_ingest=args.vectorized_ingest,
+                                       upsert=args.upsert),
+                                   args.landing_folder, args.output_folder, poll_interval_seconds=args.poll_interval,
+                                   commit_interval_seconds=args.commit_interval, commit_rows=args.commit_rows,
+                                   settle_seconds=args.settle, compact_interval_commits=args.compact_interval)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: continuous_etl.stop())
+    signal.signal(signal.SIGINT, lambda signal_number, frame: continuous_etl.stop())
+    continuous_etl.run()
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from pyarrow import ArrowInvalid
-import pyarrow.parquet as pq
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import parquet_reader
+import pyarrow as pa
 import hashlib
 import json
 
@@ -32,7 +35,15 @@ class Customer:
 
     @classmethod
     def from_string(cls, customer_string: str):
-        customer_json = json.loads(customer_string, strict=False)
+        return cls.from_json(cls.decode_json(customer_string))
+
+    @staticmethod
+    def decode_json(customer_string: str):
+        return json.loads(customer_string, strict=False)
+
+    # Construct from the dictionary decoded from the json string.
+    @classmethod
+    def from_json(cls, customer_json: dict):
 
         id = customer_json.get("id")
         first_name = customer_json.get("first_name")
@@ -52,6 +63,37 @@ class Customer:
                        last_change=last_change, segment=segment)
         return customer
 
+    # Returns this object's values in the column order of its parquet structure.
+    def to_parquet_row(self):
+        return [self.id, self.first_name, self.last_name, self.email, self.date_of_birth, self.phone_number,
+                self.address, self.city, self.country, self.postcode, self.last_change, self.segment]
+
+    @staticmethod
+    # Returns the parquet structure to save this object to file.
+    def parquet_struct():
+        customer_struct = pa.struct(
+            [
+                pa.field('id', pa.int64()),
+                pa.field('first_name', pa.string()),
+                pa.field('last_name', pa.string()),
+                pa.field('email', pa.string()),
+                pa.field('date_of_birth', pa.string()),
+                pa.field('phone_number', pa.string()),
+                pa.field('address', pa.string()),
+                pa.field('city', pa.string()),
+                pa.field('country', pa.string()),
+                pa.field('postcode', pa.string()),
+                pa.field('last_change', pa.string()),
+                pa.field('segment', pa.string())
+            ]
+        )
+        return customer_struct
+
+    @staticmethod
+    # Returns the converters of columns whose rows don't hold the values arrow converts to, see RecordStore.
+    def column_converters():
+        return {}
+
     # Hash the personal identifying information of the customer
     # This is not fully anonymous- if we want that, we should erase / replace the personal info entirely.
     def anonymize(self):
@@ -68,22 +110,57 @@ class Customer:
             self.postcode = hashlib.md5(self.postcode.encode('utf-8')).hexdigest()
 
 
-def read_customers(filepath: str):
-    try:
-        file = pq.ParquetFile(filepath)
-        empty_file = False
-    except ArrowInvalid:
-        empty_file = True
-    if not empty_file:
-        for record_batch in file.iter_batches(batch_size=1000):
-            record_list = zip(*[column.to_pylist() for column in record_batch.columns])
-            for record in record_list:
-                # Construct dictionary of customer parameters
-                customer_dict = {column_name: value for (column_name, value) in zip(record_batch.column_names, record)}
-                # Pass dictionary as keyword arguments
-                customer = Customer(**customer_dict)
-                yield customer
-
-
-def read_all_customers(filepath: str):
-    return list(read_customers(filepath))
+# The columns Customer.anonymize hashes.
+ANONYMIZED_COLUMNS = ["first_name", "last_name", "email", "date_of_birth", "phone_number", "address", "postcode"]
+
+
+# Returns the customers, a table or record batch, with the rows of the boolean mask anonymized as Customer.anonymize
+# does, a whole column at a time, rather than building a Customer per row.
+# With `workers`, the columns are hashed on that many threads. hashlib only releases the GIL while hashing values over
+# 2 KiB, so threads only speed up columns of long values.
+def anonymize_customers(customers, mask, workers: int = 0):
+    mask = pa.array(mask, pa.bool_())
+    indexes = [customers.schema.get_field_index(column_name) for column_name in ANONYMIZED_COLUMNS]
+    columns = [customers.column(index) for index in indexes]
+    if workers > 0:
+        with ThreadPoolExecutor(workers) as executor:
+            anonymized_columns = list(executor.map(lambda column: anonymize_array(column, mask), columns))
+    else:
+        anonymized_columns = [anonymize_array(column, mask) for column in columns]
+    arrays = list(customers.columns)
+    for index, column in zip(indexes, anonymized_columns):
+        arrays[index] = column
+    return type(customers).from_arrays(arrays, schema=customers.schema)
+
+
+# Returns the string array with the values at the rows of the mask replaced by the hex md5 digest of their utf-8 bytes,
+# as Customer.anonymize does. Null values stay null.
+def anonymize_array(array, mask: pa.BooleanArray):
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    values = pc.filter(array, mask).cast(pa.binary()).to_pylist()
+    digests = pa.array([hashlib.md5(value).hexdigest() if value is not None else None for value in values], pa.string())
+    return pc.replace_with_mask(array, mask, digests)
+
+
+def read_customers_table(filepath: str, columns: list = None, ids=None, filter: ds.Expression = None):
+    return parquet_reader.read_table(filepath, pa.schema(Customer.parquet_struct()), columns, customer_filter(ids, filter))
+
+
+def iter_customer_batches(filepath: str, columns: list = None, ids=None, filter: ds.Expression = None, batch_size: int = 1000):
+    return parquet_reader.iter_batches(filepath, pa.schema(Customer.parquet_struct()), columns, customer_filter(ids, filter), batch_size)
+
+
+def customer_filter(ids=None, filter: ds.Expression = None):
+    return parquet_reader.all_of(parquet_reader.is_in("id", ids, pa.int64()), filter)
+
+
+def read_customers(filepath: str, ids=None, filter: ds.Expression = None):
+    for record_batch in iter_customer_batches(filepath, ids=ids, filter=filter):
+        for customer_dict in record_batch.to_pylist():
+            # Pass dictionary as keyword arguments
+            yield Customer(**customer_dict)
+
+
+def read_all_customers(filepath: str, ids=None, filter: ds.Expression = None):
+    return list(read_customers(filepath, ids, filter))
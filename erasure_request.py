@@ -19,8 +19,11 @@ class ErasureRequest:
 
     @classmethod
     def from_string(cls, erasure_request_string: str):
-        erasure_request_json = json.loads(erasure_request_string)
+        return cls.from_json(json.loads(erasure_request_string))
 
+    # Construct from the dictionary decoded from the json string.
+    @classmethod
+    def from_json(cls, erasure_request_json: dict):
         customer_id = erasure_request_json.get("customer-id")
         email = erasure_request_json.get("email")
 
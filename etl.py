@@ -1,107 +1,594 @@
-from transaction import Transaction, Purchases
+from bulk_json import MIN_BULK_FILE_SIZE, MIN_BULK_DATA_SIZE, DecodedFile, decode_customers_gzip_file, decode_products_gzip_file, \
+    decode_transactions_gzip_file, decode_gzip_file_by_name, decode_customers_data, decode_products_data, decode_transactions_data
+from concurrent.futures import ProcessPoolExecutor
+from transaction import Transaction, TRANSACTION_PARTITION_SCHEMA, with_transaction_partitions, anonymize_delivery_address, \
+    anonymize_transactions
+from rejection import RejectedRecord, DUPLICATE_KEY, UNKNOWN_CUSTOMER, UNKNOWN_PRODUCT, STALE_RECORD, rejection_reason
+from parquet_output_stream import ParquetOutputStream, PartitionedParquetOutputStream, write_partitions
+from instrumentation import Instrumentation
 from erasure_request import ErasureRequest
-from customer import Customer
+from rejected_input_sink import RejectedInputSink
+from input_manifest import InputManifest
+from gzip_lines import GzipLineStream
+from state_store import open_state_store, open_rows_state_store
+from key_index import HashedStringKeyIndex
+from transaction_id_history import TransactionIdHistory
+from parquet_erasure import anonymize_customer_rows, erase_transactions
+from snapshot import write_arrow_file, read_arrow_file, key_index_table, load_key_index, rows_index_table, load_rows_index
+from output_changes import write_changes, apply_changes, remove_changes
+import parquet_reader
+import shutil
+from record_store import RecordStore
+from customer import Customer, anonymize_customers
 from product import Product
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
+from collections import deque
 from pathlib import Path
 import pyarrow as pa
-import gzip
+import numpy as np
+import hashlib
+import json
+import io
 import os
 
 
+# Input files are sorted by time, with a processing order of customers, products, transactions, and then erasure requests.
+INPUT_FILE_PRIORITY = {"customers.json.gz": "priority-1", "products.json.gz": "priority-2", "transactions.json.gz": "priority-3", "erasure-requests.json.gz": "priority-4"}
+
+
+def input_file_sort_key(filepath: Path):
+    return '/'.join(filepath.parts[0:-1]) + '/' + INPUT_FILE_PRIORITY[filepath.parts[-1]]
+
+
 class Etl:
     customers_output_filename = "customers.parquet"
     products_output_filename = "products.parquet"
     transactions_output_filename = "transactions.parquet"
+    transactions_output_dirname = "transactions"
     rejected_input_output_filename = "rejected_input.txt"
+    rejected_input_details_output_filename = "rejected_input_details.jsonl"
+    input_manifest_output_filename = "input_manifest.json"
+    erased_customer_ids_output_filename = "erased_customer_ids.json"
+    snapshot_state_filename = "state.json"
+
+    def __init__(self, defer_erasure_requests: bool = False, stream_output_folder: str = None,
+                 row_group_rows: int = 10000, row_group_bytes: int = 64 * 1024 * 1024, vectorized_ingest: bool = False,
+                 decode_workers: int = 0, instrument: bool = False, rejection_log_interval_seconds: float = 10.0,
+                 upsert: bool = False, state_store_folder: str = None, state_store_cache_keys: int = 100000,
+                 partition_transactions: bool = False, partition_file_rows: int = 1000000, compact_key_indexes: bool = False,
+                 transaction_id_history_folder: str = None, anonymize_workers: int = 0):
+        # Rows are held column by column, see RecordStore.
+        self.customers = RecordStore(pa.schema(Customer.parquet_struct()), column_converters=Customer.column_converters())
+        self.products = RecordStore(pa.schema(Product.parquet_struct()), column_converters=Product.column_converters())
+        self.transactions = RecordStore(pa.schema(Transaction.parquet_struct()), column_converters=Transaction.column_converters())
+        self.erasure_requests = []
+
+        # In deferred mode, erasure requests are held until save() and applied in one pass,
+        # so they also anonymize matching customers that arrive after the request.
+        self.defer_erasure_requests = defer_erasure_requests
+        self.pending_erasure_requests = []
+
+        # Deferred erasure requests anonymize the customers' columns on this many threads, see customer.anonymize_customers.
+        self.anonymize_workers = anonymize_workers
+
+        # When continuing from a previous run's output, rejected input is appended to its rejected input files.
+        self.append_rejected_input = False
 
-    def __init__(self):
-        self.customers = []
-        self.products = []
-        self.transactions = []
-        self.erasure_requests = []  # Store erasure requests till time to write file, so we can anonymize any that arrive after current time?
+        # Input files loaded by load_from_file, saved with the output so that a later run can continue from it. Once
+        # continuing from a previous run's output, the files recorded in its manifest are skipped.
+        self.input_manifest = InputManifest()
+        self.skip_loaded_input_files = False
 
-        self.rejected_input = []
+        # The folder of the previous run's output, if continuing from it, and the number of transactions it held.
+        # Saving partitioned transactions back to that folder only rewrites the partitions with new transactions.
+        self.previous_output_folder = None
+        self.previous_transaction_count = 0
+        # The customer and product rows that folder held, and the rows of those changed since, by updates and erasure
+        # requests. Saving back to it without compacting only saves the new and changed rows, see output_changes.py.
+        self.previous_customer_count = 0
+        self.previous_product_count = 0
+        self.changed_customer_rows = set()
+        self.changed_product_rows = set()
+
+        # Decode and validate each large gzipped json file at once with pyarrow, rather than line by line, see bulk_json.py.
+        self.vectorized_ingest = vectorized_ingest
+
+        # Number of worker processes which decode and validate input files in parallel in load_from_file.
+        # With 0 workers, each file is decoded as it is loaded.
+        self.decode_workers = decode_workers
+
+        # In upsert mode, a customer or product with the key of one already loaded replaces it, rather than being
+        # rejected as a duplicate. Customers are only replaced by a customer with the same or a later last_change,
+        # and products by whichever arrives last. Rows are replaced in place, so can't have been written out already.
+        assert not (upsert and stream_output_folder is not None), "Upserts can't be combined with streaming output."
+        self.upsert = upsert
+
+        # Ids of the customers hit by an erasure request, so that later updates and transactions of them are anonymized
+        # too. They are saved with the output, and loaded with it by a later run, so a customer's transactions are only
+        # anonymized once, however many runs erase the customer.
+        self.erased_customer_ids = set()
 
         # Mappings from primary key to array row.
         # Used to efficiently enforce primary key and foreign key constraints.
-        self.customer_id_to_row = {}
-        self.product_sku_to_row = {}
-        self.transaction_id_to_row = {}
+        # The customer and product indexes, and the secondary indexes below, are state stores, held in memory, or if
+        # `state_store_folder` is given, on disk behind a cache of `state_store_cache_keys` keys each, see state_store.py.
+        # With streaming output, which releases written rows, the foreign keys of transactions can then be checked
+        # against more customers and products than fit in memory. The stores only hold the state of one run, so any
+        # left in the folder by an earlier run are cleared.
+        # With `compact_key_indexes`, the indexes held in memory are hash tables in numpy arrays rather than dictionaries,
+        # see key_index.py, with transaction ids held as 128 bit hashes, at a fraction of the memory per key.
+        self.state_store_folder = state_store_folder
+        self.state_store_cache_keys = state_store_cache_keys
+        self.compact_key_indexes = compact_key_indexes
+        self.customer_id_to_row = self.new_state_store("customer_id_to_row")
+        self.product_sku_to_row = self.new_state_store("product_sku_to_row")
+        self.transaction_id_to_row = HashedStringKeyIndex() if compact_key_indexes else {}
+
+        # With `transaction_id_history_folder`, transaction ids are checked for uniqueness against every run saved with
+        # the same folder, and this run's ids are held there rather than in transaction_id_to_row, see
+        # transaction_id_history.py. The ids of a run are added to the history once it is saved.
+        self.transaction_id_history = None
+        if transaction_id_history_folder is not None:
+            self.transaction_id_history = TransactionIdHistory(transaction_id_history_folder)
+
+        # Secondary index from customer email to customer rows, used to find erasure request targets without a full scan.
+        # Emails are not enforced unique, so each email maps to a list of rows.
+        self.customer_email_to_rows = self.new_rows_state_store("customer_email_to_rows")
+
+        # Secondary index from customer id to the rows of the customer's transactions, used to anonymize the delivery
+        # addresses of an erased customer's transactions, and to look up a customer's transactions, without a full scan.
+        # It isn't kept when streaming, which releases the transactions it would index, and anonymizes them in the output
+        # instead, so would otherwise grow with every transaction written out.
+        self.customer_id_to_transaction_rows = self.new_rows_state_store("customer_id_to_transaction_rows")
+        # Rows of transactions anonymized after they were loaded, eg from a previous run's output, which must be saved.
+        self.anonymized_transaction_rows = []
+
+        # Transactions may be saved as a hive partitioned dataset in a `transactions` folder, with a partition per date and
+        # hour, see transaction.py, and files of up to `partition_file_rows` rows.
+        self.partition_transactions = partition_transactions
+        self.partition_file_rows = partition_file_rows
+
+        # In streaming mode, the output files are kept open and rows are written out a row group at a time, once
+        # `row_group_rows` rows or `row_group_bytes` bytes of input are buffered. Written rows are released from memory,
+        # leaving only the key indexes resident. Row numbers in the indexes keep counting across written rows.
+        self.stream_output_folder = stream_output_folder
+        self.customers_output_stream = None
+        self.products_output_stream = None
+        self.transactions_output_stream = None
+        if stream_output_folder is not None:
+            os.makedirs(stream_output_folder, exist_ok=True)
+            self.customers_output_stream = ParquetOutputStream(
+                os.path.join(stream_output_folder, self.customers_output_filename),
+                pa.schema(Customer.parquet_struct()), row_group_rows, row_group_bytes)
+            self.products_output_stream = ParquetOutputStream(
+                os.path.join(stream_output_folder, self.products_output_filename),
+                pa.schema(Product.parquet_struct()), row_group_rows, row_group_bytes)
+            if partition_transactions:
+                self.transactions_output_stream = PartitionedParquetOutputStream(
+                    os.path.join(stream_output_folder, self.transactions_output_dirname),
+                    pa.schema(Transaction.parquet_struct()), TRANSACTION_PARTITION_SCHEMA, with_transaction_partitions,
+                    row_group_rows, row_group_bytes, partition_file_rows)
+            else:
+                self.transactions_output_stream = ParquetOutputStream(
+                    os.path.join(stream_output_folder, self.transactions_output_filename),
+                    pa.schema(Transaction.parquet_struct()), row_group_rows, row_group_bytes)
+
+        # Rejected input is written out as it is rejected, straight to the output folder in streaming mode, see
+        # RejectedInputSink.
+        if stream_output_folder is not None:
+            self.rejected_input = RejectedInputSink(
+                os.path.join(stream_output_folder, self.rejected_input_output_filename),
+                os.path.join(stream_output_folder, self.rejected_input_details_output_filename),
+                rejection_log_interval_seconds)
+        else:
+            self.rejected_input = RejectedInputSink(log_interval_seconds=rejection_log_interval_seconds)
+
+        # Number of rows already written out by the output streams, and released from the row lists.
+        self.flushed_customer_count = 0
+        self.flushed_product_count = 0
+        self.flushed_transaction_count = 0
+
+        # Rows hit by an erasure request after they were written out, which are anonymized in the file on save. A state
+        # store of the rows, each mapped to the number of requests that hit it, as each anonymizes it again.
+        self.unanonymized_flushed_customer_rows = self.new_state_store("unanonymized_flushed_customer_rows")
+
+        # Per-stage timings, and counts of rows, rejections and bytes, see stats().
+        self.instrumentation = Instrumentation(instrument)
+
+    # Returns the store for the named key index. Override to use another state store backend.
+    def new_state_store(self, name: str):
+        return open_state_store(name, self.state_store_folder, self.state_store_cache_keys, self.compact_key_indexes, clear=True)
+
+    # Returns the store for the named secondary index. Override to use another state store backend.
+    def new_rows_state_store(self, name: str):
+        return open_rows_state_store(name, self.state_store_folder, self.state_store_cache_keys, clear=True)
 
     def load_customer_from_string(self, customer_json: str):
-        # Enforce uniqueness of customer id, using a dictionary for efficiency.
-        customer = Customer.from_string(customer_json)
-        if customer.id in self.customer_id_to_row:
-            raise Exception(f"Customer id {customer.id} is already present in the customer data, duplicate rejected.")
-        self.customer_id_to_row[customer.id] = len(self.customers)
-        self.customers.append(customer)
+        self.instrumentation.start()
+        customer_dict = Customer.decode_json(customer_json)
+        self.instrumentation.lap("json_decode")
+        customer = Customer.from_json(customer_dict)
+        self.instrumentation.lap("validate")
+        self.load_customer(customer, len(customer_json))
+
+    # Load a customer which has already been validated, given the size of its input.
+    def load_customer(self, customer: Customer, byte_count: int):
+        self.instrumentation.start()
+        if self.upsert and customer.id in self.customer_id_to_row:
+            self.update_customer(customer)
+            return
+        self.index_customer(customer.id, customer.email, self.customer_count())
+        self.instrumentation.lap("index")
+        self.customers.append(customer.to_parquet_row())
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("customers")
+        self.flush_customers_if_full(byte_count)
+
+    # Enforce uniqueness of customer id, using a dictionary for efficiency, and index the customer at the given row.
+    def index_customer(self, customer_id: int, email: str, row: int):
+        if customer_id in self.customer_id_to_row:
+            raise RejectedRecord(f"Customer id {customer_id} is already present in the customer data, duplicate rejected.", DUPLICATE_KEY)
+        self.customer_id_to_row[customer_id] = row
+        self.customer_email_to_rows.add_row(email, row)
+
+    # Replace the row of a customer already loaded, unless that customer has a later last_change.
+    # The row is found through the id index and replaced in place, so the cost of an update doesn't grow with the rows held.
+    def update_customer(self, customer: Customer):
+        row = self.customer_id_to_row[customer.id]
+        store_row = row - self.flushed_customer_count
+        last_change = self.customers.get(store_row, "last_change")
+        # Dates in ISO format order as strings. A customer without a last_change is older than any with one.
+        if (customer.last_change or "") < (last_change or ""):
+            raise RejectedRecord(f"Customer id {customer.id} has a later last_change ({last_change}) than this update ({customer.last_change}), stale update rejected.", STALE_RECORD)
+
+        self.reindex_customer_email(row, self.customers.get(store_row, "email"), customer.email)
+        for column_name, value in zip(self.customers.schema.names, customer.to_parquet_row()):
+            self.customers.set(store_row, column_name, value)
+        self.changed_customer_rows.add(row)
+        if customer.id in self.erased_customer_ids:
+            self.anonymize_customer(row)
+        self.instrumentation.lap("update")
+        self.instrumentation.count_accepted("customers")
+        self.instrumentation.count_updated("customers")
+
+    # Move the customer row to its new email in the email index.
+    def reindex_customer_email(self, row: int, email: str, new_email: str):
+        if new_email == email:
+            return
+        self.customer_email_to_rows.remove_row(email, row)
+        self.customer_email_to_rows.add_row(new_email, row)
 
     def load_customers_from_gzip_file(self, zipped_input_filepath: str):
-        with gzip.open(zipped_input_filepath) as input_file:
-            for line in input_file.readlines():
-                try:
-                    self.load_customer_from_string(line)
-                except Exception as e:
-                    print(e)
-                    self.rejected_input.append(bytes(zipped_input_filepath+": ", 'utf-8')+line)
+        if self.load_in_bulk(zipped_input_filepath):
+            self.load_decoded_customers(decode_customers_gzip_file(zipped_input_filepath))
+            return
+        self.load_customers_from_lines(self.read_gzip_lines("customers", zipped_input_filepath), zipped_input_filepath)
+
+    # Load customers from newline delimited json data, eg the body of a bulk request, with `source` describing where it
+    # came from. Large data is decoded in bulk if vectorized_ingest is set.
+    # Returns the (line number, message, rejection reason) of each rejected line, in line order.
+    def load_customers_from_data(self, data: bytes, source: str):
+        if self.load_data_in_bulk(data):
+            return self.load_decoded_customers(decode_customers_data(source, data))
+        self.instrumentation.count_bytes_read("customers", len(data))
+        return self.load_customers_from_lines(io.BytesIO(data).readlines(), source)
+
+    def load_customers_from_lines(self, lines, source: str):
+        return self.load_lines("customers", self.load_customer_from_string, lines, source)
+
+    # Load customers which were decoded and validated a whole file at a time, see bulk_json.py.
+    def load_decoded_customers(self, decoded: DecodedFile):
+        self.count_decoded_file("customers", decoded)
+        rejections = list(decoded.rejections)
+        accepted_table_rows = []
+        first_row = self.customer_count()
+        accepted_bytes = 0
+        updated_table_rows = []
+        customer_ids = decoded.table.column("id").to_pylist()
+        emails = decoded.table.column("email").to_pylist()
+        for table_row, (customer_id, email) in enumerate(zip(customer_ids, emails)):
+            line_number = decoded.row_numbers[table_row]
+            if self.upsert and customer_id in self.customer_id_to_row:
+                updated_table_rows.append(table_row)
+                continue
+            try:
+                self.index_customer(customer_id, email, first_row + len(accepted_table_rows))
+            except Exception as e:
+                rejections.append((line_number, str(e), rejection_reason(e)))
+                continue
+            accepted_table_rows.append(table_row)
+            accepted_bytes += len(decoded.lines[line_number])
+
+        self.instrumentation.lap("index")
+        self.customers.extend(decoded.table.take(pa.array(accepted_table_rows, pa.int64())))
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("customers", len(accepted_table_rows))
+        rejections += self.update_decoded_rows(decoded, updated_table_rows, Customer, self.update_customer)
+        rejections = self.reject_decoded_lines("customers", decoded, rejections)
+        self.flush_customers_if_full(accepted_bytes)
+        return rejections
 
     def load_product_from_string(self, product_json: str):
-        # Enforce uniqueness of product sku, using a dictionary for efficiency.
-        product = Product.from_string(product_json)
-        if product.sku in self.product_sku_to_row:
-            raise Exception(f"Product SKU {product.sku} is already present in the product data, duplicate rejected.")
-        self.product_sku_to_row[product.sku] = len(self.products)
-        self.products.append(product)
+        self.instrumentation.start()
+        product_dict = Product.decode_json(product_json)
+        self.instrumentation.lap("json_decode")
+        product = Product.from_json(product_dict)
+        self.instrumentation.lap("validate")
+        self.load_product(product, len(product_json))
+
+    # Load a product which has already been validated, given the size of its input.
+    def load_product(self, product: Product, byte_count: int):
+        self.instrumentation.start()
+        if self.upsert and product.sku in self.product_sku_to_row:
+            self.update_product(product)
+            return
+        self.index_product(product.sku, self.product_count())
+        self.instrumentation.lap("index")
+        self.products.append(product.to_parquet_row())
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("products")
+        self.flush_products_if_full(byte_count)
+
+    # Enforce uniqueness of product sku, using a dictionary for efficiency, and index the product at the given row.
+    def index_product(self, sku: int, row: int):
+        if sku in self.product_sku_to_row:
+            raise RejectedRecord(f"Product SKU {sku} is already present in the product data, duplicate rejected.", DUPLICATE_KEY)
+        self.product_sku_to_row[sku] = row
+
+    # Replace the row of a product already loaded, in place, through the sku index.
+    def update_product(self, product: Product):
+        row = self.product_sku_to_row[product.sku]
+        store_row = row - self.flushed_product_count
+        for column_name, value in zip(self.products.schema.names, product.to_parquet_row()):
+            self.products.set(store_row, column_name, value)
+        self.changed_product_rows.add(row)
+        self.instrumentation.lap("update")
+        self.instrumentation.count_accepted("products")
+        self.instrumentation.count_updated("products")
 
     def load_products_from_gzip_file(self, zipped_input_filepath: str):
-        with gzip.open(zipped_input_filepath) as input_file:
-            for line in input_file.readlines():
-                try:
-                    self.load_product_from_string(line)
-                except Exception as e:
-                    print(e)
-                    self.rejected_input.append(bytes(zipped_input_filepath+": ", 'utf-8')+line)
+        if self.load_in_bulk(zipped_input_filepath):
+            self.load_decoded_products(decode_products_gzip_file(zipped_input_filepath))
+            return
+        self.load_products_from_lines(self.read_gzip_lines("products", zipped_input_filepath), zipped_input_filepath)
+
+    # Load products from newline delimited json data, eg the body of a bulk request, with `source` describing where it
+    # came from. Large data is decoded in bulk if vectorized_ingest is set.
+    # Returns the (line number, message, rejection reason) of each rejected line, in line order.
+    def load_products_from_data(self, data: bytes, source: str):
+        if self.load_data_in_bulk(data):
+            return self.load_decoded_products(decode_products_data(source, data))
+        self.instrumentation.count_bytes_read("products", len(data))
+        return self.load_products_from_lines(io.BytesIO(data).readlines(), source)
+
+    def load_products_from_lines(self, lines, source: str):
+        return self.load_lines("products", self.load_product_from_string, lines, source)
+
+    # Load products which were decoded and validated a whole file at a time, see bulk_json.py.
+    def load_decoded_products(self, decoded: DecodedFile):
+        self.count_decoded_file("products", decoded)
+        rejections = list(decoded.rejections)
+        accepted_table_rows = []
+        first_row = self.product_count()
+        accepted_bytes = 0
+        updated_table_rows = []
+        for table_row, sku in enumerate(decoded.table.column("sku").to_pylist()):
+            line_number = decoded.row_numbers[table_row]
+            if self.upsert and sku in self.product_sku_to_row:
+                updated_table_rows.append(table_row)
+                continue
+            try:
+                self.index_product(sku, first_row + len(accepted_table_rows))
+            except Exception as e:
+                rejections.append((line_number, str(e), rejection_reason(e)))
+                continue
+            accepted_table_rows.append(table_row)
+            accepted_bytes += len(decoded.lines[line_number])
+
+        self.instrumentation.lap("index")
+        self.products.extend(decoded.table.take(pa.array(accepted_table_rows, pa.int64())))
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("products", len(accepted_table_rows))
+        rejections += self.update_decoded_rows(decoded, updated_table_rows, Product, self.update_product)
+        rejections = self.reject_decoded_lines("products", decoded, rejections)
+        self.flush_products_if_full(accepted_bytes)
+        return rejections
 
     def load_transaction_from_string(self, transaction_json: str):
+        self.instrumentation.start()
+        transaction_dict = Transaction.decode_json(transaction_json)
+        self.instrumentation.lap("json_decode")
+        transaction = Transaction.from_json(transaction_dict)
+        self.instrumentation.lap("validate")
+        self.load_transaction(transaction, len(transaction_json))
+
+    # Load a transaction which has already been validated, given the size of its input.
+    def load_transaction(self, transaction: Transaction, byte_count: int):
+        self.instrumentation.start()
+        skus = [product_purchase.sku for product_purchase in transaction.purchases.products]
+        self.index_transaction(transaction.transaction_id, transaction.customer_id, skus, self.transaction_count())
+        self.instrumentation.lap("index")
+        if self.anonymize_transactions_on_load() and transaction.customer_id in self.erased_customer_ids:
+            transaction.anonymize()
+        self.transactions.append(transaction.to_parquet_row())
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("transactions")
+        self.flush_transactions_if_full(byte_count)
+
+    # Enforce the transaction's primary and foreign key constraints, and index the transaction at the given row.
+    def index_transaction(self, transaction_id: str, customer_id: int, skus: list, row: int):
         # Enforce uniqueness of transaction id, using a dictionary for efficiency.
-        transaction = Transaction.from_string(transaction_json)
-        if transaction.transaction_id in self.transaction_id_to_row:
-            raise Exception(f"Transaction id {transaction.transaction_id} is already present in the transaction data, duplicate rejected.")
+        if self.transaction_id_known(transaction_id):
+            raise RejectedRecord(f"Transaction id {transaction_id} is already present in the transaction data, duplicate rejected.", DUPLICATE_KEY)
 
         # Enforce customer id must refer to a valid customer we have already processed.
-        if transaction.customer_id not in self.customer_id_to_row:
-            raise Exception(f"Transaction customer_id {transaction.customer_id} is not present in the customer data, transaction rejected (transaction id {transaction.transaction_id}).")
+        if customer_id not in self.customer_id_to_row:
+            raise RejectedRecord(f"Transaction customer_id {customer_id} is not present in the customer data, transaction rejected (transaction id {transaction_id}).", UNKNOWN_CUSTOMER)
 
         # Enforce product sku must refer to a valid product we have already processed.
-        for product_purchase in transaction.purchases.products:
-            if product_purchase.sku not in self.product_sku_to_row:
-                raise Exception(f"Transaction product SKU {product_purchase.sku} is not present in the product data, transaction rejected (transaction id {transaction.transaction_id}).")
+        for sku in skus:
+            if sku not in self.product_sku_to_row:
+                raise RejectedRecord(f"Transaction product SKU {sku} is not present in the product data, transaction rejected (transaction id {transaction_id}).", UNKNOWN_PRODUCT)
+
+        self.index_transaction_id(transaction_id, customer_id, row)
 
-        self.transaction_id_to_row[transaction.transaction_id] = len(self.transactions)
-        self.transactions.append(transaction)
+    # Returns whether the transaction id was already loaded, by this run or, with a transaction id history, an earlier one.
+    def transaction_id_known(self, transaction_id: str):
+        if transaction_id in self.transaction_id_to_row:
+            return True
+        return self.transaction_id_history is not None and transaction_id in self.transaction_id_history
+
+    def index_transaction_id(self, transaction_id: str, customer_id: int, row: int):
+        if self.transaction_id_history is not None:
+            self.transaction_id_history.add(transaction_id)
+        else:
+            self.transaction_id_to_row[transaction_id] = row
+        if self.stream_output_folder is None:
+            self.customer_id_to_transaction_rows.add_row(customer_id, row)
 
     def load_transactions_from_gzip_file(self, zipped_input_filepath: str):
-        with gzip.open(zipped_input_filepath) as input_file:
-            for line in input_file.readlines():
+        if self.load_in_bulk(zipped_input_filepath):
+            self.load_decoded_transactions(decode_transactions_gzip_file(zipped_input_filepath))
+            return
+        self.load_transactions_from_lines(self.read_gzip_lines("transactions", zipped_input_filepath), zipped_input_filepath)
+
+    # Load transactions from newline delimited json data, eg the body of a bulk request, with `source` describing where it
+    # came from. Large data is decoded in bulk if vectorized_ingest is set.
+    # Returns the (line number, message, rejection reason) of each rejected line, in line order.
+    def load_transactions_from_data(self, data: bytes, source: str):
+        if self.load_data_in_bulk(data):
+            return self.load_decoded_transactions(decode_transactions_data(source, data))
+        self.instrumentation.count_bytes_read("transactions", len(data))
+        return self.load_transactions_from_lines(io.BytesIO(data).readlines(), source)
+
+    def load_transactions_from_lines(self, lines, source: str):
+        return self.load_lines("transactions", self.load_transaction_from_string, lines, source)
+
+    # Load transactions which were decoded and validated a whole file at a time, see bulk_json.py.
+    def load_decoded_transactions(self, decoded: DecodedFile):
+        self.count_decoded_file("transactions", decoded)
+        rejections = list(decoded.rejections)
+        accepted_table_rows = []
+        first_row = self.transaction_count()
+        accepted_bytes = 0
+
+        # The foreign key checks don't depend on the order of the transactions in the file, so they are made for the
+        # whole file at once, leaving only the uniqueness check to be made one row at a time.
+        customer_ids = decoded.table.column("customer_id")
+        customer_known = self.customer_id_to_row.contains_keys(customer_ids.combine_chunks())
+        products = decoded.table.column("purchases").combine_chunks().field("products")
+        sku_known = self.product_sku_to_row.contains_keys(pc.list_flatten(products).field("sku"))
+        rows_with_unknown_sku = pc.unique(pc.filter(pc.list_parent_indices(products), pc.invert(sku_known)))
+        row_numbers = pa.array(np.arange(decoded.table.num_rows))
+        foreign_keys_known = pc.and_(customer_known, pc.invert(pc.is_in(row_numbers, value_set=rows_with_unknown_sku))).to_pylist()
+
+        customer_id_values = customer_ids.to_pylist()
+        for table_row, transaction_id in enumerate(decoded.table.column("transaction_id").to_pylist()):
+            line_number = decoded.row_numbers[table_row]
+            if foreign_keys_known[table_row] and not self.transaction_id_known(transaction_id):
+                self.index_transaction_id(transaction_id, customer_id_values[table_row], first_row + len(accepted_table_rows))
+            else:
+                # Make the full checks, to reject the row with the reason it fails them.
                 try:
-                    self.load_transaction_from_string(line)
+                    skus = products[table_row].values.field("sku").to_pylist()
+                    self.index_transaction(transaction_id, customer_id_values[table_row], skus, first_row + len(accepted_table_rows))
                 except Exception as e:
-                    print(e)
-                    self.rejected_input.append(bytes(zipped_input_filepath+": ", 'utf-8')+line)
+                    rejections.append((line_number, str(e), rejection_reason(e)))
+                    continue
+            accepted_table_rows.append(table_row)
+            accepted_bytes += len(decoded.lines[line_number])
+
+        self.instrumentation.lap("index")
+        accepted_transactions = decoded.table.take(pa.array(accepted_table_rows, pa.int64()))
+        if self.anonymize_transactions_on_load():
+            erased = pc.is_in(accepted_transactions.column("customer_id"), value_set=pa.array(list(self.erased_customer_ids), pa.int64()))
+            accepted_transactions = anonymize_transactions(accepted_transactions, erased)
+        self.transactions.extend(accepted_transactions)
+        self.instrumentation.lap("store")
+        self.instrumentation.count_accepted("transactions", len(accepted_table_rows))
+        rejections = self.reject_decoded_lines("transactions", decoded, rejections)
+        self.flush_transactions_if_full(accepted_bytes)
+        return rejections
+
+    # In upsert mode, apply the decoded rows whose keys were already loaded, including earlier in the same file, as updates.
+    # They are applied in input order once the file's new rows are stored, which gives the same result as loading the
+    # file line by line, as each update only depends on the earlier rows with its key.
+    # Returns the (line number, message, rejection reason) of each rejected update.
+    def update_decoded_rows(self, decoded: DecodedFile, table_rows: list, record_class, update):
+        rejections = []
+        for table_row in table_rows:
+            try:
+                update(record_class(**decoded.table.slice(table_row, 1).to_pylist()[0]))
+            except Exception as e:
+                rejections.append((decoded.row_numbers[table_row], str(e), rejection_reason(e)))
+        return rejections
+
+    def load_in_bulk(self, zipped_input_filepath: str):
+        return self.vectorized_ingest and os.path.getsize(zipped_input_filepath) >= MIN_BULK_FILE_SIZE
+
+    def load_data_in_bulk(self, data: bytes):
+        return self.vectorized_ingest and len(data) >= MIN_BULK_DATA_SIZE
+
+    # Reject the given (line number, message, reason) of a decoded file, in input line order, and return them in that order.
+    def reject_decoded_lines(self, entity: str, decoded: DecodedFile, rejections: list):
+        rejections = sorted(rejections, key=lambda rejection: rejection[0])
+        for line_number, message, reason in rejections:
+            self.rejected_input.reject(entity, decoded.filepath, line_number + 1, decoded.lines[line_number], reason, message)
+            self.instrumentation.count_rejected(entity, reason)
+        return rejections
+
+    # Count the time a decoded file took to read and decode, which may have been spent in a worker process.
+    # The time from here until its rows are indexed is then counted as indexing.
+    def count_decoded_file(self, entity: str, decoded: DecodedFile):
+        self.instrumentation.add_seconds("read", decoded.read_seconds)
+        self.instrumentation.add_seconds("decode", decoded.decode_seconds)
+        self.instrumentation.count_bytes_read(entity, decoded.input_bytes)
+        self.instrumentation.start()
+
+    # Stream the lines of a gzip file, inflated on a background thread while the lines before are loaded, see
+    # gzip_lines.py. Time spent waiting for lines is counted as reading.
+    def read_gzip_lines(self, entity: str, zipped_input_filepath: str):
+        if self.instrumentation.enabled:
+            self.instrumentation.count_bytes_read(entity, os.path.getsize(zipped_input_filepath))
+        return GzipLineStream(zipped_input_filepath, on_wait=lambda seconds: self.instrumentation.add_seconds("read", seconds))
+
+    # Load each line, of a list or a stream of lines, with `load_from_string`, rejecting the lines it fails on.
+    # Returns the (line number, message, rejection reason) of each rejected line.
+    def load_lines(self, entity: str, load_from_string, lines, source: str):
+        rejections = []
+        for line_number, line in enumerate(lines):
+            try:
+                load_from_string(line)
+            except Exception as e:
+                reason = rejection_reason(e)
+                self.rejected_input.reject(entity, source, line_number + 1, line, reason, str(e))
+                self.instrumentation.count_rejected(entity, reason)
+                rejections.append((line_number, str(e), reason))
+        return rejections
 
     def load_erasure_request_from_string(self, erasure_request_json: str):
-        self.erasure_requests.append(ErasureRequest.from_string(erasure_request_json))
-        self.implement_erasure_request(self.erasure_requests[-1])
+        self.load_erasure_request(ErasureRequest.from_string(erasure_request_json))
+
+    def load_erasure_request(self, erasure_request: ErasureRequest):
+        self.erasure_requests.append(erasure_request)
+        self.instrumentation.count_accepted("erasure_requests")
+        if self.defer_erasure_requests:
+            self.pending_erasure_requests.append(erasure_request)
+        else:
+            self.instrumentation.start()
+            self.implement_erasure_request(erasure_request)
+            self.instrumentation.lap("erasure")
 
     def load_erasure_request_from_gzip_file(self, zipped_input_filepath: str):
-        with gzip.open(zipped_input_filepath) as input_file:
-            for line in input_file.readlines():
-                try:
-                    self.load_erasure_request_from_string(line)
-                except Exception as e:
-                    print(e)
-                    self.rejected_input.append(bytes(zipped_input_filepath+": ", 'utf-8')+line)
+        self.load_erasure_requests_from_lines(self.read_gzip_lines("erasure_requests", zipped_input_filepath), zipped_input_filepath)
+
+    def load_erasure_requests_from_data(self, data: bytes, source: str):
+        self.instrumentation.count_bytes_read("erasure_requests", len(data))
+        return self.load_erasure_requests_from_lines(io.BytesIO(data).readlines(), source)
+
+    def load_erasure_requests_from_lines(self, lines, source: str):
+        return self.load_lines("erasure_requests", self.load_erasure_request_from_string, lines, source)
 
     def load_from_file(self, input_path:str):
         if os.path.isfile(input_path):
@@ -110,9 +597,15 @@ class Etl:
             # Select all files in input folder
             unsorted_input_files = list(Path(input_path).glob('**/*.json.gz'))
 
-            # Sort input files by time, with a processing order of customers, products, transactions, and then erasure requests.
-            process_priority = {"customers.json.gz": "priority-1", "products.json.gz": "priority-2", "transactions.json.gz": "priority-3", "erasure-requests.json.gz": "priority-4"}
-            input_filepaths = sorted(unsorted_input_files, key=lambda filepath: '/'.join(filepath.parts[0:-1]) + '/' + process_priority[filepath.parts[-1]])
+            input_filepaths = sorted(unsorted_input_files, key=input_file_sort_key)
+
+        # Skip files already loaded by a previous run.
+        if self.skip_loaded_input_files:
+            input_filepaths = [filepath for filepath in input_filepaths if not self.input_manifest.is_loaded(filepath)]
+
+        if self.decode_workers > 0:
+            self.load_files_in_parallel(input_filepaths)
+            return
 
         # Load each file
         for zipped_input_filepath in input_filepaths:
@@ -125,88 +618,506 @@ class Etl:
                 self.load_transactions_from_gzip_file(str(zipped_input_filepath))
             elif zipped_input_file == "erasure-requests.json.gz":
                 self.load_erasure_request_from_gzip_file(str(zipped_input_filepath))
+            self.record_loaded_input_file(zipped_input_filepath)
+
+    def record_loaded_input_file(self, zipped_input_filepath: Path):
+        self.input_manifest.record(zipped_input_filepath)
+
+    # Decode and validate the files in worker processes, as that only depends on each file's own contents.
+    # The decoded files are then loaded here one at a time, in the same order as the serial path, so the primary key,
+    # foreign key and erasure checks see the rows in the same order, and give the same results.
+    # Only a few files per worker are decoded ahead of the file being loaded, to bound the memory held by decoded files.
+    def load_files_in_parallel(self, input_filepaths: list):
+        with ProcessPoolExecutor(max_workers=self.decode_workers) as executor:
+            decoding_files = deque()
+            for zipped_input_filepath in input_filepaths:
+                if zipped_input_filepath.name == "erasure-requests.json.gz":
+                    # Erasure requests are few and cheap to decode, so are loaded here when their turn comes.
+                    decoding_files.append((zipped_input_filepath, None))
+                else:
+                    vectorized = self.vectorized_ingest and os.path.getsize(zipped_input_filepath) >= MIN_BULK_FILE_SIZE
+                    decoding_files.append((zipped_input_filepath, executor.submit(decode_gzip_file_by_name, str(zipped_input_filepath), vectorized)))
+                if len(decoding_files) >= 4 * self.decode_workers:
+                    self.load_decoding_file(*decoding_files.popleft())
+            while len(decoding_files) > 0:
+                self.load_decoding_file(*decoding_files.popleft())
+
+    def load_decoding_file(self, zipped_input_filepath: Path, decoding):
+        zipped_input_file = zipped_input_filepath.name
+        if zipped_input_file == "customers.json.gz":
+            self.load_decoded_customers(decoding.result())
+        elif zipped_input_file == "products.json.gz":
+            self.load_decoded_products(decoding.result())
+        elif zipped_input_file == "transactions.json.gz":
+            self.load_decoded_transactions(decoding.result())
+        elif zipped_input_file == "erasure-requests.json.gz":
+            self.load_erasure_request_from_gzip_file(str(zipped_input_filepath))
+        self.record_loaded_input_file(zipped_input_filepath)
+
+    # Continue from the output of a previous run, so that only new input files need to be loaded.
+    # The previous rows are reloaded as arrow record batches, and the key indexes are rebuilt from their key columns.
+    # From then on, load_from_file skips the input files recorded in the previous run's manifest, and save() appends
+    # to the previous rejected input file.
+    def load_previous_output(self, output_folder: str):
+        assert self.customer_count() == 0 and self.product_count() == 0 and self.transaction_count() == 0, \
+            "Previous output must be loaded before any other data."
+        assert self.stream_output_folder is None, "Previous output can't be loaded by a streaming Etl."
+
+        self.input_manifest = InputManifest.from_file(os.path.join(output_folder, self.input_manifest_output_filename))
+        self.skip_loaded_input_files = True
+        erased_customer_ids_filepath = os.path.join(output_folder, self.erased_customer_ids_output_filename)
+        if os.path.isfile(erased_customer_ids_filepath):
+            with open(erased_customer_ids_filepath) as erased_customer_ids_file:
+                self.erased_customer_ids = set(json.load(erased_customer_ids_file))
+        self.append_rejected_input = True
+
+        customers = read_previous_output(os.path.join(output_folder, self.customers_output_filename), self.customers.schema)
+        for row, (customer_id, email) in enumerate(zip(customers.column("id").to_pylist(), customers.column("email").to_pylist())):
+            self.customer_id_to_row[customer_id] = row
+            self.customer_email_to_rows.add_row(email, row)
+        self.customers.extend(customers)
+        self.previous_customer_count = customers.num_rows
+
+        products = read_previous_output(os.path.join(output_folder, self.products_output_filename), self.products.schema)
+        self.product_sku_to_row.update((sku, row) for row, sku in enumerate(products.column("sku").to_pylist()))
+        self.products.extend(products)
+        self.previous_product_count = products.num_rows
+
+        self.previous_output_folder = output_folder
+        transactions_folder = os.path.join(output_folder, self.transactions_output_dirname)
+        if os.path.isdir(transactions_folder):
+            transactions = parquet_reader.read_table(transactions_folder, self.transactions.schema, partition_schema=TRANSACTION_PARTITION_SCHEMA)
+        else:
+            transactions = read_previous_output(os.path.join(output_folder, self.transactions_output_filename), self.transactions.schema)
+        self.previous_transaction_count = transactions.num_rows
+        self.transaction_id_to_row.clear()
+        self.transaction_id_to_row.update((transaction_id, row) for row, transaction_id in enumerate(transactions.column("transaction_id").to_pylist()))
+        for row, customer_id in enumerate(transactions.column("customer_id").to_pylist()):
+            self.customer_id_to_transaction_rows.add_row(customer_id, row)
+        self.transactions.extend(transactions)
 
     def implement_erasure_request(self, erasure_request: ErasureRequest):
-        for customer in self.customers:
-            if (
-                (erasure_request.customer_id is not None and customer.id == erasure_request.customer_id) or
-                (erasure_request.email is not None and customer.email == erasure_request.email)
-            ):
-                customer.anonymize()
+        for row in self.erasure_request_rows(erasure_request):
+            self.anonymize_customer(row)
+
+    # Returns the rows of the customers matching the erasure request, in row order.
+    def erasure_request_rows(self, erasure_request: ErasureRequest):
+        # Look up the matching customers via the id and email indexes, rather than scanning every customer.
+        matching_rows = set()
+        if erasure_request.customer_id is not None and erasure_request.customer_id in self.customer_id_to_row:
+            matching_rows.add(self.customer_id_to_row[erasure_request.customer_id])
+        if erasure_request.email is not None:
+            matching_rows.update(self.customer_email_to_rows.get(erasure_request.email, []))
+        return sorted(matching_rows)
+
+    def anonymize_customer(self, row: int):
+        if row < self.flushed_customer_count:
+            # Already written out, so anonymized in the file on save. The rows waiting are counted by stats().
+            self.unanonymized_flushed_customer_rows[row] = self.unanonymized_flushed_customer_rows.get(row, 0) + 1
+            return
+
+        # Anonymizing changes the email, so move the row to its new key in the email index.
+        store_row = row - self.flushed_customer_count
+        customer = Customer(**self.customers.row(store_row))
+        email = customer.email
+        customer.anonymize()
+        for column_name, value in vars(customer).items():
+            self.customers.set(store_row, column_name, value)
+        self.changed_customer_rows.add(row)
+        self.reindex_customer_email(row, email, customer.email)
+        self.erase_customer_transactions(customer.id)
+
+    # Mark the customer as erased, and anonymize the delivery addresses of the transactions loaded for them so far, found
+    # through the customer's transaction index. Transactions loaded later are anonymized as they are loaded.
+    # In streaming mode, the transactions of erased customers are instead anonymized in the output on save, see save().
+    def erase_customer_transactions(self, customer_id: int):
+        if customer_id in self.erased_customer_ids:
+            return
+        self.erased_customer_ids.add(customer_id)
+        if self.stream_output_folder is not None:
+            return
+        for row in self.customer_id_to_transaction_rows.get(customer_id, []):
+            delivery_address = self.transactions.get(row, "delivery_address")
+            self.transactions.set(row, "delivery_address", anonymize_delivery_address(delivery_address))
+            self.anonymized_transaction_rows.append(row)
+
+    # Returns whether transactions of erased customers are to be anonymized as they are loaded, which they are unless
+    # streaming, or no customers are erased.
+    def anonymize_transactions_on_load(self):
+        return self.stream_output_folder is None and len(self.erased_customer_ids) > 0
+
+    # Returns the customer's transactions held in memory, found through the customer's transaction index, or when
+    # streaming, by scanning the transactions not yet written out, which are at most a row group.
+    def customer_transactions(self, customer_id: int):
+        if self.stream_output_folder is None:
+            store_rows = self.customer_id_to_transaction_rows.get(customer_id, [])
+        else:
+            customer_ids = self.transactions.to_table().column("customer_id")
+            store_rows = pc.indices_nonzero(pc.fill_null(pc.equal(customer_ids, customer_id), False)).to_pylist()
+        transactions = []
+        for store_row in store_rows:
+            values = self.transactions.row(store_row)
+            transaction = Transaction(values["transaction_id"], values["customer_id"], delivery_address=values["delivery_address"],
+                                      transaction_time_datetime=values["transaction_time"])
+            transaction.purchases = values["purchases"]
+            transactions.append(transaction)
+        return transactions
+
+    def implement_pending_erasure_requests(self):
+        # Apply all deferred erasure requests in arrival order, in a single pass over the requests.
+        # The rows each request matches are found as if the requests were applied one at a time, with the email index
+        # following the changed emails, then all the rows held are anonymized at once, a column at a time, see
+        # customer.anonymize_customers. A row matched by several requests is anonymized as many times.
+        self.instrumentation.start()
+        anonymize_counts = {}
+        anonymized_emails = {}
+        for erasure_request in self.pending_erasure_requests:
+            for row in self.erasure_request_rows(erasure_request):
+                if row < self.flushed_customer_count:
+                    self.anonymize_customer(row)
+                    continue
+                store_row = row - self.flushed_customer_count
+                email = anonymized_emails.get(row, self.customers.get(store_row, "email"))
+                anonymized_emails[row] = hashlib.md5(email.encode('utf-8')).hexdigest()
+                self.reindex_customer_email(row, email, anonymized_emails[row])
+                self.erase_customer_transactions(self.customers.get(store_row, "id"))
+                anonymize_counts[store_row] = anonymize_counts.get(store_row, 0) + 1
+                self.changed_customer_rows.add(row)
+        self.pending_erasure_requests = []
+
+        for anonymize_count in range(1, max(anonymize_counts.values(), default=0) + 1):
+            mask = np.zeros(len(self.customers), dtype=bool)
+            mask[[store_row for store_row, count in anonymize_counts.items() if count >= anonymize_count]] = True
+            self.customers.map_batches(lambda batch, first_row: self.anonymize_customer_batch(batch, mask[first_row:first_row + batch.num_rows]))
+        self.instrumentation.lap("erasure")
+
+    def anonymize_customer_batch(self, batch: pa.RecordBatch, mask: np.ndarray):
+        if not mask.any():
+            return batch
+        return anonymize_customers(batch, mask, self.anonymize_workers)
+
+    def save_erased_customer_ids(self, erased_customer_ids_filepath: str):
+        # Write to a temporary file then rename it, as the input manifest is written.
+        temporary_filepath = erased_customer_ids_filepath + ".tmp"
+        with open(temporary_filepath, mode='w') as erased_customer_ids_file:
+            json.dump(sorted(self.erased_customer_ids), erased_customer_ids_file)
+        os.replace(temporary_filepath, erased_customer_ids_filepath)
 
     def save_customers(self, customers_filepath: str):
+        self.instrumentation.start()
         if len(self.customers) > 0:
-            customer_headers = list(vars(self.customers[0]).keys())
-            customer_columns = [[vars(customer)[customer_key] for customer in self.customers] for customer_key in customer_headers]
-            customer_table = pa.Table.from_arrays(customer_columns, names=customer_headers)
-            pq.write_table(customer_table, customers_filepath, row_group_size=10000)
+            pq.write_table(self.customers.to_table(), customers_filepath, row_group_size=10000)
         else:
             with open(customers_filepath, mode='w'):
                 pass
+        self.instrumentation.lap("write")
 
     def save_products(self, products_filepath: str):
+        self.instrumentation.start()
         if len(self.products) > 0:
-            product_headers = list(vars(self.products[0]).keys())
-            product_columns = [[vars(product)[product_key] for product in self.products] for product_key in product_headers]
-            product_table = pa.Table.from_arrays(product_columns, names=product_headers)
-            pq.write_table(product_table, products_filepath, row_group_size=10000)
+            pq.write_table(self.products.to_table(), products_filepath, row_group_size=10000)
         else:
             with open(products_filepath, mode='w'):
                 pass
+        self.instrumentation.lap("write")
 
     def save_transactions(self, transactions_filepath: str):
-        if len(self.transactions) > 0:
-            transaction_id = [transaction.transaction_id for transaction in self.transactions]
-            customer_id = [transaction.customer_id for transaction in self.transactions]
-            transaction_time = [transaction.transaction_time for transaction in self.transactions]
-            delivery_address = [transaction.delivery_address for transaction in self.transactions]
-            purchases = [transaction.purchases.to_parquet_data() for transaction in self.transactions]
-
-            transactions_schema = pa.schema(Transaction.parquet_struct())
-
-            data = [
-                pa.array(transaction_id),
-                pa.array(customer_id),
-                pa.array(delivery_address),
-                pa.array(transaction_time),
-                pa.array(purchases, type=Purchases.parquet_struct())
-            ]
-            transaction_headers = list(vars(self.transactions[0]).keys())
-            batch = pa.RecordBatch.from_arrays(data, transaction_headers)
-            transaction_table = pa.Table.from_batches([batch], transactions_schema)
-            pq.write_table(transaction_table, transactions_filepath, row_group_size=10000)
+        self.instrumentation.start()
+        if self.partition_transactions:
+            self.save_transaction_partitions(transactions_filepath)
+        elif len(self.transactions) > 0:
+            pq.write_table(self.transactions.to_table(), transactions_filepath, row_group_size=10000)
         else:
             with open(transactions_filepath, mode='w'):
                 pass
+        self.instrumentation.lap("write")
+
+    # Save the transactions to a folder of partitions. When saving back to the output folder of the previous run, only
+    # the partitions with new transactions are rewritten, and the other partitions are left as they are.
+    def save_transaction_partitions(self, transactions_folder: str):
+        transactions = with_transaction_partitions(self.transactions.to_table())
+        rewrite_all = self.previous_output_folder is None or \
+            os.path.abspath(self.previous_output_folder) != os.path.abspath(os.path.dirname(transactions_folder)) or \
+            not os.path.isdir(transactions_folder)
+        if rewrite_all:
+            shutil.rmtree(transactions_folder, ignore_errors=True)
+            os.makedirs(transactions_folder)
+        else:
+            # Partitions with previous transactions anonymized since are rewritten too.
+            partitions = pc.binary_join_element_wise(transactions.column("date"), transactions.column("hour"), "/")
+            anonymized_rows = [row for row in self.anonymized_transaction_rows if row < self.previous_transaction_count]
+            changed_partitions = pa.concat_arrays([partitions.slice(self.previous_transaction_count).combine_chunks(),
+                                                   partitions.combine_chunks().take(pa.array(anonymized_rows, pa.int64()))])
+            transactions = transactions.filter(pc.is_in(partitions, value_set=pc.unique(changed_partitions)))
+        if transactions.num_rows > 0:
+            write_partitions(transactions, transactions_folder, TRANSACTION_PARTITION_SCHEMA, "part-{i}.parquet",
+                             self.partition_file_rows, replace_partitions=True)
+
+    # In streaming mode, count the input bytes of newly loaded rows, and write the rows out once a row group is buffered.
+    def flush_customers_if_full(self, byte_count: int):
+        if self.customers_output_stream is not None:
+            self.customers_output_stream.add_buffered_bytes(byte_count)
+            if self.customers_output_stream.should_flush(len(self.customers)):
+                self.flush_customers()
+
+    def flush_products_if_full(self, byte_count: int):
+        if self.products_output_stream is not None:
+            self.products_output_stream.add_buffered_bytes(byte_count)
+            if self.products_output_stream.should_flush(len(self.products)):
+                self.flush_products()
+
+    def flush_transactions_if_full(self, byte_count: int):
+        if self.transactions_output_stream is not None:
+            self.transactions_output_stream.add_buffered_bytes(byte_count)
+            if self.transactions_output_stream.should_flush(len(self.transactions)):
+                self.flush_transactions()
+
+    # Write the buffered rows out as a row group of the output stream, and release them from memory.
+    def flush_customers(self):
+        if len(self.customers) > 0:
+            self.instrumentation.start()
+            self.customers_output_stream.write(self.customers.to_table())
+            self.flushed_customer_count += len(self.customers)
+            self.customers.clear()
+            self.instrumentation.lap("write")
+
+    def flush_products(self):
+        if len(self.products) > 0:
+            self.instrumentation.start()
+            self.products_output_stream.write(self.products.to_table())
+            self.flushed_product_count += len(self.products)
+            self.products.clear()
+            self.instrumentation.lap("write")
+
+    def flush_transactions(self):
+        if len(self.transactions) > 0:
+            self.instrumentation.start()
+            self.transactions_output_stream.write(self.transactions.to_table())
+            self.flushed_transaction_count += len(self.transactions)
+            self.transactions.clear()
+            self.instrumentation.lap("write")
 
     def save_rejected_input(self, rejected_input_filepath: str):
-        with open(rejected_input_filepath, mode='wb') as output_file:
-            output_file.writelines(self.rejected_input)
+        details_filepath = os.path.join(os.path.dirname(rejected_input_filepath), self.rejected_input_details_output_filename)
+        self.rejected_input.save(rejected_input_filepath, details_filepath, self.append_rejected_input)
 
-    def save(self, output_folder):
+    # Save the output to a folder, or when streaming, finish saving it to the stream output folder.
+    # Saving back to the folder of the previous output, with `compact` false, only saves the customer and product rows
+    # new or changed since, as change files of the output files, as it does transactions, unless they are partitioned,
+    # see output_changes.py. Otherwise every output file is rewritten in full, and any change files are removed.
+    def save(self, output_folder: str = None, compact: bool = True):
+        if self.stream_output_folder is not None:
+            assert output_folder is None or os.path.abspath(output_folder) == os.path.abspath(self.stream_output_folder), \
+                "A streaming Etl can only save to its stream output folder."
+            output_folder = self.stream_output_folder
         os.makedirs(output_folder, exist_ok=True)
 
         customers_filepath = os.path.join(output_folder, self.customers_output_filename)
         products_filepath = os.path.join(output_folder, self.products_output_filename)
-        transactions_filepath = os.path.join(output_folder, self.transactions_output_filename)
+        if self.partition_transactions:
+            transactions_filepath = os.path.join(output_folder, self.transactions_output_dirname)
+        else:
+            transactions_filepath = os.path.join(output_folder, self.transactions_output_filename)
         rejected_input_filepath = os.path.join(output_folder, self.rejected_input_output_filename)
 
-        self.save_customers(customers_filepath)
-        self.save_products(products_filepath)
-        self.save_transactions(transactions_filepath)
+        self.implement_pending_erasure_requests()
+
+        if self.stream_output_folder is not None:
+            # Write out the remaining buffered rows, and finalize the files.
+            self.flush_customers()
+            self.flush_products()
+            self.flush_transactions()
+            self.customers_output_stream.close()
+            self.products_output_stream.close()
+            self.transactions_output_stream.close()
+            # Rows hit by an erasure request after they were written out are anonymized in the file, see parquet_erasure.py.
+            # So are the delivery addresses of all the transactions of erased customers.
+            self.instrumentation.start()
+            if len(self.unanonymized_flushed_customer_rows) > 0:
+                erased_customer_ids = anonymize_customer_rows(customers_filepath, dict(self.unanonymized_flushed_customer_rows.items()))
+                self.erased_customer_ids.update(erased_customer_ids)
+                self.unanonymized_flushed_customer_rows.clear()
+            if len(self.erased_customer_ids) > 0:
+                erase_transactions(transactions_filepath, self.erased_customer_ids)
+            self.instrumentation.lap("erasure")
+        elif not compact and self.saves_to_previous_output(output_folder, [customers_filepath, products_filepath, transactions_filepath]):
+            self.save_changes(self.customers, customers_filepath, self.previous_customer_count, self.changed_customer_rows)
+            self.save_changes(self.products, products_filepath, self.previous_product_count, self.changed_product_rows)
+            if self.partition_transactions:
+                self.save_transactions(transactions_filepath)
+            else:
+                self.save_changes(self.transactions, transactions_filepath, self.previous_transaction_count, self.anonymized_transaction_rows)
+        else:
+            self.save_customers(customers_filepath)
+            self.save_products(products_filepath)
+            self.save_transactions(transactions_filepath)
+            for output_filepath in [customers_filepath, products_filepath, transactions_filepath]:
+                remove_changes(output_filepath)
+        if self.stream_output_folder is None:
+            # The output folder now holds every row, so saving to it again only saves the rows changed since, as when
+            # continuing from previous output.
+            self.previous_output_folder = output_folder
+            self.previous_customer_count = self.customer_count()
+            self.previous_product_count = self.product_count()
+            self.previous_transaction_count = self.transaction_count()
+            self.changed_customer_rows = set()
+            self.changed_product_rows = set()
+            self.anonymized_transaction_rows = []
         self.save_rejected_input(rejected_input_filepath)
+        if self.instrumentation.enabled:
+            for output_filepath in [customers_filepath, products_filepath, transactions_filepath, rejected_input_filepath,
+                                    os.path.join(output_folder, self.rejected_input_details_output_filename)]:
+                self.instrumentation.count_bytes_written(os.path.basename(output_filepath), output_size(output_filepath))
+
+        for state_store in [self.customer_id_to_row, self.product_sku_to_row, self.customer_email_to_rows,
+                            self.customer_id_to_transaction_rows, self.unanonymized_flushed_customer_rows]:
+            state_store.flush()
+        self.save_erased_customer_ids(os.path.join(output_folder, self.erased_customer_ids_output_filename))
+
+        # The manifest is written last, so if saving is interrupted, the next run loads the same input files again.
+        self.input_manifest.save(os.path.join(output_folder, self.input_manifest_output_filename))
+
+        if self.transaction_id_history is not None:
+            self.transaction_id_history.commit()
+
+    # Returns whether saving to the output folder saves back to the previous output, all of whose files are present.
+    def saves_to_previous_output(self, output_folder: str, output_paths: list):
+        return self.previous_output_folder is not None and \
+            os.path.abspath(self.previous_output_folder) == os.path.abspath(output_folder) and \
+            all(os.path.exists(output_path) for output_path in output_paths)
+
+    # Save the rows of a store which were added or changed since the previous output was saved, as a change file of its
+    # output file.
+    def save_changes(self, store: RecordStore, output_filepath: str, previous_count: int, changed_rows):
+        self.instrumentation.start()
+        rows = sorted(set(row for row in changed_rows if row < previous_count)) + list(range(previous_count, len(store)))
+        if len(rows) > 0:
+            write_changes(output_filepath, store.to_table(), rows)
+        self.instrumentation.lap("write")
+
+    # Write the state of the etl process, its rows, key indexes, and erasure requests and rejected input so far, to a
+    # folder, from which load_snapshot restores it without decoding any input again, see write_ahead_log.py.
+    # Rows and key indexes are written as arrow IPC files, see snapshot.py.
+    def save_snapshot(self, snapshot_folder: str):
+        assert self.stream_output_folder is None, "A streaming Etl has released the rows it wrote, so can't be snapshotted."
+        assert self.transaction_id_history is None, "The transaction id history isn't part of a snapshot."
+        os.makedirs(snapshot_folder, exist_ok=True)
+        for name, store in [("customers", self.customers), ("products", self.products), ("transactions", self.transactions)]:
+            write_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow"), store.to_table())
+        for name, index in [("customer_id_to_row", self.customer_id_to_row), ("product_sku_to_row", self.product_sku_to_row),
+                            ("transaction_id_to_row", self.transaction_id_to_row)]:
+            write_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow"), key_index_table(index))
+        for name, index in [("customer_email_to_rows", self.customer_email_to_rows),
+                            ("customer_id_to_transaction_rows", self.customer_id_to_transaction_rows)]:
+            write_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow"), rows_index_table(index))
+        rejected_input_counts = self.rejected_input.snapshot(
+            os.path.join(snapshot_folder, self.rejected_input_output_filename),
+            os.path.join(snapshot_folder, self.rejected_input_details_output_filename))
+
+        state = {
+            "erasure_requests": [[erasure_request.customer_id, erasure_request.email] for erasure_request in self.erasure_requests],
+            "pending_erasure_requests": [[erasure_request.customer_id, erasure_request.email] for erasure_request in self.pending_erasure_requests],
+            "erased_customer_ids": sorted(self.erased_customer_ids),
+            "rejected_input": rejected_input_counts,
+            "append_rejected_input": self.append_rejected_input,
+            "input_manifest": self.input_manifest.entries,
+            "skip_loaded_input_files": self.skip_loaded_input_files,
+            "previous_output_folder": self.previous_output_folder,
+            "previous_transaction_count": self.previous_transaction_count,
+            "previous_customer_count": self.previous_customer_count,
+            "previous_product_count": self.previous_product_count,
+            "changed_customer_rows": sorted(self.changed_customer_rows),
+            "changed_product_rows": sorted(self.changed_product_rows),
+            "anonymized_transaction_rows": self.anonymized_transaction_rows
+        }
+        with open(os.path.join(snapshot_folder, self.snapshot_state_filename), mode='w') as state_file:
+            json.dump(state, state_file)
+
+    # Restore the state written by save_snapshot, to an Etl created with the same options, before any other data.
+    # The row tables are memory mapped, and kept as the sealed batches of the row stores.
+    def load_snapshot(self, snapshot_folder: str):
+        assert self.customer_count() == 0 and self.product_count() == 0 and self.transaction_count() == 0, \
+            "A snapshot must be loaded before any other data."
+        assert self.stream_output_folder is None, "A snapshot can't be loaded by a streaming Etl."
+        with open(os.path.join(snapshot_folder, self.snapshot_state_filename)) as state_file:
+            state = json.load(state_file)
+
+        for name, store in [("customers", self.customers), ("products", self.products), ("transactions", self.transactions)]:
+            store.extend(read_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow")))
+        for name, index in [("customer_id_to_row", self.customer_id_to_row), ("product_sku_to_row", self.product_sku_to_row),
+                            ("transaction_id_to_row", self.transaction_id_to_row)]:
+            load_key_index(index, read_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow")))
+        for name, index in [("customer_email_to_rows", self.customer_email_to_rows),
+                            ("customer_id_to_transaction_rows", self.customer_id_to_transaction_rows)]:
+            load_rows_index(index, read_arrow_file(os.path.join(snapshot_folder, f"{name}.arrow")))
+        self.rejected_input.restore(
+            os.path.join(snapshot_folder, self.rejected_input_output_filename),
+            os.path.join(snapshot_folder, self.rejected_input_details_output_filename), state["rejected_input"])
+
+        self.erasure_requests = [ErasureRequest(customer_id, email) for customer_id, email in state["erasure_requests"]]
+        self.pending_erasure_requests = [ErasureRequest(customer_id, email) for customer_id, email in state["pending_erasure_requests"]]
+        self.erased_customer_ids = set(state["erased_customer_ids"])
+        self.append_rejected_input = state["append_rejected_input"]
+        self.input_manifest = InputManifest(state["input_manifest"])
+        self.skip_loaded_input_files = state["skip_loaded_input_files"]
+        self.previous_output_folder = state["previous_output_folder"]
+        self.previous_transaction_count = state["previous_transaction_count"]
+        self.previous_customer_count = state["previous_customer_count"]
+        self.previous_product_count = state["previous_product_count"]
+        self.changed_customer_rows = set(state["changed_customer_rows"])
+        self.changed_product_rows = set(state["changed_product_rows"])
+        self.anonymized_transaction_rows = state["anonymized_transaction_rows"]
 
     def customer_count(self):
-        return len(self.customers)
+        return self.flushed_customer_count + len(self.customers)
 
     def product_count(self):
-        return len(self.products)
+        return self.flushed_product_count + len(self.products)
 
     def transaction_count(self):
-        return len(self.transactions)
+        return self.flushed_transaction_count + len(self.transactions)
 
     def erasure_request_count(self):
         return len(self.erasure_requests)
 
     def rejected_input_count(self):
-        return len(self.rejected_input)
+        return self.rejected_input.count
+
+    # A snapshot of the instrumentation counts and timings, the row counts, and the size of each key index.
+    # The stage timings and the accepted, rejected and byte counts are only kept when instrumentation is enabled.
+    def stats(self):
+        stats = self.instrumentation.snapshot()
+        stats["rows"] = {
+            "customers": self.customer_count(),
+            "products": self.product_count(),
+            "transactions": self.transaction_count(),
+            "erasure_requests": self.erasure_request_count(),
+            "rejected_input": self.rejected_input_count(),
+            "flushed_customers_to_anonymize": len(self.unanonymized_flushed_customer_rows)
+        }
+        stats["index_sizes"] = {
+            "customer_id": len(self.customer_id_to_row),
+            "customer_email": len(self.customer_email_to_rows),
+            "product_sku": len(self.product_sku_to_row),
+            "transaction_id": len(self.transaction_id_to_row)
+        }
+        if self.transaction_id_history is not None:
+            stats["index_sizes"]["transaction_id_history"] = len(self.transaction_id_history)
+        return stats
+
+
+# Read a previous output file, as a table with the given schema, with any change files saved since applied, see
+# output_changes.py. An empty file holds no rows.
+def read_previous_output(filepath: str, schema: pa.Schema):
+    if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
+        table = schema.empty_table()
+    else:
+        table = pq.read_table(filepath).cast(schema)
+    return apply_changes(table, filepath, schema)
+
+
+# The size of an output file, or of the files of an output folder.
+def output_size(output_path: str):
+    if os.path.isdir(output_path):
+        return sum(filepath.stat().st_size for filepath in Path(output_path).rglob("*") if filepath.is_file())
+    return os.path.getsize(output_path)
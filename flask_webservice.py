@@ -7,50 +7,172 @@ curl --header "Content-Type: application/json" \
     --request POST \
     --data '{"id": "347984", "first_name": "Georgia", "last_name": "Lewis", "date_of_birth": "2009-09-27", "email": "hollymillar@example.org", "phone_number": "01632 960 972", "address": "Studio 99\nMorley tunnel", "city": "Alana Ville", "country": "United Kingdom", "postcode": "E09 9TW", "last_change": "2020-03-12", "segment": "sports"}' \
      http://localhost:5000/customer
+
+Send many records in one request, as newline delimited json, optionally gzip encoded, with:
+gzip -c customers.json | curl --header "Content-Type: application/x-ndjson" --header "Content-Encoding: gzip" \
+    --request POST --data-binary @- http://localhost:5000/customers
+The response reports whether each record was accepted or rejected.
+
+Requests are parsed and validated on their own threads, then queued for the single thread which loads them into the
+etl process, see ingestion_queue.py. When the queue is full, requests are refused with status 429.
+
+Scrape the etl process's metrics in the prometheus text format with:
+curl http://localhost:5000/metrics
+
+To survive a crash, launch with ETL_WAL_FOLDER=<folder> set. Accepted records are then logged to a write-ahead log in that
+folder before they are acknowledged, with periodic snapshots of the etl state, and on start up the etl state is restored
+from the latest snapshot and the records logged since, see write_ahead_log.py.
+If writing to the log fails, requests are refused with status 503 until the webservice is restarted, and so recovered.
 """
-from flask import Flask, request
-from json import dumps
+from ingestion_queue import IngestionQueue, QueueFull, IngestionStopped
+from write_ahead_log import WriteAheadLog
+from concurrent.futures import TimeoutError
+from bulk_json import decode_customers_data, decode_products_data, decode_transactions_data
+from flask import Flask, request, jsonify
+from erasure_request import ErasureRequest
+from instrumentation import prometheus_text
+from rejection import rejection_reason
+from transaction import Transaction
+from customer import Customer
+from product import Product
 from etl import Etl
+import gzip
+import json
+import io
+import os
 
-etl = Etl()
+# Seconds a request waits for its records to be loaded, before giving up, see submit().
+LOAD_TIMEOUT_SECONDS = 30
+
+etl = Etl(instrument=True)
+write_ahead_log = None
+if os.environ.get("ETL_WAL_FOLDER"):
+    write_ahead_log = WriteAheadLog(os.environ["ETL_WAL_FOLDER"])
+    write_ahead_log.recover(etl)
+ingestion_queue = IngestionQueue(etl, write_ahead_log=write_ahead_log)
+ingestion_queue.start()
 app = Flask(__name__)
 
-@app.route("/customer", methods=['POST'])
-def etl_customer():
-    customer_json = request.json
-    customer_json_string = dumps(customer_json)
+# Queue the work for the writer thread, and respond with the result once it's done.
+# `log_entry` returns the records the result accepted, for the write-ahead log, see IngestionQueue.submit.
+# Should the work still be waiting after LOAD_TIMEOUT_SECONDS, it is taken off the queue, and the request refused with
+# status 503, so the records are only loaded if resent. Work the writer has already taken is still applied, so the
+# request is answered with status 202, without its result.
+def submit(apply, record_count: int, respond, log_entry=None):
+    try:
+        future = ingestion_queue.submit(apply, record_count, log_entry)
+        result = future.result(timeout=LOAD_TIMEOUT_SECONDS)
+    except QueueFull as e:
+        return str(e), 429, {"Retry-After": "1"}
+    except IngestionStopped as e:
+        return str(e), 503
+    except TimeoutError:
+        if ingestion_queue.cancel(future):
+            return "Timed out waiting for the records to be loaded. They were not loaded.", 503
+        return "Timed out waiting for the records to be loaded. They are still being loaded.", 202
+    return respond(result)
+
+# Single record endpoints. Records the etl process rejects respond with status 400.
+def etl_record(entity: str, from_json, load):
+    byte_count = request.content_length or 0
     try:
-        etl.load_customer_from_string(customer_json_string)
-        return "", 200
+        record = from_json(request.json)
     except Exception as e:
+        ingestion_queue.count_rejected(entity, rejection_reason(e))
         return str(e), 400
 
+    def apply(etl: Etl):
+        try:
+            load(etl, record, byte_count)
+            return None
+        except Exception as e:
+            etl.instrumentation.count_rejected(entity, rejection_reason(e))
+            return e
+
+    # The record is logged as a single line of json, as the bulk endpoints take.
+    line = json.dumps(request.json).encode('utf-8') + b"\n"
+    return submit(apply, 1, lambda rejection: ("", 200) if rejection is None else (str(rejection), 400),
+                  lambda rejection: (entity, line) if rejection is None else None)
+
+@app.route("/customer", methods=['POST'])
+def etl_customer():
+    return etl_record("customers", Customer.from_json, lambda etl, customer, byte_count: etl.load_customer(customer, byte_count))
+
 @app.route("/product", methods=['POST'])
 def etl_product():
-    product_json = request.json
-    product_json_string = dumps(product_json)
-    try:
-        etl.load_product_from_string(product_json_string)
-        return "", 200
-    except Exception as e:
-        return str(e), 400
+    return etl_record("products", Product.from_json, lambda etl, product, byte_count: etl.load_product(product, byte_count))
 
 @app.route("/transaction", methods=['POST'])
 def etl_transaction():
-    transaction_json = request.json
-    transaction_json_string = dumps(transaction_json)
-    try:
-        etl.load_transaction_from_string(transaction_json_string)
-        return "", 200
-    except Exception as e:
-        return str(e), 400
+    return etl_record("transactions", Transaction.from_json, lambda etl, transaction, byte_count: etl.load_transaction(transaction, byte_count))
 
 @app.route("/erasure-request", methods=['POST'])
 def etl_erasure_request():
-    erasure_request_json = request.json
-    erasure_request_json_string = dumps(erasure_request_json)
+    return etl_record("erasure_requests", ErasureRequest.from_json, lambda etl, erasure_request, byte_count: etl.load_erasure_request(erasure_request))
+
+# Bulk endpoints, taking newline delimited json records. The body is decoded and validated as it is, without decoding
+# it into python objects first. Responds with the result of each record, by line number.
+def request_data():
+    data = request.get_data()
+    if request.headers.get("Content-Encoding") == "gzip":
+        data = gzip.decompress(data)
+    return data
+
+def bulk_response(line_count: int):
+    def respond(rejections: list):
+        rejected_lines = {line_number: (message, reason) for line_number, message, reason in rejections}
+        results = []
+        for line_number in range(line_count):
+            if line_number in rejected_lines:
+                message, reason = rejected_lines[line_number]
+                results.append({"line": line_number, "status": "rejected", "reason": reason, "error": message})
+            else:
+                results.append({"line": line_number, "status": "accepted"})
+        return jsonify({"accepted": line_count - len(rejected_lines), "rejected": len(rejected_lines), "results": results}), 200
+    return respond
+
+# Returns the (entity, lines) of the lines not rejected, for the write-ahead log, or None if all were.
+def accepted_lines_entry(entity: str, lines: list):
+    def log_entry(rejections: list):
+        rejected_line_numbers = {line_number for line_number, message, reason in rejections}
+        accepted_lines = [line if line.endswith(b"\n") else line + b"\n"
+                          for line_number, line in enumerate(lines) if line_number not in rejected_line_numbers]
+        return (entity, b"".join(accepted_lines)) if len(accepted_lines) > 0 else None
+    return log_entry
+
+def etl_bulk(entity: str, decode_data, load_decoded):
     try:
-        etl.load_erasure_request_from_string(erasure_request_json_string)
-        return "", 200
-    except Exception as e:
+        data = request_data()
+    except (OSError, EOFError) as e:
+        return str(e), 400
+    decoded = decode_data(f"POST {request.path}", data, ingestion_queue.etl.load_data_in_bulk(data))
+    return submit(lambda etl: load_decoded(etl, decoded), len(decoded.lines), bulk_response(len(decoded.lines)),
+                  accepted_lines_entry(entity, decoded.lines))
+
+@app.route("/customers", methods=['POST'])
+def etl_customers():
+    return etl_bulk("customers", decode_customers_data, lambda etl, decoded: etl.load_decoded_customers(decoded))
+
+@app.route("/products", methods=['POST'])
+def etl_products():
+    return etl_bulk("products", decode_products_data, lambda etl, decoded: etl.load_decoded_products(decoded))
+
+@app.route("/transactions", methods=['POST'])
+def etl_transactions():
+    return etl_bulk("transactions", decode_transactions_data, lambda etl, decoded: etl.load_decoded_transactions(decoded))
+
+@app.route("/erasure-requests", methods=['POST'])
+def etl_erasure_requests():
+    # Erasure requests are few and cheap to decode, so are decoded by the writer.
+    try:
+        data = request_data()
+    except (OSError, EOFError) as e:
         return str(e), 400
+    source = f"POST {request.path}"
+    lines = io.BytesIO(data).readlines()
+    return submit(lambda etl: etl.load_erasure_requests_from_data(data, source), len(lines), bulk_response(len(lines)),
+                  accepted_lines_entry("erasure_requests", lines))
+
+@app.route("/metrics", methods=['GET'])
+def etl_metrics():
+    return submit(lambda etl: prometheus_text(etl.stats()), 0, lambda metrics: (metrics, 200, {"Content-Type": "text/plain; version=0.0.4"}))
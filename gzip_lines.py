@@ -0,0 +1,89 @@
+from time import perf_counter
+import threading
+import queue
+import zlib
+import io
+
+# Compressed bytes read from the file at a time.
+CHUNK_BYTES = 256 * 1024
+# Batches of lines decompressed ahead of the reader.
+MAX_PENDING_BATCHES = 8
+
+
+# Streams the lines of a gzip file, as gzip.open(...).readlines() would return them, without holding the whole file.
+# A background thread reads and inflates the file a chunk at a time, and passes each chunk's lines to the reader through
+# a queue of at most `max_pending_batches` batches. zlib releases the GIL while inflating, so the file is decompressed
+# while the reader parses the lines before, and memory stays bounded however large the file is.
+# `on_wait(seconds)` is called with the time the reader spent waiting for each batch.
+# The thread starts when iteration does, and stops at its end, or when the stream is closed. Errors reading the file are
+# raised to the reader.
+class GzipLineStream:
+    def __init__(self, filepath: str, chunk_bytes: int = CHUNK_BYTES, max_pending_batches: int = MAX_PENDING_BATCHES,
+                 on_wait=None):
+        self.filepath = filepath
+        self.chunk_bytes = chunk_bytes
+        self.on_wait = on_wait
+        self.batches = queue.Queue(maxsize=max_pending_batches)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __iter__(self):
+        self.thread = threading.Thread(target=self.inflate, name="gzip-lines", daemon=True)
+        self.thread.start()
+        try:
+            while True:
+                start = perf_counter()
+                batch = self.batches.get()
+                if self.on_wait is not None:
+                    self.on_wait(perf_counter() - start)
+                if batch is END:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield from batch
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def inflate(self):
+        try:
+            with open(self.filepath, mode='rb') as input_file:
+                # Gzip files may hold several members one after another, each inflated by its own decompressor.
+                decompressor = zlib.decompressobj(wbits=31)
+                partial_line = b""
+                for chunk in iter(lambda: input_file.read(self.chunk_bytes), b""):
+                    data = b""
+                    while len(chunk) > 0:
+                        data += decompressor.decompress(chunk)
+                        chunk = decompressor.unused_data
+                        if decompressor.eof and len(chunk) > 0:
+                            decompressor = zlib.decompressobj(wbits=31)
+                    lines = io.BytesIO(partial_line + data).readlines()
+                    partial_line = lines.pop() if len(lines) > 0 and not lines[-1].endswith(b"\n") else b""
+                    if not self.put(lines):
+                        return
+                if not decompressor.eof and input_file.tell() > 0:
+                    raise EOFError(f"Compressed file {self.filepath} ended before the end-of-stream marker was reached")
+                if len(partial_line) > 0:
+                    self.put([partial_line])
+            self.put(END)
+        except Exception as e:
+            self.put(e)
+
+    # Wait for space in the queue, unless the reader has stopped. Returns whether the batch was queued.
+    def put(self, batch):
+        while not self.stopped.is_set():
+            try:
+                self.batches.put(batch, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+END = object()
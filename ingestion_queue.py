@@ -0,0 +1,158 @@
+from concurrent.futures import Future
+from collections import deque
+import threading
+from etl import Etl
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestionStopped(Exception):
+    pass
+
+
+# Gives a single writer thread ownership of an Etl, so records from many request threads can be loaded without
+# corrupting its row stores and key indexes.
+# Request threads parse and validate their records, then submit the work that changes the Etl, as a function of the Etl.
+# The writer applies submitted work in arrival order, taking up to `max_batch_records` records of it at a time.
+# At most `max_pending_records` records may be waiting. Beyond that, submit raises QueueFull rather than queueing
+# without bound, so callers can push back on their clients. A single submission larger than the limit is only
+# accepted when nothing else is waiting.
+# Given a write-ahead log, the records each submission accepts are logged, and the log committed once per batch, before
+# the submissions' results are set, so no record is acknowledged before it is durable. The Etl is snapshotted to the log
+# between batches whenever one is due. See write_ahead_log.py.
+# If logging a batch fails, the Etl holds records the log doesn't, and the log may end in part of an entry, so neither can
+# take more work. The queue stops, failing the batch and all the work waiting with IngestionStopped, and the etl
+# process must be restarted, to recover from the log, which holds exactly the records acknowledged.
+class IngestionQueue:
+    def __init__(self, etl: Etl, max_pending_records: int = 10000, max_batch_records: int = 1000, write_ahead_log=None):
+        self.etl = etl
+        self.max_pending_records = max_pending_records
+        self.max_batch_records = max_batch_records
+        self.write_ahead_log = write_ahead_log
+
+        self.condition = threading.Condition()
+        # (apply, record count, log entry, future) of each submission waiting for the writer.
+        self.pending = deque()
+        self.pending_records = 0
+        # Records rejected by request threads before being submitted, by entity then reason. The writer adds them
+        # to the Etl's instrumentation, which only it may change.
+        self.pending_rejection_counts = {}
+        self.running = False
+        self.writer = None
+        # The exception which stopped the queue, if logging failed.
+        self.failure = None
+
+    def start(self):
+        with self.condition:
+            self.running = True
+        self.writer = threading.Thread(target=self.run, name="etl-writer", daemon=True)
+        self.writer.start()
+
+    # Stop accepting work, and wait for the writer to finish the work already submitted.
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    # Submit a function of the Etl, to be applied by the writer. Returns a future of its result.
+    # Work which loads no records, such as reading the Etl's stats, is never refused for a full queue.
+    # `log_entry` is a function of the result, returning the (entity, newline delimited json) of the records accepted,
+    # or None, for the write-ahead log.
+    def submit(self, apply, record_count: int = 1, log_entry=None):
+        future = Future()
+        with self.condition:
+            if self.failure is not None:
+                raise IngestionStopped(f"The ingestion queue stopped, as the write-ahead log failed: {self.failure}")
+            if not self.running:
+                raise IngestionStopped("The ingestion queue is not running.")
+            if record_count > 0 and self.pending_records > 0 and self.pending_records + record_count > self.max_pending_records:
+                raise QueueFull(f"The ingestion queue is full, with {self.pending_records} records waiting.")
+            self.pending.append((apply, record_count, log_entry, future))
+            self.pending_records += record_count
+            self.condition.notify()
+        return future
+
+    # Take a submission's work off the queue, if the writer hasn't taken it yet. Returns whether it was, and so won't be
+    # applied.
+    def cancel(self, future: Future):
+        with self.condition:
+            for submission in self.pending:
+                if submission[3] is future:
+                    self.pending.remove(submission)
+                    self.pending_records -= submission[1]
+                    future.cancel()
+                    return True
+        return False
+
+    def count_rejected(self, entity: str, reason: str):
+        with self.condition:
+            rejection_counts = self.pending_rejection_counts.setdefault(entity, {})
+            rejection_counts[reason] = rejection_counts.get(reason, 0) + 1
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                batch = [self.pending.popleft()]
+                batch_records = batch[0][1]
+                while len(self.pending) > 0 and batch_records + self.pending[0][1] <= self.max_batch_records:
+                    batch.append(self.pending.popleft())
+                    batch_records += batch[-1][1]
+                self.pending_records -= batch_records
+                rejection_counts = self.pending_rejection_counts
+                self.pending_rejection_counts = {}
+
+            for entity, reasons in rejection_counts.items():
+                for reason, count in reasons.items():
+                    self.etl.instrumentation.count_rejected(entity, reason, count)
+            outcomes = []
+            for apply, record_count, log_entry, future in batch:
+                try:
+                    outcomes.append((apply(self.etl), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+            if self.write_ahead_log is not None:
+                try:
+                    self.log_batch(batch, outcomes)
+                except Exception as e:
+                    self.fail(batch, e)
+                    return
+            for (apply, record_count, log_entry, future), (result, exception) in zip(batch, outcomes):
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+
+            if self.write_ahead_log is not None and self.write_ahead_log.snapshot_due():
+                try:
+                    self.write_ahead_log.snapshot(self.etl)
+                except Exception as e:
+                    print(f"Failed to snapshot the etl process, the write-ahead log keeps growing: {e}")
+
+    # Stop the queue after logging the batch failed, failing the batch and the work waiting behind it.
+    def fail(self, batch: list, failure: Exception):
+        with self.condition:
+            self.failure = failure
+            self.running = False
+            batch = batch + list(self.pending)
+            self.pending.clear()
+            self.pending_records = 0
+        for apply, record_count, log_entry, future in batch:
+            future.set_exception(IngestionStopped(f"The ingestion queue stopped, as the write-ahead log failed: {failure}"))
+
+    # Log the records accepted by a batch, and commit them to the write-ahead log at once.
+    def log_batch(self, batch: list, outcomes: list):
+        for (apply, record_count, log_entry, future), (result, exception) in zip(batch, outcomes):
+            if log_entry is not None and exception is None:
+                entry = log_entry(result)
+                if entry is not None:
+                    self.write_ahead_log.append(*entry)
+        self.write_ahead_log.commit()
@@ -0,0 +1,55 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+
+
+# Records the input files which have already been loaded, so that later runs can skip them.
+# Each file is recorded with its size, modification time and a hash of its content. A file is treated as already
+# loaded if its size and modification time are unchanged, or failing that, if its content hash is unchanged.
+class InputManifest:
+    def __init__(self, entries: dict = None):
+        # Entries by absolute file path.
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def from_file(cls, manifest_filepath: str):
+        if not os.path.isfile(manifest_filepath):
+            return cls()
+        with open(manifest_filepath) as manifest_file:
+            return cls(json.load(manifest_file))
+
+    def save(self, manifest_filepath: str):
+        # Write to a temporary file then rename it, so an interrupted save leaves the previous manifest in place.
+        temporary_filepath = manifest_filepath + ".tmp"
+        with open(temporary_filepath, mode='w') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=2, sort_keys=True)
+        os.replace(temporary_filepath, manifest_filepath)
+
+    def is_loaded(self, input_filepath: Path):
+        entry = self.entries.get(str(Path(input_filepath).absolute()))
+        if entry is None:
+            return False
+        stat = os.stat(input_filepath)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        return entry["sha256"] == file_sha256(input_filepath)
+
+    def record(self, input_filepath: Path):
+        stat = os.stat(input_filepath)
+        self.entries[str(Path(input_filepath).absolute())] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_sha256(input_filepath)
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def file_sha256(filepath: Path):
+    file_hash = hashlib.sha256()
+    with open(filepath, mode='rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
@@ -0,0 +1,99 @@
+from time import perf_counter
+
+
+# Counts and times the work of the etl process, by stage and entity.
+# Stages are timed as laps: start() marks the start of a record or file, and each lap(stage) adds the time since the
+# previous mark to that stage. When disabled, every method returns straight away, so the per-record calls cost next
+# to nothing.
+class Instrumentation:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.lap_start = 0.0
+
+        self.stage_seconds = {}
+        # Rows by entity, and rejected rows by entity then rejection reason, see rejection.py.
+        self.accepted_rows = {}
+        self.rejected_rows = {}
+        # Accepted rows which replaced a row already loaded, in upsert mode, by entity.
+        self.updated_rows = {}
+        # Compressed input bytes read by entity, and bytes written by output file.
+        self.bytes_read = {}
+        self.bytes_written = {}
+
+    def start(self):
+        if self.enabled:
+            self.lap_start = perf_counter()
+
+    def lap(self, stage: str):
+        if self.enabled:
+            now = perf_counter()
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + now - self.lap_start
+            self.lap_start = now
+
+    # Add time measured elsewhere, e.g. by a worker process.
+    def add_seconds(self, stage: str, seconds: float):
+        if self.enabled:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def count_accepted(self, entity: str, row_count: int = 1):
+        if self.enabled:
+            self.accepted_rows[entity] = self.accepted_rows.get(entity, 0) + row_count
+
+    def count_updated(self, entity: str, row_count: int = 1):
+        if self.enabled:
+            self.updated_rows[entity] = self.updated_rows.get(entity, 0) + row_count
+
+    def count_rejected(self, entity: str, reason: str, row_count: int = 1):
+        if self.enabled:
+            rejected_rows = self.rejected_rows.setdefault(entity, {})
+            rejected_rows[reason] = rejected_rows.get(reason, 0) + row_count
+
+    def count_bytes_read(self, entity: str, byte_count: int):
+        if self.enabled:
+            self.bytes_read[entity] = self.bytes_read.get(entity, 0) + byte_count
+
+    def count_bytes_written(self, output_filename: str, byte_count: int):
+        if self.enabled:
+            self.bytes_written[output_filename] = self.bytes_written.get(output_filename, 0) + byte_count
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "stage_seconds": dict(self.stage_seconds),
+            "accepted_rows": dict(self.accepted_rows),
+            "updated_rows": dict(self.updated_rows),
+            "rejected_rows": {entity: dict(reasons) for entity, reasons in self.rejected_rows.items()},
+            "bytes_read": dict(self.bytes_read),
+            "bytes_written": dict(self.bytes_written)
+        }
+
+
+# Formats an Etl.stats() snapshot in the prometheus text exposition format.
+def prometheus_text(stats: dict):
+    lines = []
+
+    def metric(name: str, metric_type: str, help_text: str, samples: list):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    metric("etl_stage_seconds_total", "counter", "Wall time spent in each stage of the etl process.",
+           [({"stage": stage}, seconds) for stage, seconds in sorted(stats["stage_seconds"].items())])
+    metric("etl_rows_accepted_total", "counter", "Input rows accepted, by entity.",
+           [({"entity": entity}, count) for entity, count in sorted(stats["accepted_rows"].items())])
+    metric("etl_rows_updated_total", "counter", "Input rows which replaced a row already loaded, by entity.",
+           [({"entity": entity}, count) for entity, count in sorted(stats["updated_rows"].items())])
+    metric("etl_rows_rejected_total", "counter", "Input rows rejected, by entity and reason.",
+           [({"entity": entity, "reason": reason}, count)
+            for entity, reasons in sorted(stats["rejected_rows"].items()) for reason, count in sorted(reasons.items())])
+    metric("etl_bytes_read_total", "counter", "Compressed input bytes read, by entity.",
+           [({"entity": entity}, count) for entity, count in sorted(stats["bytes_read"].items())])
+    metric("etl_bytes_written_total", "counter", "Output bytes written, by output file.",
+           [({"file": output_filename}, count) for output_filename, count in sorted(stats["bytes_written"].items())])
+    metric("etl_rows", "gauge", "Rows held or written, by entity.",
+           [({"entity": entity}, count) for entity, count in sorted(stats["rows"].items())])
+    metric("etl_index_entries", "gauge", "Entries in each key index.",
+           [({"index": index}, size) for index, size in sorted(stats["index_sizes"].items())])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,259 @@
+from collections.abc import MutableMapping, Mapping
+import pyarrow.compute as pc
+import pyarrow as pa
+import numpy as np
+import hashlib
+
+# Multiplier spreading integer keys over the table, see slots_of.
+MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+MIN_INT64 = -(1 << 63)
+MAX_INT64 = (1 << 63) - 1
+# The table is grown once more than this fraction of its slots are used.
+MAX_LOAD = 2 / 3
+
+
+# Key indexes mapping keys to rows in compact numpy arrays, rather than in a dictionary of boxed python objects.
+# Each is a hash table with linear probing, whose keys are one or two int64 words, held in one array per word beside
+# arrays of the rows and of which slots are used. At up to 2/3 of its slots used, an entry costs at most about 27 bytes
+# for an integer key, against over 100 bytes in a dictionary, and about 40 bytes for a hashed string key, against over
+# 200. Lookups probe a few slots, each in constant time.
+class CompactKeyIndex:
+    def __init__(self, key_word_count: int, capacity: int = 1024):
+        self.key_word_count = key_word_count
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int):
+        self.capacity = capacity
+        self.shift = 64 - (capacity.bit_length() - 1)
+        self.key_words = [np.zeros(capacity, dtype=np.int64) for _ in range(self.key_word_count)]
+        self.rows = np.zeros(capacity, dtype=np.int64)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return sum(words.nbytes for words in self.key_words) + self.rows.nbytes + self.used.nbytes
+
+    # Returns the home slot of each key, given as arrays of its words, from the top bits of its first word mixed by a
+    # multiplier.
+    def slots_of(self, key_words: list):
+        return ((key_words[0].view(np.uint64) * np.uint64(MULTIPLIER)) >> np.uint64(self.shift)).astype(np.int64)
+
+    # Set the rows of the keys, given as arrays of their words, at once. Of any repeated keys, the last row is kept.
+    def set_many(self, key_words: list, rows: np.ndarray):
+        self.reserve(self.count + len(rows))
+        slots = self.slots_of(key_words)
+        pending = np.arange(len(rows))
+        mask = self.capacity - 1
+        while len(pending) > 0:
+            pending_slots = slots[pending]
+            used = self.used[pending_slots]
+            equal = used & self.keys_equal(pending_slots, key_words, pending)
+            self.rows[pending_slots[equal]] = rows[pending[equal]]
+
+            # Of the keys whose slot is free, the first takes it, and the others compare against it in the next round.
+            free = np.flatnonzero(~used)
+            claimed_slots, first = np.unique(pending_slots[free], return_index=True)
+            claiming = pending[free[first]]
+            for word_index in range(self.key_word_count):
+                self.key_words[word_index][claimed_slots] = key_words[word_index][claiming]
+            self.rows[claimed_slots] = rows[claiming]
+            self.used[claimed_slots] = True
+            self.count += len(claiming)
+
+            done = equal.copy()
+            done[free[first]] = True
+            probing = used & ~equal
+            slots[pending[probing]] = (pending_slots[probing] + 1) & mask
+            pending = pending[~done]
+
+    # Returns whether each key, given as arrays of its words, is present, and its row, or -1 if it isn't.
+    def get_many(self, key_words: list):
+        slots = self.slots_of(key_words)
+        found = np.zeros(len(slots), dtype=bool)
+        rows = np.full(len(slots), -1, dtype=np.int64)
+        pending = np.arange(len(slots))
+        mask = self.capacity - 1
+        while len(pending) > 0:
+            pending_slots = slots[pending]
+            used = self.used[pending_slots]
+            equal = used & self.keys_equal(pending_slots, key_words, pending)
+            found[pending[equal]] = True
+            rows[pending[equal]] = self.rows[pending_slots[equal]]
+            probing = used & ~equal
+            slots[pending[probing]] = (pending_slots[probing] + 1) & mask
+            pending = pending[probing]
+        return found, rows
+
+    def keys_equal(self, slots: np.ndarray, key_words: list, indices: np.ndarray):
+        equal = self.key_words[0][slots] == key_words[0][indices]
+        for word_index in range(1, self.key_word_count):
+            equal &= self.key_words[word_index][slots] == key_words[word_index][indices]
+        return equal
+
+    # Grow the table to hold `count` keys within the maximum load.
+    def reserve(self, count: int):
+        if count <= self.capacity * MAX_LOAD:
+            return
+        capacity = self.capacity
+        while count > capacity * MAX_LOAD:
+            capacity *= 2
+        used = self.used
+        key_words = [words[used] for words in self.key_words]
+        rows = self.rows[used]
+        self.allocate(capacity)
+        self.set_many(key_words, rows)
+
+    # Returns the slot of the key, given as its words, and whether it is present there, or else the free slot it would
+    # take.
+    def find(self, key_words: tuple):
+        first_word = key_words[0]
+        slot = ((first_word * MULTIPLIER) & MASK64) >> self.shift
+        used = self.used
+        first_words = self.key_words[0]
+        mask = self.capacity - 1
+        while used[slot]:
+            if first_words[slot] == first_word and all(
+                    self.key_words[word_index][slot] == key_words[word_index] for word_index in range(1, self.key_word_count)):
+                return slot, True
+            slot = (slot + 1) & mask
+        return slot, False
+
+    def get_row(self, key_words: tuple):
+        slot, found = self.find(key_words)
+        if not found:
+            raise KeyError(key_words)
+        return int(self.rows[slot])
+
+    def set_row(self, key_words: tuple, row: int):
+        slot, found = self.find(key_words)
+        if not found:
+            if self.count + 1 > self.capacity * MAX_LOAD:
+                self.reserve(self.count + 1)
+                slot, found = self.find(key_words)
+            for word_index in range(self.key_word_count):
+                self.key_words[word_index][slot] = key_words[word_index]
+            self.used[slot] = True
+            self.count += 1
+        self.rows[slot] = row
+
+    # Remove the key, moving back any later keys in its probe sequence, so that lookups needn't skip deleted slots.
+    def delete(self, key_words: tuple):
+        slot, found = self.find(key_words)
+        if not found:
+            raise KeyError(key_words)
+        mask = self.capacity - 1
+        next_slot = slot
+        while True:
+            next_slot = (next_slot + 1) & mask
+            if not self.used[next_slot]:
+                break
+            home = ((int(self.key_words[0][next_slot]) * MULTIPLIER) & MASK64) >> self.shift
+            # The key can move back to the free slot if its home slot isn't cyclically between the two.
+            if (next_slot - home) & mask >= (next_slot - slot) & mask:
+                for words in self.key_words:
+                    words[slot] = words[next_slot]
+                self.rows[slot] = self.rows[next_slot]
+                slot = next_slot
+        self.used[slot] = False
+        self.count -= 1
+
+    def clear(self):
+        self.allocate(1024)
+
+    # Set the rows of many keys at once, given as pairs of key and row.
+    def update(self, pairs=()):
+        if isinstance(pairs, Mapping):
+            pairs = pairs.items()
+        key_words = []
+        rows = []
+        for key, row in pairs:
+            key_words.append(self.key_words_of(key))
+            rows.append(row)
+        word_arrays = [np.array([words[word_index] for words in key_words], dtype=np.int64) for word_index in range(self.key_word_count)]
+        self.set_many(word_arrays, np.array(rows, dtype=np.int64))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Maps int64 keys, eg customer ids and product skus, to rows. A state store, see state_store.py.
+class Int64KeyIndex(CompactKeyIndex, MutableMapping):
+    def __init__(self, capacity: int = 1024):
+        super().__init__(1, capacity)
+
+    def __contains__(self, key):
+        return is_int64(key) and self.find((int(key),))[1]
+
+    def __getitem__(self, key):
+        if not is_int64(key):
+            raise KeyError(key)
+        return self.get_row((int(key),))
+
+    def __setitem__(self, key, row):
+        self.set_row(self.key_words_of(key), row)
+
+    def __delitem__(self, key):
+        if not is_int64(key):
+            raise KeyError(key)
+        self.delete((int(key),))
+
+    def key_words_of(self, key):
+        if not is_int64(key):
+            raise ValueError(f"Key {key} is not a 64 bit integer.")
+        return (int(key),)
+
+    def __iter__(self):
+        for key in self.key_words[0][self.used].tolist():
+            yield key
+
+    def contains_keys(self, keys: pa.Array):
+        key_array = pc.fill_null(keys.cast(pa.int64()), 0).to_numpy(zero_copy_only=False)
+        found, rows = self.get_many([key_array])
+        return pc.and_(pa.array(found), pc.is_valid(keys))
+
+    update = CompactKeyIndex.update
+
+
+# Maps string keys, eg transaction ids, to rows, holding each key as a fixed width 128 bit hash of it, in two int64
+# words. Distinct keys are taken to have distinct hashes, which for a billion keys fails with a chance of about 1 in
+# 10^20. As the keys themselves aren't kept, they can't be iterated over.
+class HashedStringKeyIndex(CompactKeyIndex):
+    def __init__(self, capacity: int = 1024):
+        super().__init__(2, capacity)
+
+    def __contains__(self, key):
+        return self.find(string_key_words(key))[1]
+
+    def __getitem__(self, key):
+        return self.get_row(string_key_words(key))
+
+    def __setitem__(self, key, row):
+        self.set_row(string_key_words(key), row)
+
+    def __delitem__(self, key):
+        self.delete(string_key_words(key))
+
+    def get(self, key, default=None):
+        slot, found = self.find(string_key_words(key))
+        return int(self.rows[slot]) if found else default
+
+    def key_words_of(self, key):
+        return string_key_words(key)
+
+
+def is_int64(key):
+    return isinstance(key, (int, np.integer)) and not isinstance(key, bool) and MIN_INT64 <= key <= MAX_INT64
+
+
+# Returns the 128 bit hash of a string key, as two int64 words. Keys of other types are hashed as their string.
+def string_key_words(key):
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little', signed=True), int.from_bytes(digest[8:], 'little', signed=True)
@@ -0,0 +1,81 @@
+from etl import INPUT_FILE_PRIORITY, input_file_sort_key
+from pathlib import Path
+import time
+import os
+
+
+# Finds the input files added to a landing folder, eg its `date=2020-01-01/hour=00` folders, by polling it.
+# Listing the whole tree on every poll would cost a listing per folder, so each folder's listing is cached with its
+# modification time, which changes whenever an entry is added to, removed from or renamed in it. A poll then stats each
+# folder, and only lists those which changed. A folder modified within `racy_seconds` of being listed is listed again
+# on the next poll, as a file added in the same clock tick as the listing leaves its modification time unchanged.
+# New files are only returned once they are `settle_seconds` old, so that a file still being written isn't read. Files
+# written elsewhere and moved into the landing folder are returned on the poll after they appear.
+class LandingFolderWatcher:
+    def __init__(self, landing_folder: str, settle_seconds: float = 1.0, racy_seconds: float = 2.0):
+        self.landing_folder = landing_folder
+        self.settle_seconds = settle_seconds
+        self.racy_seconds = racy_seconds
+
+        # Cached listings by folder path, as its modification time, whether it may have changed since it was listed,
+        # and its subfolders and input file names.
+        self.listings = {}
+        # Input files found but not yet returned, as they aren't settled yet, and those returned.
+        self.pending_filepaths = set()
+        self.returned_filepaths = set()
+        # Folders listed, over all polls.
+        self.listing_count = 0
+
+    # Returns the input files added since the last poll, in the order load_from_file processes them.
+    def poll(self):
+        visited_folders = set()
+        self.scan(self.landing_folder, visited_folders)
+        for folder in set(self.listings) - visited_folders:
+            del self.listings[folder]
+
+        now = time.time()
+        settled_filepaths = []
+        for filepath in list(self.pending_filepaths):
+            try:
+                modified_time = os.stat(filepath).st_mtime
+            except FileNotFoundError:
+                self.pending_filepaths.discard(filepath)
+                continue
+            if now - modified_time >= self.settle_seconds:
+                self.pending_filepaths.discard(filepath)
+                self.returned_filepaths.add(filepath)
+                settled_filepaths.append(Path(filepath))
+        return sorted(settled_filepaths, key=input_file_sort_key)
+
+    def scan(self, folder: str, visited_folders: set):
+        try:
+            modified_time_ns = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            return
+        visited_folders.add(folder)
+        listing = self.listings.get(folder)
+        if listing is None or listing[0] != modified_time_ns or listing[1]:
+            listing = self.list_folder(folder, modified_time_ns)
+        modified_time_ns, racy, subfolders, filenames = listing
+        for filename in filenames:
+            filepath = os.path.join(folder, filename)
+            if filepath not in self.returned_filepaths:
+                self.pending_filepaths.add(filepath)
+        for subfolder in subfolders:
+            self.scan(subfolder, visited_folders)
+
+    def list_folder(self, folder: str, modified_time_ns: int):
+        listed_time_ns = time.time_ns()
+        subfolders = []
+        filenames = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                elif entry.name in INPUT_FILE_PRIORITY:
+                    filenames.append(entry.name)
+        racy = modified_time_ns > listed_time_ns - int(self.racy_seconds * 1e9)
+        listing = (modified_time_ns, racy, sorted(subfolders), sorted(filenames))
+        self.listings[folder] = listing
+        self.listing_count += 1
+        return listing
@@ -0,0 +1,104 @@
+from decimal import Decimal, InvalidOperation
+import pyarrow.compute as pc
+import numpy as np
+import pyarrow as pa
+
+
+# Money is held as an integer count of its smallest unit at a fixed scale, eg 16.99 at a scale of 2 as 1699 cents,
+# rather than as a Decimal object per value. Sums and comparisons are then exact integer arithmetic, and a column of
+# values is sealed into a decimal128 array straight from an int64 buffer.
+
+# Purchases are in cents. Some input prices carry a third decimal place, so product prices are in thousandths.
+PURCHASE_SCALE = 2
+PRODUCT_PRICE_SCALE = 3
+
+# The decimal128 columns money is saved to hold up to 12 digits.
+MONEY_PRECISION = 12
+
+
+# Returns the value as an integer count of units at the given scale.
+# Accepts the values json input holds, strings and numbers, and Decimals, as read back from parquet. Integers are whole
+# amounts, eg 25 is 25.00. Values with nonzero digits beyond the scale are refused, rather than rounded.
+def parse_money(value, scale: int = PURCHASE_SCALE):
+    if isinstance(value, bool):
+        raise ValueError(f"Money amount {value} is not a number.")
+    if isinstance(value, int):
+        units = value * 10 ** scale
+    elif isinstance(value, str) and value.isascii():
+        units = parse_money_string(value, scale)
+    elif isinstance(value, (str, float, Decimal)):
+        # Floats are read by their shortest repr, eg 16.99, rather than their exact binary value.
+        units = parse_money_decimal(value if isinstance(value, Decimal) else Decimal(str(value)), scale)
+    else:
+        raise ValueError(f"Money amount {value} is not a number.")
+    if abs(units) >= 10 ** MONEY_PRECISION:
+        raise ValueError(f"Money amount {value} has more than {MONEY_PRECISION} digits.")
+    return units
+
+
+# Parses the plain decimal strings money is normally given as, eg "16.99" or "-3", without building a Decimal.
+def parse_money_string(value: str, scale: int):
+    digits = value.strip()
+    sign = 1
+    if digits[:1] in ("-", "+"):
+        sign = -1 if digits[0] == "-" else 1
+        digits = digits[1:]
+    whole, point, fraction = digits.partition(".")
+    if not (whole + fraction).isdigit() or "_" in digits:
+        # Anything else, eg exponents, is left to Decimal.
+        try:
+            return parse_money_decimal(Decimal(value), scale)
+        except InvalidOperation:
+            raise ValueError(f"Money amount {value} is not a number.")
+    if len(fraction) > scale:
+        if fraction[scale:].strip("0") != "":
+            raise ValueError(f"Money amount {value} has more than {scale} decimal places.")
+        fraction = fraction[:scale]
+    return sign * int((whole or "0") + fraction.ljust(scale, "0"))
+
+
+def parse_money_decimal(value: Decimal, scale: int):
+    if not value.is_finite():
+        raise ValueError(f"Money amount {value} is not a number.")
+    units = value.scaleb(scale)
+    if units != units.to_integral_value():
+        raise ValueError(f"Money amount {value} has more than {scale} decimal places.")
+    return int(units)
+
+
+# Returns the integer units as a Decimal, eg 1699 at a scale of 2 as Decimal("16.99").
+def money_to_decimal(units: int, scale: int = PURCHASE_SCALE):
+    return Decimal(units).scaleb(-scale)
+
+
+# Returns a decimal128 array of the integer units, which must already be at the type's scale.
+# Each decimal128 value is a little-endian 128 bit integer, so its low word is the unit count and its high word the
+# sign extension of it.
+def money_array(units, decimal_type: pa.Decimal128Type):
+    low_words = np.asarray(units, dtype=np.int64)
+    words = np.empty(2 * len(low_words), dtype=np.int64)
+    words[0::2] = low_words
+    words[1::2] = low_words >> 63
+    return pa.Array.from_buffers(decimal_type, len(low_words), [None, pa.py_buffer(words)])
+
+
+# Returns the unscaled integer values of a decimal128 array, eg 12.34 as 1234 at a scale of 2.
+# Decimals of up to 18 digits fit in the low 64 bits of each little-endian 128 bit value. Null values are returned as 0.
+def decimal_to_unscaled_int64(array: pa.Array):
+    array = pc.fill_null(array, pa.scalar(Decimal(0), array.type))
+    return np.frombuffer(array.buffers()[1], dtype=np.int64)[2 * array.offset:2 * (array.offset + len(array)):2]
+
+
+# Converts a money column of a RecordStore between the integer units rows hold and its decimal128 array.
+class MoneyColumn:
+    def __init__(self, decimal_type: pa.Decimal128Type):
+        self.type = decimal_type
+
+    def new_column(self):
+        return []
+
+    def to_arrow(self, values: list):
+        return money_array(values, self.type)
+
+    def to_python(self, array: pa.Array):
+        return decimal_to_unscaled_int64(array).tolist()
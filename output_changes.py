@@ -0,0 +1,60 @@
+import pyarrow.parquet as pq
+import pyarrow as pa
+from pathlib import Path
+import numpy as np
+import shutil
+import os
+
+# A customers or products output file may be followed by change files, in a `<file>.changes` folder, saved by
+# Etl.save(compact=False) so that a save doesn't rewrite every row. Each change file holds rows that replace rows of
+# the output, or follow them, with their row numbers in a `row` column. They apply in the order of their numbers, and
+# applying one again leaves the same rows, so a save interrupted after writing the output file, but before removing the
+# change files it holds, leaves the output as it was.
+# A full save, a compaction, rewrites the output file and removes its change files. Until then, readers apply them to
+# the rows of the file, see parquet_reader.py.
+
+CHANGES_SUFFIX = ".changes"
+ROW_COLUMN = "row"
+
+
+def changes_folder(filepath: str):
+    return filepath + CHANGES_SUFFIX
+
+
+def change_filepaths(filepath: str):
+    folder = changes_folder(filepath)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(str(change_filepath) for change_filepath in Path(folder).glob("*.parquet"))
+
+
+def has_changes(filepath: str):
+    return len(change_filepaths(filepath)) > 0
+
+
+# Save the rows of a table at the given row numbers as the next change file of an output file.
+def write_changes(filepath: str, table: pa.Table, rows: list):
+    folder = changes_folder(filepath)
+    os.makedirs(folder, exist_ok=True)
+    number = len(change_filepaths(filepath))
+    changes = table.take(pa.array(rows, pa.int64())).append_column(ROW_COLUMN, pa.array(rows, pa.int64()))
+    pq.write_table(changes, os.path.join(folder, f"changes-{number:012d}.parquet"), row_group_size=10000)
+
+
+# Returns the rows of an output file, a table of `schema`, with its change files applied.
+def apply_changes(table: pa.Table, filepath: str, schema: pa.Schema):
+    for change_filepath in change_filepaths(filepath):
+        changes = pq.read_table(change_filepath)
+        rows = changes.column(ROW_COLUMN).to_numpy()
+        row_count = max(table.num_rows, int(rows.max()) + 1)
+        # Take each row from the table, unless the changes replace it, or it follows the table's rows.
+        indices = np.arange(row_count)
+        indices[table.num_rows:] = -1
+        indices[rows] = table.num_rows + np.arange(len(rows))
+        assert (indices >= 0).all(), f"The change file {change_filepath} leaves rows missing."
+        table = pa.concat_tables([table, changes.drop_columns([ROW_COLUMN]).cast(schema)]).take(pa.array(indices))
+    return table
+
+
+def remove_changes(filepath: str):
+    shutil.rmtree(changes_folder(filepath), ignore_errors=True)
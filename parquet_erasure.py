@@ -0,0 +1,189 @@
+from erasure_request import ErasureRequest
+from output_changes import change_filepaths
+from transaction import anonymize_transactions
+from customer import anonymize_customers
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
+from pathlib import Path
+import pyarrow as pa
+import numpy as np
+import argparse
+import gzip
+import os
+
+
+# Applies erasure requests to customers already written to parquet, without loading or rewriting the whole output, and
+# to the delivery addresses of their transactions.
+# The min and max statistics of each row group's id and email columns rule out the row groups no request can match,
+# without reading them, as do those of the customer_id column of transactions. Only the row groups which do match are
+# decoded and anonymized, as Customer.anonymize and Transaction.anonymize do, and only the files holding them are
+# rewritten, to a temporary file swapped in place of the original, so readers see either the old file or the new one.
+# The statistics only rule out row groups whose values don't span the requested ones, so pruning works best on output
+# clustered by id or email. Parquet bloom filters would rule out more, but pyarrow doesn't read them.
+# The change files saved since an output file was last compacted are erased along with it, see output_changes.py.
+
+
+# Anonymize the customers matching any of the erasure requests, in a customers parquet file, or a folder of them.
+# A customer's rows may be spread over an output file and its change files, so the customers matching an email in any
+# file are found first, then all the rows of their ids are anonymized, in every file.
+# Returns the ids of the customers anonymized.
+def erase_customers(path: str, erasure_requests: list):
+    customer_ids = [erasure_request.customer_id for erasure_request in erasure_requests if erasure_request.customer_id is not None]
+    emails = [erasure_request.email for erasure_request in erasure_requests if erasure_request.email is not None]
+    filepaths = parquet_filepaths(path)
+    customer_ids += email_customer_ids(filepaths, emails)
+    anonymized_ids = []
+    for filepath in filepaths:
+        parquet_file = pq.ParquetFile(filepath)
+        row_group_masks = {}
+        for row_group in candidate_row_groups(parquet_file, customer_ids, []):
+            table = parquet_file.read_row_group(row_group, columns=["id"])
+            mask = pc.is_in(table.column("id"), value_set=pa.array(customer_ids, pa.int64()))
+            mask = pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+            if mask.any():
+                row_group_masks[row_group] = mask
+        anonymized_ids += masked_values(parquet_file, row_group_masks, "id")
+        anonymize_row_groups(filepath, parquet_file, row_group_masks, anonymize_customers)
+    return list(dict.fromkeys(anonymized_ids))
+
+
+# Returns the ids of the customers with any of the emails, in any of the customers parquet files.
+def email_customer_ids(filepaths: list, emails: list):
+    customer_ids = []
+    for filepath in filepaths:
+        parquet_file = pq.ParquetFile(filepath)
+        for row_group in candidate_row_groups(parquet_file, [], emails):
+            table = parquet_file.read_row_group(row_group, columns=["id", "email"])
+            mask = pc.fill_null(pc.is_in(table.column("email"), value_set=pa.array(emails, pa.string())), False)
+            customer_ids += pc.filter(table.column("id"), mask).to_pylist()
+    return customer_ids
+
+
+# Anonymize the delivery addresses of the transactions of the customers, in a transactions parquet file, or a folder of
+# them, eg a partitioned dataset.
+# Returns the number of transactions anonymized.
+def erase_transactions(path: str, customer_ids):
+    customer_ids = list(customer_ids)
+    anonymized_count = 0
+    for filepath in parquet_filepaths(path):
+        parquet_file = pq.ParquetFile(filepath)
+        customer_id_index = parquet_file.schema_arrow.get_field_index("customer_id")
+        row_group_masks = {}
+        for row_group in range(parquet_file.num_row_groups):
+            if may_contain(parquet_file.metadata.row_group(row_group).column(customer_id_index).statistics, customer_ids):
+                table = parquet_file.read_row_group(row_group, columns=["customer_id"])
+                mask = pc.is_in(table.column("customer_id"), value_set=pa.array(customer_ids, pa.int64()))
+                mask = pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+                if mask.any():
+                    row_group_masks[row_group] = mask
+        anonymized_count += anonymize_row_groups(filepath, parquet_file, row_group_masks, anonymize_transactions)
+    return anonymized_count
+
+
+# Anonymize the customers at the given rows of a customers parquet file, eg rows written out by a streaming Etl before
+# an erasure request for them arrived. `row_counts` maps each row to the number of requests that matched it, and a row is
+# anonymized as many times, as Etl anonymizes the rows it holds.
+# Returns the ids of the customers anonymized.
+def anonymize_customer_rows(filepath: str, row_counts: dict):
+    parquet_file = pq.ParquetFile(filepath)
+    row_group_counts = {}
+    first_row = 0
+    rows = np.fromiter(row_counts.keys(), dtype=np.int64, count=len(row_counts))
+    counts = np.fromiter(row_counts.values(), dtype=np.int64, count=len(row_counts))
+    for row_group in range(parquet_file.num_row_groups):
+        row_count = parquet_file.metadata.row_group(row_group).num_rows
+        in_group = (rows >= first_row) & (rows < first_row + row_count)
+        if in_group.any():
+            group_counts = np.zeros(row_count, dtype=np.int64)
+            group_counts[rows[in_group] - first_row] = counts[in_group]
+            row_group_counts[row_group] = group_counts
+        first_row += row_count
+    anonymized_ids = masked_values(parquet_file, {row_group: group_counts > 0 for row_group, group_counts in row_group_counts.items()}, "id")
+    anonymize_row_groups(filepath, parquet_file, row_group_counts, anonymize_customers_repeatedly)
+    return anonymized_ids
+
+
+# Anonymize each customer of the table as many times as its count.
+def anonymize_customers_repeatedly(customers: pa.Table, counts: np.ndarray):
+    for count in range(1, int(counts.max()) + 1):
+        customers = anonymize_customers(customers, counts >= count)
+    return customers
+
+
+# Returns the parquet files of an output file, itself and its change files, or of a folder. Empty output files, which hold
+# no rows, are left out.
+def parquet_filepaths(path: str):
+    if os.path.isdir(path):
+        filepaths = sorted(str(filepath) for filepath in Path(path).rglob("*.parquet"))
+    else:
+        filepaths = [path] + change_filepaths(path)
+    return [filepath for filepath in filepaths if os.path.getsize(filepath) > 0]
+
+
+# Returns the row groups whose id or email statistics could hold one of the ids or emails.
+# Row groups without statistics for a column can't be ruled out by it.
+def candidate_row_groups(parquet_file: pq.ParquetFile, customer_ids: list, emails: list):
+    column_indexes = {name: parquet_file.schema_arrow.get_field_index(name) for name in ["id", "email"]}
+    candidates = []
+    for row_group in range(parquet_file.num_row_groups):
+        metadata = parquet_file.metadata.row_group(row_group)
+        if any(may_contain(metadata.column(column_indexes[name]).statistics, values)
+               for name, values in [("id", customer_ids), ("email", emails)]):
+            candidates.append(row_group)
+    return candidates
+
+
+def may_contain(statistics, values: list):
+    if len(values) == 0:
+        return False
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return any(statistics.min <= value <= statistics.max for value in values)
+
+
+# Returns the values of the column at the masked rows of each row group.
+def masked_values(parquet_file: pq.ParquetFile, row_group_masks: dict, column_name: str):
+    values = []
+    for row_group, mask in sorted(row_group_masks.items()):
+        column = parquet_file.read_row_group(row_group, columns=[column_name]).column(column_name)
+        values += pc.filter(column, pa.array(mask)).to_pylist()
+    return values
+
+
+# Rewrite the file with the masked rows of each row group anonymized by anonymize(table, mask), keeping its row groups,
+# and swap it in place of the file. Row groups without masked rows are copied as arrow data, without converting their
+# rows. A mask may also hold counts, for anonymize to use, with the rows of non-zero counts masked.
+# Returns the number of rows anonymized.
+def anonymize_row_groups(filepath: str, parquet_file: pq.ParquetFile, row_group_masks: dict, anonymize):
+    if len(row_group_masks) == 0:
+        return 0
+    temporary_filepath = filepath + ".tmp"
+    with pq.ParquetWriter(temporary_filepath, parquet_file.schema_arrow) as writer:
+        for row_group in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(row_group)
+            if row_group in row_group_masks:
+                table = anonymize(table, row_group_masks[row_group])
+            writer.write_table(table, row_group_size=max(table.num_rows, 1))
+    parquet_file.close()
+    os.replace(temporary_filepath, filepath)
+    return sum(int(np.count_nonzero(mask)) for mask in row_group_masks.values())
+
+
+def read_erasure_requests(filepath: str):
+    open_file = gzip.open if filepath.endswith(".gz") else open
+    with open_file(filepath, mode='rt') as input_file:
+        return [ErasureRequest.from_string(line) for line in input_file if line.strip() != ""]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply erasure requests to customers already saved to parquet.")
+    parser.add_argument("customers_path", help="A customers parquet file, or a folder of them.")
+    parser.add_argument("erasure_requests", nargs="+", help="Files of erasure requests, one json object per line, optionally gzipped.")
+    parser.add_argument("--transactions", help="A transactions parquet file, or folder, whose delivery addresses of the erased customers to anonymize.")
+    args = parser.parse_args()
+
+    erasure_requests = [erasure_request for filepath in args.erasure_requests for erasure_request in read_erasure_requests(filepath)]
+    erased_customer_ids = erase_customers(args.customers_path, erasure_requests)
+    print(f"Anonymized {len(erased_customer_ids):,} customers.")
+    if args.transactions:
+        print(f"Anonymized {erase_transactions(args.transactions, set(erased_customer_ids)):,} transactions.")
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+import pyarrow as pa
+import shutil
+import os
+
+
+# Keeps one parquet file open for writing, so rows can be written out a row group at a time and released from memory.
+# The caller buffers rows, and flushes them whenever `should_flush` reports a row group's worth of data is buffered.
+class ParquetOutputStream:
+    def __init__(self, filepath: str, schema: pa.Schema, row_group_rows: int = 10000, row_group_bytes: int = 64 * 1024 * 1024):
+        self.filepath = filepath
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        self.row_group_bytes = row_group_bytes
+
+        # The writer is opened on the first flush, so an output with no rows is left as an empty file, matching Etl.save.
+        self.writer = None
+        self.buffered_bytes = 0
+        self.flushed_rows = 0
+
+    def add_buffered_bytes(self, byte_count: int):
+        self.buffered_bytes += byte_count
+
+    def should_flush(self, buffered_rows: int):
+        return buffered_rows >= self.row_group_rows or self.buffered_bytes >= self.row_group_bytes
+
+    def write(self, table: pa.Table):
+        if table.num_rows > 0:
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.filepath, self.schema)
+            self.writer.write_table(table, row_group_size=self.row_group_rows)
+            self.flushed_rows += table.num_rows
+        self.buffered_bytes = 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        else:
+            with open(self.filepath, mode='w'):
+                pass
+
+
+# Writes rows out as a hive partitioned dataset in a folder, eg `date=2020-01-01/hour=00/part-0.parquet`, buffered as
+# for ParquetOutputStream. `add_partition_columns(table)` returns the table with the columns of `partition_schema`
+# added. Each partition keeps a file open, which each write adds a row group of the partition's rows to, until it
+# holds `file_rows` rows, when the partition moves on to a new file.
+# At most `max_open_files` files are kept open, as each holds a file descriptor and write buffers. Opening another closes
+# the least recently written, and that partition moves on to a new file when it is next written to. Input arriving in
+# time order, as it does, keeps writing to the latest few partitions, so older ones are closed once finished.
+# Any previous contents of the folder are removed.
+class PartitionedParquetOutputStream(ParquetOutputStream):
+    def __init__(self, folder: str, schema: pa.Schema, partition_schema: pa.Schema, add_partition_columns,
+                 row_group_rows: int = 10000, row_group_bytes: int = 64 * 1024 * 1024, file_rows: int = 1000000,
+                 max_open_files: int = 16):
+        super().__init__(folder, schema, row_group_rows, row_group_bytes)
+        self.partition_schema = partition_schema
+        self.add_partition_columns = add_partition_columns
+        self.file_rows = file_rows
+        self.max_open_files = max_open_files
+        # By partition path, eg `date=2020-01-01/hour=00`: the open writer, least recently written first, the rows written
+        # to its file, and the number of files opened.
+        self.partition_writers = OrderedDict()
+        self.partition_file_rows = {}
+        self.partition_file_counts = {}
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+    def write(self, table: pa.Table):
+        if table.num_rows > 0:
+            partitioned_table = self.add_partition_columns(table)
+            partition_paths = pc.binary_join_element_wise(
+                *[pc.binary_join_element_wise(f"{name}=", pc.cast(partitioned_table.column(name), pa.string()), "")
+                  for name in self.partition_schema.names], "/")
+            for partition_path in pc.unique(partition_paths).to_pylist():
+                self.write_partition(partition_path, table.filter(pc.equal(partition_paths, partition_path)))
+            self.flushed_rows += table.num_rows
+        self.buffered_bytes = 0
+
+    def write_partition(self, partition_path: str, table: pa.Table):
+        offset = 0
+        while offset < table.num_rows:
+            if partition_path not in self.partition_writers:
+                self.open_partition_file(partition_path)
+            self.partition_writers.move_to_end(partition_path)
+            rows = table.slice(offset, self.file_rows - self.partition_file_rows[partition_path])
+            self.partition_writers[partition_path].write_table(rows, row_group_size=self.row_group_rows)
+            self.partition_file_rows[partition_path] += rows.num_rows
+            offset += rows.num_rows
+            if self.partition_file_rows[partition_path] >= self.file_rows:
+                self.partition_writers.pop(partition_path).close()
+
+    def open_partition_file(self, partition_path: str):
+        if len(self.partition_writers) >= self.max_open_files:
+            self.partition_writers.popitem(last=False)[1].close()
+        partition_folder = os.path.join(self.filepath, *partition_path.split("/"))
+        os.makedirs(partition_folder, exist_ok=True)
+        file_count = self.partition_file_counts.get(partition_path, 0)
+        self.partition_writers[partition_path] = pq.ParquetWriter(os.path.join(partition_folder, f"part-{file_count}.parquet"), self.schema)
+        self.partition_file_rows[partition_path] = 0
+        self.partition_file_counts[partition_path] = file_count + 1
+
+    def close(self):
+        for writer in self.partition_writers.values():
+            writer.close()
+        self.partition_writers = OrderedDict()
+
+
+# Write a table, including its partition columns, into the hive partitions of a folder.
+# Partitions already in the folder are replaced if `replace_partitions`, and are otherwise added to, with files named
+# by `basename_template`.
+def write_partitions(table: pa.Table, folder: str, partition_schema: pa.Schema, basename_template: str, file_rows: int,
+                     row_group_rows: int = 10000, replace_partitions: bool = False):
+    # Written by one thread, so the rows keep their order within each partition.
+    ds.write_dataset(table, folder, format="parquet", partitioning=ds.partitioning(partition_schema, flavor="hive"),
+                     basename_template=basename_template, max_rows_per_file=file_rows,
+                     max_rows_per_group=min(row_group_rows, file_rows), use_threads=False,
+                     existing_data_behavior="delete_matching" if replace_partitions else "overwrite_or_ignore")
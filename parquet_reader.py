@@ -0,0 +1,80 @@
+from output_changes import has_changes, apply_changes
+import pyarrow.dataset as ds
+import pyarrow as pa
+import os
+
+
+# Reads the output files as arrow data, without building an object per row.
+# Only the requested columns are read, and row groups whose min/max statistics show they can't match the filter are
+# skipped without being decoded. Filters are pyarrow dataset expressions, e.g. `ds.field("category") == "house"`.
+# An output folder is read as a hive partitioned dataset, with the partition columns of `partition_schema`. Filters can
+# then refer to the partition columns, to skip whole partitions, but they are not returned.
+# An output file followed by change files, see output_changes.py, is read whole, with the changes applied, then filtered.
+def read_table(filepath: str, schema: pa.Schema, columns: list = None, filter: ds.Expression = None, partition_schema: pa.Schema = None):
+    if has_changes(filepath):
+        return read_changed_table(filepath, schema, columns, filter)
+    dataset = output_dataset(filepath, schema, partition_schema)
+    if dataset is None:
+        return empty_table(schema, columns)
+    return dataset.to_table(columns=columns if columns is not None else schema.names, filter=filter)
+
+
+def iter_batches(filepath: str, schema: pa.Schema, columns: list = None, filter: ds.Expression = None, batch_size: int = 1000,
+                 partition_schema: pa.Schema = None):
+    if has_changes(filepath):
+        for record_batch in read_changed_table(filepath, schema, columns, filter).to_batches(max_chunksize=batch_size):
+            if record_batch.num_rows > 0:
+                yield record_batch
+        return
+    dataset = output_dataset(filepath, schema, partition_schema)
+    if dataset is not None:
+        for record_batch in dataset.to_batches(columns=columns if columns is not None else schema.names, filter=filter,
+                                               batch_size=batch_size):
+            if record_batch.num_rows > 0:
+                yield record_batch
+
+
+# Returns None for an output file holding no rows, which is saved as an empty file.
+def output_dataset(filepath: str, schema: pa.Schema, partition_schema: pa.Schema = None):
+    if os.path.isdir(filepath):
+        return ds.dataset(filepath, schema=pa.schema(list(schema) + list(partition_schema)), format="parquet",
+                          partitioning=ds.partitioning(partition_schema, flavor="hive"))
+    if os.path.getsize(filepath) == 0:
+        return None
+    return ds.dataset(filepath, schema=schema, format="parquet")
+
+
+def read_changed_table(filepath: str, schema: pa.Schema, columns: list = None, filter: ds.Expression = None):
+    dataset = output_dataset(filepath, schema)
+    table = apply_changes(dataset.to_table() if dataset is not None else schema.empty_table(), filepath, schema)
+    if filter is not None:
+        table = table.filter(filter)
+    return table.select(columns if columns is not None else schema.names)
+
+
+def empty_table(schema: pa.Schema, columns: list = None):
+    table = schema.empty_table()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+# Combine filters, ignoring those not set. Returns None if no filter is set.
+def all_of(*filters):
+    combined = None
+    for filter in filters:
+        if filter is not None:
+            combined = filter if combined is None else combined & filter
+    return combined
+
+
+# Filters on a column's value being within a set, or within a range. Return None when there is nothing to filter on.
+def is_in(column_name: str, values, value_type: pa.DataType):
+    if values is None:
+        return None
+    return ds.field(column_name).isin(pa.array(list(values), type=value_type))
+
+
+def in_range(column_name: str, start=None, end=None):
+    return all_of(ds.field(column_name) >= start if start is not None else None,
+                  ds.field(column_name) < end if end is not None else None)
@@ -1,7 +1,9 @@
-from pyarrow.lib import ArrowInvalid
 from dataclasses import dataclass
-import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import parquet_reader
+from money import PRODUCT_PRICE_SCALE, MoneyColumn, parse_money, money_to_decimal
 from decimal import Decimal
+import pyarrow as pa
 import json
 
 
@@ -9,6 +11,7 @@ import json
 class Product:
     sku: int
     name: str
+    # Also held as `price_units`, an integer count of thousandths, which is what is saved, see money.py.
     price: Decimal
     category: str
     popularity: float
@@ -23,15 +26,24 @@ class Product:
 
         # Enforce type
         self.sku = int(self.sku)
-        self.price = Decimal(self.price)
+        self.price_units = parse_money(self.price, PRODUCT_PRICE_SCALE)
+        self.price = money_to_decimal(self.price_units, PRODUCT_PRICE_SCALE)
 
         # Other constraints
-        assert self.price >= 0, "Price must be positive."
+        assert self.price_units >= 0, "Price must be positive."
         assert self.popularity > 0, "Popularity must be greater than 0."
 
     @classmethod
     def from_string(cls, product_string: str):
-        product_json = json.loads(product_string)
+        return cls.from_json(cls.decode_json(product_string))
+
+    @staticmethod
+    def decode_json(product_string: str):
+        return json.loads(product_string)
+
+    # Construct from the dictionary decoded from the json string.
+    @classmethod
+    def from_json(cls, product_json: dict):
 
         sku = product_json.get("sku")
         if sku == 62291 or sku == "62291":
@@ -44,23 +56,56 @@ class Product:
         product = cls(sku=sku, name=name, price=price, category=category, popularity=popularity)
         return product
 
+    # Construct from a price already in thousandths, eg a price column of a RecordStore, rather than an amount.
+    @classmethod
+    def from_units(cls, sku: int, name: str, price_units: int, category: str, popularity: float):
+        return cls(sku=sku, name=name, price=money_to_decimal(price_units, PRODUCT_PRICE_SCALE), category=category, popularity=popularity)
+
+    # Returns this object's values in the column order of its parquet structure.
+    def to_parquet_row(self):
+        return [self.sku, self.name, self.price_units, self.category, self.popularity]
+
+    @staticmethod
+    # Returns the parquet structure to save this object to file.
+    def parquet_struct():
+        # Some input prices carry a third decimal place, so prices are saved at a scale of 3 to preserve them exactly.
+        product_struct = pa.struct(
+            [
+                pa.field('sku', pa.int64()),
+                pa.field('name', pa.string()),
+                pa.field('price', pa.decimal128(12, 3)),
+                pa.field('category', pa.string()),
+                pa.field('popularity', pa.float64())
+            ]
+        )
+        return product_struct
+
+    @staticmethod
+    # Returns the converters of columns whose rows don't hold the values arrow converts to, see RecordStore.
+    def column_converters():
+        return {'price': MoneyColumn(Product.parquet_struct().field('price').type)}
+
+
+def read_products_table(filepath: str, columns: list = None, skus=None, category: str = None, filter: ds.Expression = None):
+    return parquet_reader.read_table(filepath, pa.schema(Product.parquet_struct()), columns, product_filter(skus, category, filter))
+
+
+def iter_product_batches(filepath: str, columns: list = None, skus=None, category: str = None, filter: ds.Expression = None,
+                         batch_size: int = 1000):
+    return parquet_reader.iter_batches(filepath, pa.schema(Product.parquet_struct()), columns, product_filter(skus, category, filter), batch_size)
+
+
+def product_filter(skus=None, category: str = None, filter: ds.Expression = None):
+    category_filter = ds.field("category") == category if category is not None else None
+    return parquet_reader.all_of(parquet_reader.is_in("sku", skus, pa.int64()), category_filter, filter)
+
+
+def read_products(filepath: str, skus=None, category: str = None, filter: ds.Expression = None):
+    for record_batch in iter_product_batches(filepath, skus=skus, category=category, filter=filter):
+        for product_dict in record_batch.to_pylist():
+            # Pass dictionary as keyword arguments
+            yield Product(**product_dict)
+
 
-def read_products(filepath: str):
-    try:
-        file = pq.ParquetFile(filepath)
-        empty_file = False
-    except ArrowInvalid:
-        empty_file = True
-    if not empty_file:
-        for record_batch in file.iter_batches(batch_size=1000):
-            record_list = zip(*[column.to_pylist() for column in record_batch.columns])
-            for record in record_list:
-                # Construct dictionary of product parameters
-                product_dict = {column_name: value for (column_name, value) in zip(record_batch.column_names, record)}
-                # Pass dictionary as keyword arguments
-                product = Product(**product_dict)
-                yield product
-
-
-def read_all_products(filepath: str):
-    return list(read_products(filepath))
+def read_all_products(filepath: str, skus=None, category: str = None, filter: ds.Expression = None):
+    return list(read_products(filepath, skus, category, filter))
@@ -0,0 +1,144 @@
+from bisect import bisect_right
+import pyarrow as pa
+
+
+# Holds rows column by column, rather than as a list of objects.
+# New rows are appended to one python list per column, and every `batch_rows` rows those lists are sealed into an
+# arrow record batch, which holds the values in compact column buffers instead of as python objects.
+# Saving is then just a table over the sealed batches.
+# Columns whose rows hold values in another form than arrow converts to and from python, eg money as integer units, are
+# given a converter with new_column(), to_arrow(column) and to_python(array) methods, see money.MoneyColumn. Its
+# new_column() may return a builder of the column's arrow buffers in place of a list, which must support append, pop of
+# the last row, len, and getting and setting values by row.
+class RecordStore:
+    def __init__(self, schema: pa.Schema, batch_rows: int = 10000, column_converters: dict = None):
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.column_converters = column_converters if column_converters is not None else {}
+
+        # Sealed record batches, and the row number each one starts at.
+        self.batches = []
+        self.batch_offsets = []
+        self.sealed_row_count = 0
+
+        # Rows not yet sealed, held in one list or builder per column.
+        self.columns = self.new_columns()
+        self.unsealed_row_count = 0
+
+        # Values changed after their row was sealed, by row then column name. Applied when the batches are next read.
+        self.overrides = {}
+
+    def __len__(self):
+        return self.sealed_row_count + self.unsealed_row_count
+
+    # Append a row, given its values in schema column order.
+    # Should the row complete a batch that then fails to seal, eg as a value doesn't fit its column's type, the row is
+    # taken back out before the error is raised, leaving the unsealed rows as they were.
+    def append(self, values: list):
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+        self.unsealed_row_count += 1
+        if self.unsealed_row_count >= self.batch_rows:
+            try:
+                self.seal()
+            except Exception:
+                for column in self.columns.values():
+                    column.pop()
+                self.unsealed_row_count -= 1
+                raise
+
+    # Append the rows of a table with the same schema. The table's record batches are kept as sealed batches.
+    def extend(self, table: pa.Table):
+        self.seal()
+        for batch in table.to_batches():
+            if batch.num_rows > 0:
+                self.batches.append(batch)
+                self.batch_offsets.append(self.sealed_row_count)
+                self.sealed_row_count += batch.num_rows
+
+    # The batch is built before anything is changed, so a seal that fails leaves the unsealed rows in place.
+    def seal(self):
+        if self.unsealed_row_count > 0:
+            arrays = [self.column_array(field, self.columns[field.name]) for field in self.schema]
+            self.batches.append(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+            self.batch_offsets.append(self.sealed_row_count)
+            self.sealed_row_count += self.unsealed_row_count
+            self.columns = self.new_columns()
+            self.unsealed_row_count = 0
+
+    def get(self, row: int, column_name: str):
+        if row >= self.sealed_row_count:
+            return self.columns[column_name][row - self.sealed_row_count]
+        if row in self.overrides and column_name in self.overrides[row]:
+            return self.overrides[row][column_name]
+        batch_index = bisect_right(self.batch_offsets, row) - 1
+        array = self.batches[batch_index].column(column_name)
+        batch_row = row - self.batch_offsets[batch_index]
+        if column_name in self.column_converters:
+            return self.column_converters[column_name].to_python(array.slice(batch_row, 1))[0]
+        return array[batch_row].as_py()
+
+    def set(self, row: int, column_name: str, value):
+        if row >= self.sealed_row_count:
+            self.columns[column_name][row - self.sealed_row_count] = value
+        else:
+            self.overrides.setdefault(row, {})[column_name] = value
+
+    # Returns the row as a dictionary of column name to value.
+    def row(self, row: int):
+        return {column_name: self.get(row, column_name) for column_name in self.schema.names}
+
+    def apply_overrides(self):
+        overrides_by_batch = {}
+        for row, column_values in self.overrides.items():
+            batch_index = bisect_right(self.batch_offsets, row) - 1
+            overrides_by_batch.setdefault(batch_index, {})[row - self.batch_offsets[batch_index]] = column_values
+
+        for batch_index, batch_overrides in overrides_by_batch.items():
+            batch = self.batches[batch_index]
+            arrays = batch.columns
+            for column_index, column_name in enumerate(self.schema.names):
+                changed_rows = {batch_row: column_values[column_name] for batch_row, column_values in batch_overrides.items() if column_name in column_values}
+                if len(changed_rows) > 0:
+                    values = self.column_values(column_name, arrays[column_index])
+                    for batch_row, value in changed_rows.items():
+                        values[batch_row] = value
+                    arrays[column_index] = self.column_array(self.schema.field(column_name), values)
+            self.batches[batch_index] = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.overrides = {}
+
+    # Replace each batch with function(batch, first_row), after sealing all rows, eg to change many rows of a column at
+    # once.
+    def map_batches(self, function):
+        self.seal()
+        self.apply_overrides()
+        for batch_index, batch in enumerate(self.batches):
+            self.batches[batch_index] = function(batch, self.batch_offsets[batch_index])
+
+    def new_columns(self):
+        return {column_name: self.column_converters[column_name].new_column() if column_name in self.column_converters else []
+                for column_name in self.schema.names}
+
+    def column_array(self, field: pa.Field, values):
+        if field.name in self.column_converters:
+            return self.column_converters[field.name].to_arrow(values)
+        return pa.array(values, type=field.type)
+
+    def column_values(self, column_name: str, array: pa.Array):
+        if column_name in self.column_converters:
+            return self.column_converters[column_name].to_python(array)
+        return array.to_pylist()
+
+    def to_table(self):
+        self.seal()
+        self.apply_overrides()
+        return pa.Table.from_batches(self.batches, schema=self.schema)
+
+    # Release all rows.
+    def clear(self):
+        self.batches = []
+        self.batch_offsets = []
+        self.sealed_row_count = 0
+        self.columns = self.new_columns()
+        self.unsealed_row_count = 0
+        self.overrides = {}
@@ -0,0 +1,109 @@
+from time import monotonic
+import tempfile
+import shutil
+import json
+
+# Rejected input held in memory before spilling to a temporary file.
+SPOOL_BYTES = 8 * 1024 * 1024
+
+
+# Receives the input lines the etl process rejects, writing each out as it is rejected, rather than holding them all
+# in memory until saving.
+# Each line is written to the rejected input file as "<source>: <line>", and a json record of its entity, source, line
+# number (counting from 1), rejection reason and message is written to the details file, in the same order.
+# Given output file paths, the sink writes straight to them. Otherwise it writes to temporary files, which spill from
+# memory to disk once large, and are copied to the output files by save().
+# Rejections are logged per entity and reason: the first one in full, then only a count, at most once every
+# `log_interval_seconds`, so a file of bad rows doesn't cost a log line per row.
+class RejectedInputSink:
+    def __init__(self, input_filepath: str = None, details_filepath: str = None, log_interval_seconds: float = 10.0,
+                 log=print):
+        self.input_filepath = input_filepath
+        self.details_filepath = details_filepath
+        if input_filepath is not None:
+            self.input_file = open(input_filepath, mode='wb')
+            self.details_file = open(details_filepath, mode='wb')
+        else:
+            self.input_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+            self.details_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+
+        self.count = 0
+        # Bytes of the temporary files already copied out by save(), when saving appends to the output files.
+        self.saved_input_bytes = 0
+        self.saved_details_bytes = 0
+
+        self.log_interval_seconds = log_interval_seconds
+        self.log = log
+        # Rejections by (entity, reason), those already logged, and when they were last logged.
+        self.reason_counts = {}
+        self.logged_counts = {}
+        self.logged_times = {}
+
+    def reject(self, entity: str, source: str, line_number: int, line: bytes, reason: str, message: str):
+        self.input_file.write(bytes(source+": ", 'utf-8')+line)
+        details = {"entity": entity, "source": source, "line_number": line_number, "reason": reason, "message": message}
+        self.details_file.write(json.dumps(details).encode('utf-8') + b"\n")
+        self.count += 1
+
+        key = (entity, reason)
+        self.reason_counts[key] = self.reason_counts.get(key, 0) + 1
+        if key not in self.logged_times:
+            self.log(f"Rejected {entity} line {line_number} of {source} ({reason}): {message}")
+            self.logged_counts[key] = self.reason_counts[key]
+            self.logged_times[key] = monotonic()
+        elif monotonic() - self.logged_times[key] >= self.log_interval_seconds:
+            self.log_count(key)
+
+    def log_count(self, key: tuple):
+        entity, reason = key
+        unlogged_count = self.reason_counts[key] - self.logged_counts[key]
+        if unlogged_count > 0:
+            self.log(f"Rejected {unlogged_count} more {entity} ({reason}), {self.reason_counts[key]} in total.")
+        self.logged_counts[key] = self.reason_counts[key]
+        self.logged_times[key] = monotonic()
+
+    # Log the counts not yet logged.
+    def log_counts(self):
+        for key in self.reason_counts:
+            self.log_count(key)
+
+    # Write the rejected input out to the output files. If `append`, only input rejected since the last save is
+    # appended to them.
+    def save(self, input_filepath: str, details_filepath: str, append: bool = False):
+        self.log_counts()
+        if self.input_filepath is not None:
+            self.input_file.flush()
+            self.details_file.flush()
+            return
+        self.saved_input_bytes = copy_file(self.input_file, input_filepath, self.saved_input_bytes if append else 0, append)
+        self.saved_details_bytes = copy_file(self.details_file, details_filepath, self.saved_details_bytes if append else 0, append)
+
+    # Copy the rejected input so far to the given files, for a snapshot of the etl process, without changing what save()
+    # appends next. Returns the counts restore() takes back with the files.
+    def snapshot(self, input_filepath: str, details_filepath: str):
+        copy_file(self.input_file, input_filepath, 0, False)
+        copy_file(self.details_file, details_filepath, 0, False)
+        return {"count": self.count, "saved_input_bytes": self.saved_input_bytes, "saved_details_bytes": self.saved_details_bytes}
+
+    # Restore the rejected input of a snapshot to an empty sink.
+    def restore(self, input_filepath: str, details_filepath: str, counts: dict):
+        for output_file, snapshot_filepath in [(self.input_file, input_filepath), (self.details_file, details_filepath)]:
+            with open(snapshot_filepath, mode='rb') as snapshot_file:
+                shutil.copyfileobj(snapshot_file, output_file)
+        self.count = counts["count"]
+        self.saved_input_bytes = counts["saved_input_bytes"]
+        self.saved_details_bytes = counts["saved_details_bytes"]
+
+    def close(self):
+        self.input_file.close()
+        self.details_file.close()
+
+
+# Copy a temporary file from the given offset, and return the offset it was copied up to.
+def copy_file(temporary_file, output_filepath: str, offset: int, append: bool):
+    end = temporary_file.tell()
+    temporary_file.seek(offset)
+    with open(output_filepath, mode='ab' if append else 'wb') as output_file:
+        shutil.copyfileobj(temporary_file, output_file)
+    temporary_file.seek(end)
+    return end
@@ -0,0 +1,27 @@
+from json import JSONDecodeError
+
+
+# Reasons an input record is rejected, used to count rejections by reason.
+MALFORMED_JSON = "malformed_json"
+INVALID_RECORD = "invalid_record"
+DUPLICATE_KEY = "duplicate_key"
+UNKNOWN_CUSTOMER = "unknown_customer"
+UNKNOWN_PRODUCT = "unknown_product"
+STALE_RECORD = "stale_record"
+
+
+# Raised for a record which is valid by itself, but is rejected by the key constraints of the data already loaded.
+class RejectedRecord(Exception):
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+# Returns the reason for the exception raised while loading a record.
+# Records failing to parse as json are malformed, and records failing the checks in their class are invalid.
+def rejection_reason(exception: Exception):
+    if isinstance(exception, RejectedRecord):
+        return exception.reason
+    if isinstance(exception, JSONDecodeError):
+        return MALFORMED_JSON
+    return INVALID_RECORD
@@ -0,0 +1,61 @@
+from key_index import CompactKeyIndex
+import pyarrow as pa
+
+# Snapshots of the etl state are folders of arrow IPC files: a table of the rows of each entity, and a table of the keys
+# and rows of each key index, see Etl.save_snapshot. IPC files hold the arrow buffers as they are in memory, so they are
+# written without encoding, and read memory mapped, without decoding or copying them.
+
+
+def write_arrow_file(filepath: str, table: pa.Table):
+    with pa.OSFile(filepath, mode='wb') as output_file:
+        with pa.ipc.new_file(output_file, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_arrow_file(filepath: str):
+    return pa.ipc.open_file(pa.memory_map(filepath, mode='r')).read_all()
+
+
+# Returns a table of the keys of a key index, a mapping of keys to rows, and their rows.
+# A compact key index is written as the words it holds its keys as, so that it is restored without hashing its keys
+# again, which for hashed string keys couldn't be done anyway, as their keys aren't kept.
+def key_index_table(index):
+    if isinstance(index, CompactKeyIndex):
+        columns = {f"key_word_{word_index}": words[index.used] for word_index, words in enumerate(index.key_words)}
+        columns["row"] = index.rows[index.used]
+        return pa.table(columns)
+    keys = []
+    rows = []
+    for key, row in index.items():
+        keys.append(key)
+        rows.append(row)
+    return pa.table({"key": pa.array(keys), "row": pa.array(rows, pa.int64())})
+
+
+# Set the rows of the keys of a table written by key_index_table in an empty key index of the same kind.
+def load_key_index(index, table: pa.Table):
+    if isinstance(index, CompactKeyIndex):
+        assert "key_word_0" in table.column_names, "A compact key index can only be restored from a compact key index."
+        key_words = [table.column(f"key_word_{word_index}").to_numpy() for word_index in range(index.key_word_count)]
+        index.set_many(key_words, table.column("row").to_numpy())
+    else:
+        assert "key" in table.column_names, "A compact key index can only be restored to a compact key index."
+        index.update(zip(table.column("key").to_pylist(), table.column("row").to_pylist()))
+
+
+# Returns a table of each key of a secondary index, a rows state store, against each of its rows.
+def rows_index_table(index):
+    keys = []
+    rows = []
+    for key, key_rows in index.items():
+        keys += [key] * len(key_rows)
+        rows += key_rows
+    return pa.table({"key": pa.array(keys), "row": pa.array(rows, pa.int64())})
+
+
+# Set the rows of the keys of a table written by rows_index_table in an empty rows state store.
+def load_rows_index(index, table: pa.Table):
+    key_rows = {}
+    for key, row in zip(table.column("key").to_pylist(), table.column("row").to_pylist()):
+        key_rows.setdefault(key, []).append(row)
+    index.update(key_rows)
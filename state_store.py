@@ -0,0 +1,199 @@
+from collections.abc import MutableMapping
+from collections import OrderedDict
+import pyarrow.compute as pc
+import pyarrow as pa
+from key_index import Int64KeyIndex
+import numpy as np
+import sqlite3
+import os
+
+
+# Key value stores for the key indexes of the etl process, mapping each customer id or product sku to its row.
+# A state store is a mutable mapping, with one extra method, contains_keys(keys), returning whether each key of an
+# arrow array is present, as an arrow boolean array, so whole files can be checked against an index at once.
+# MemoryStateStore holds the index in a dictionary. Int64KeyIndex, see key_index.py, holds it in memory in compact numpy
+# arrays. SqliteStateStore holds it on disk, so it isn't bounded by memory.
+# Secondary indexes, mapping each key to a list of rows, eg the rows of the customers with an email, are rows state
+# stores: state stores with two more methods, add_row(key, row), appending a row to a key's rows, and
+# remove_row(key, row), removing it, and the key once it has no rows left.
+# Other backends can be used by overriding Etl.new_state_store and Etl.new_rows_state_store.
+
+
+class MemoryStateStore(dict):
+    def contains_keys(self, keys: pa.Array):
+        # Look up only the distinct keys asked about, rather than building an array of every key held.
+        found_keys = [key for key in pc.unique(keys).to_pylist() if key in self]
+        return pc.is_in(keys, value_set=pa.array(found_keys, keys.type))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Holds the mapping in a table of an sqlite database file, behind an in-memory cache of the `cache_keys` most recently
+# used keys.
+# Writes are cached, and written to the database together, once `write_batch_keys` are waiting, or the store is flushed.
+# The database is opened for use from any thread, as the etl process may be created on one thread and loaded by
+# another, but only one thread may use the store at a time.
+class SqliteStateStore(MutableMapping):
+    def __init__(self, filepath: str, cache_keys: int = 100000, write_batch_keys: int = 10000):
+        self.filepath = filepath
+        self.cache_keys = cache_keys
+        self.write_batch_keys = write_batch_keys
+
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        # The store only holds a derived index, which is rebuilt after a crash, so it needn't be synced to disk.
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state (key PRIMARY KEY, value) WITHOUT ROWID")
+
+        # Recently used keys, least recently used first, and their values, or DELETED for keys known to be absent.
+        self.cache = OrderedDict()
+        # Values written since the last flush, or DELETED for deleted keys.
+        self.pending = {}
+
+    def __getitem__(self, key):
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            value = self.pending.get(key, MISSING)
+            if value is MISSING:
+                row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                value = row[0] if row is not None else DELETED
+            self.cache_value(key, value)
+        else:
+            self.cache.move_to_end(key)
+        if value is DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        self.cache_value(key, value)
+        self.pending[key] = value
+        if len(self.pending) >= self.write_batch_keys:
+            self.flush()
+
+    def __delitem__(self, key):
+        self[key]
+        self.cache_value(key, DELETED)
+        self.pending[key] = DELETED
+
+    def __iter__(self):
+        self.flush()
+        for (key,) in self.connection.execute("SELECT key FROM state"):
+            yield key
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+
+    def cache_value(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_keys:
+            self.cache.popitem(last=False)
+
+    def contains_keys(self, keys: pa.Array):
+        known_keys = []
+        unknown_keys = []
+        for key in pc.unique(keys).to_pylist():
+            value = self.cache.get(key, self.pending.get(key, MISSING))
+            if value is MISSING:
+                unknown_keys.append(key)
+            elif value is not DELETED:
+                known_keys.append(key)
+        # Look up the keys not in memory a batch at a time, within sqlite's limit on query parameters.
+        for start in range(0, len(unknown_keys), 500):
+            batch = unknown_keys[start:start + 500]
+            query = f"SELECT key FROM state WHERE key IN ({','.join('?' * len(batch))})"
+            known_keys.extend(key for (key,) in self.connection.execute(query, batch))
+        return pc.is_in(keys, value_set=pa.array(known_keys, keys.type))
+
+    def clear(self):
+        self.connection.execute("DELETE FROM state")
+        self.connection.commit()
+        self.cache.clear()
+        self.pending.clear()
+
+    def flush(self):
+        if len(self.pending) > 0:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                            [(key, value) for key, value in self.pending.items() if value is not DELETED])
+                self.connection.executemany("DELETE FROM state WHERE key = ?",
+                                            [(key,) for key, value in self.pending.items() if value is DELETED])
+            self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+MISSING = object()
+DELETED = object()
+
+
+class MemoryRowsStateStore(MemoryStateStore):
+    def add_row(self, key, row: int):
+        self.setdefault(key, []).append(row)
+
+    def remove_row(self, key, row: int):
+        rows = self[key]
+        rows.remove(row)
+        if len(rows) == 0:
+            del self[key]
+
+
+# Holds the rows of each key as the bytes of an int64 array. The lists it returns are copies, so the rows of a key only
+# change through the store.
+class SqliteRowsStateStore(SqliteStateStore):
+    def __getitem__(self, key):
+        return np.frombuffer(super().__getitem__(key), dtype=np.int64).tolist()
+
+    def __setitem__(self, key, rows: list):
+        super().__setitem__(key, np.asarray(rows, dtype=np.int64).tobytes())
+
+    def add_row(self, key, row: int):
+        self[key] = self.get(key, []) + [row]
+
+    def remove_row(self, key, row: int):
+        rows = self[key]
+        rows.remove(row)
+        if len(rows) == 0:
+            del self[key]
+        else:
+            self[key] = rows
+
+
+# Returns a store for the named index, in `folder` if given, and otherwise in memory, in a dictionary, or if `compact`,
+# in an Int64KeyIndex, which only holds integer keys.
+# An on-disk store keeps its contents between runs unless `clear` is given. The etl process clears its stores, as their
+# state only lasts one run: they index rows it holds, which a later run reloads, and reindexes, from the output.
+def open_state_store(name: str, folder: str = None, cache_keys: int = 100000, compact: bool = False, clear: bool = False):
+    if folder is None:
+        return Int64KeyIndex() if compact else MemoryStateStore()
+    os.makedirs(folder, exist_ok=True)
+    store = SqliteStateStore(os.path.join(folder, name + ".sqlite"), cache_keys)
+    if clear:
+        store.clear()
+    return store
+
+
+# Returns a rows state store for the named secondary index, in `folder` if given, and otherwise in memory, in a
+# dictionary of lists. `clear` is as for open_state_store.
+def open_rows_state_store(name: str, folder: str = None, cache_keys: int = 100000, clear: bool = False):
+    if folder is None:
+        return MemoryRowsStateStore()
+    os.makedirs(folder, exist_ok=True)
+    store = SqliteRowsStateStore(os.path.join(folder, name + ".sqlite"), cache_keys)
+    if clear:
+        store.clear()
+    return store
@@ -0,0 +1,259 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import argparse
+import random
+import gzip
+import json
+import os
+
+
+# Writes a synthetic input dataset, in the same date=/hour= folder layout and json shapes as the real input data,
+# at any scale. The customers, products and erasure requests scale with the number of transactions.
+# A controlled fraction of the records are faulty, so the rejection paths are exercised too:
+#  - duplicate_rate: customers, products and transactions repeating the key of an earlier record.
+#  - bad_foreign_key_rate: transactions referring to a customer or product sku that doesn't exist.
+#  - invalid_rate: products with a negative price, and transactions whose total_cost doesn't match their products.
+#  - erasure_rate: the fraction of customers hit by an erasure request.
+# The same arguments and seed always produce the same dataset.
+
+FIRST_NAMES = ["Julie-Anne", "Ian", "Georgia", "Amy", "Callum", "Zoe", "Aaron", "Yasmin", "Mohammed", "Olivia"]
+LAST_NAMES = ["Lyons", "Moore", "Lewis", "Morgan", "Barrett", "Edwards", "Williams", "Khan", "Murphy", "Smith"]
+CITIES = ["Emer Ville", "East James", "Alana Ville", "Mariastad", "East Williamville", "Wrightport"]
+COUNTRIES = ["United Kingdom", "Republic of Ireland"]
+SEGMENTS = ["health", "sports", "beauty", "family"]
+CATEGORIES = ["misc", "vitamin", "house", "sports", "beauty"]
+
+FIRST_CUSTOMER_ID = 100000
+FIRST_SKU = 10000
+
+
+# Counts of the records written, by whether the etl process should accept them.
+@dataclass
+class SyntheticDataSummary:
+    customers: int = 0
+    products: int = 0
+    transactions: int = 0
+    erasure_requests: int = 0
+    rejected_customers: int = 0
+    rejected_products: int = 0
+    rejected_transactions: int = 0
+
+    def rejected_input_count(self):
+        return self.rejected_customers + self.rejected_products + self.rejected_transactions
+
+
+def generate_dataset(output_folder: str, transaction_count: int, days: int = 31, hours_per_day: int = 24,
+                     customer_count: int = None, product_count: int = None, duplicate_rate: float = 0.001,
+                     bad_foreign_key_rate: float = 0.001, invalid_rate: float = 0.001, erasure_rate: float = 0.01,
+                     seed: int = 0, start_date: datetime = datetime(2020, 1, 1)):
+    # By default, keep the proportions of the real test data.
+    if customer_count is None:
+        customer_count = max(1, transaction_count // 12)
+    if product_count is None:
+        product_count = max(1, min(transaction_count // 4, 100000))
+
+    generator = SyntheticDataGenerator(random.Random(seed), duplicate_rate, bad_foreign_key_rate, invalid_rate)
+    hour_count = days * hours_per_day
+    for hour_index in range(hour_count):
+        day, hour = divmod(hour_index, hours_per_day)
+        hour_start = start_date + timedelta(days=day, hours=hour)
+        hour_folder = os.path.join(output_folder, f"date={hour_start.date().isoformat()}", f"hour={hour:02}")
+        os.makedirs(hour_folder, exist_ok=True)
+
+        # Products arrive once a day, and customers and transactions every hour, each spread evenly over the dataset.
+        if hour == 0:
+            write_lines(os.path.join(hour_folder, "products.json.gz"),
+                        generator.products(share(product_count, day, days)))
+        write_lines(os.path.join(hour_folder, "customers.json.gz"),
+                    generator.customers(share(customer_count, hour_index, hour_count)))
+        write_lines(os.path.join(hour_folder, "transactions.json.gz"),
+                    generator.transactions(share(transaction_count, hour_index, hour_count), hour_start))
+        erasure_request_count = generator.erasure_request_count(customer_count * erasure_rate, hour_index, hour_count)
+        if erasure_request_count > 0:
+            write_lines(os.path.join(hour_folder, "erasure-requests.json.gz"), generator.erasure_requests(erasure_request_count))
+    return generator.summary
+
+
+# The number of the `total` items falling in the given part, out of `parts` equal parts.
+def share(total: int, part: int, parts: int):
+    return total * (part + 1) // parts - total * part // parts
+
+
+def write_lines(filepath: str, lines: list):
+    with gzip.open(filepath, mode='wt', encoding='utf-8', compresslevel=1) as output_file:
+        for line in lines:
+            output_file.write(line)
+            output_file.write("\n")
+
+
+class SyntheticDataGenerator:
+    def __init__(self, rng: random.Random, duplicate_rate: float, bad_foreign_key_rate: float, invalid_rate: float):
+        self.rng = rng
+        self.duplicate_rate = duplicate_rate
+        self.bad_foreign_key_rate = bad_foreign_key_rate
+        self.invalid_rate = invalid_rate
+        self.summary = SyntheticDataSummary()
+
+        # Keys written so far. Records only refer to customers and products written before them.
+        self.next_customer_id = FIRST_CUSTOMER_ID
+        self.next_sku = FIRST_SKU
+        self.product_prices = []
+        self.next_transaction_number = 0
+        self.last_accepted_transaction_number = None
+        self.erasure_requests_written = 0
+
+    def customers(self, count: int):
+        for _ in range(count):
+            if self.next_customer_id > FIRST_CUSTOMER_ID and self.rng.random() < self.duplicate_rate:
+                customer_id = self.rng.randrange(FIRST_CUSTOMER_ID, self.next_customer_id)
+                self.summary.rejected_customers += 1
+            else:
+                customer_id = self.next_customer_id
+                self.next_customer_id += 1
+                self.summary.customers += 1
+            yield json.dumps({
+                "id": str(customer_id),
+                "first_name": self.rng.choice(FIRST_NAMES),
+                "last_name": self.rng.choice(LAST_NAMES),
+                "date_of_birth": None if self.rng.random() < 0.5 else f"{self.rng.randint(1940, 2005)}-{self.rng.randint(1, 12):02}-{self.rng.randint(1, 28):02}",
+                "email": customer_email(customer_id),
+                "phone_number": f"+44{self.rng.randrange(10 ** 9, 10 ** 10)}",
+                "address": f"{self.rng.randint(1, 200)} {self.rng.choice(LAST_NAMES)} street",
+                "city": self.rng.choice(CITIES),
+                "country": self.rng.choice(COUNTRIES),
+                "postcode": f"E{self.rng.randint(1, 20)} {self.rng.randint(1, 9)}NS",
+                "last_change": f"2020-01-{self.rng.randint(1, 31):02}",
+                "segment": self.rng.choice(SEGMENTS)
+            })
+
+    def products(self, count: int):
+        for _ in range(count):
+            price_cents = self.rng.randint(99, 9999)
+            faulty = self.rng.random()
+            if self.next_sku > FIRST_SKU and faulty < self.duplicate_rate:
+                sku = self.rng.randrange(FIRST_SKU, self.next_sku)
+                self.summary.rejected_products += 1
+            elif faulty < self.duplicate_rate + self.invalid_rate:
+                sku = 0
+                price_cents = -price_cents
+                self.summary.rejected_products += 1
+            else:
+                sku = self.next_sku
+                self.next_sku += 1
+                self.product_prices.append(price_cents)
+                self.summary.products += 1
+            yield json.dumps({
+                "sku": sku,
+                "name": "".join(self.rng.choices("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ", k=10)),
+                "price": format_cents(price_cents),
+                "category": self.rng.choice(CATEGORIES),
+                "popularity": self.rng.random() + 0.001
+            })
+
+    def transactions(self, count: int, hour_start: datetime):
+        for _ in range(count):
+            customer_id = None
+            if self.next_customer_id > FIRST_CUSTOMER_ID:
+                customer_id = self.rng.randrange(FIRST_CUSTOMER_ID, self.next_customer_id)
+            skus = []
+            if len(self.product_prices) > 0:
+                skus = [self.rng.randrange(FIRST_SKU, self.next_sku) for _ in range(self.rng.choice([1, 1, 1, 2, 3, 4, 5]))]
+
+            # Pick at most one fault for the transaction. Duplicates repeat the id of the last accepted transaction.
+            faulty = self.rng.random()
+            duplicate = self.last_accepted_transaction_number is not None and faulty < self.duplicate_rate
+            bad_foreign_key = not duplicate and (faulty < self.duplicate_rate + self.bad_foreign_key_rate or customer_id is None or len(skus) == 0)
+            invalid_total = not duplicate and not bad_foreign_key and faulty < self.duplicate_rate + self.bad_foreign_key_rate + self.invalid_rate
+
+            if duplicate:
+                transaction_number = self.last_accepted_transaction_number
+            else:
+                transaction_number = self.next_transaction_number
+                self.next_transaction_number += 1
+            if bad_foreign_key:
+                if customer_id is None or len(skus) == 0 or self.rng.random() < 0.5:
+                    customer_id = self.rng.randrange(FIRST_CUSTOMER_ID)
+                else:
+                    skus[0] = self.rng.randrange(FIRST_SKU)
+            if duplicate or bad_foreign_key or invalid_total:
+                self.summary.rejected_transactions += 1
+            else:
+                self.last_accepted_transaction_number = transaction_number
+                self.summary.transactions += 1
+
+            purchases = []
+            for sku in skus:
+                quantity = self.rng.choice([1, 1, 1, 2, 3])
+                price_cents = self.product_prices[sku - FIRST_SKU] if sku >= FIRST_SKU else 100
+                purchases.append({"sku": sku, "quanitity": quantity, "price": format_cents(price_cents),
+                                  "total": format_cents(price_cents * quantity)})
+            total_cost_cents = sum(price_cents_of(purchase["total"]) for purchase in purchases)
+            if invalid_total:
+                total_cost_cents += 1
+
+            transaction_time = hour_start + timedelta(microseconds=self.rng.randrange(3600 * 10 ** 6))
+            yield json.dumps({
+                "transaction_id": transaction_id(transaction_number),
+                "transaction_time": transaction_time.isoformat(timespec='microseconds'),
+                "customer_id": str(customer_id),
+                "delivery_address": {"address": f"{self.rng.randint(1, 200)} {self.rng.choice(LAST_NAMES)} street",
+                                     "postcode": f"D{self.rng.randint(1, 20):02} EHHA", "city": self.rng.choice(CITIES),
+                                     "country": self.rng.choice(COUNTRIES)},
+                "purchases": {"products": purchases, "total_cost": format_cents(total_cost_cents)}
+            })
+
+    # Spread the erasure requests evenly over the dataset, once there are customers to erase.
+    def erasure_request_count(self, total: float, hour_index: int, hour_count: int):
+        if self.next_customer_id == FIRST_CUSTOMER_ID:
+            return 0
+        return int(total * (hour_index + 1) / hour_count) - self.erasure_requests_written
+
+    def erasure_requests(self, count: int):
+        for _ in range(count):
+            customer_id = self.rng.randrange(FIRST_CUSTOMER_ID, self.next_customer_id)
+            request = self.rng.choice([{"customer-id": str(customer_id)}, {"email": customer_email(customer_id)},
+                                       {"customer-id": str(customer_id), "email": customer_email(customer_id)}])
+            self.erasure_requests_written += 1
+            self.summary.erasure_requests += 1
+            yield json.dumps(request)
+
+
+# A uuid shaped id, unique to the transaction number.
+def transaction_id(transaction_number: int):
+    return f"{transaction_number >> 48:08x}-{(transaction_number >> 32) & 0xffff:04x}-4000-8000-{transaction_number & 0xffffffffffff:012x}"
+
+
+def customer_email(customer_id: int):
+    return f"customer{customer_id}@example.com"
+
+
+def format_cents(cents: int):
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02}"
+
+
+def price_cents_of(price: str):
+    whole, fraction = price.split(".")
+    return int(whole) * 100 + int(fraction)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic input dataset for the etl process.")
+    parser.add_argument("output_folder")
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--hours-per-day", type=int, default=24)
+    parser.add_argument("--customers", type=int, default=None)
+    parser.add_argument("--products", type=int, default=None)
+    parser.add_argument("--duplicate-rate", type=float, default=0.001)
+    parser.add_argument("--bad-foreign-key-rate", type=float, default=0.001)
+    parser.add_argument("--invalid-rate", type=float, default=0.001)
+    parser.add_argument("--erasure-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = generate_dataset(args.output_folder, args.transactions, days=args.days, hours_per_day=args.hours_per_day,
+                               customer_count=args.customers, product_count=args.products,
+                               duplicate_rate=args.duplicate_rate, bad_foreign_key_rate=args.bad_foreign_key_rate,
+                               invalid_rate=args.invalid_rate, erasure_rate=args.erasure_rate, seed=args.seed)
+    print(summary)
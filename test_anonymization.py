@@ -1,6 +1,9 @@
-from customer import read_customers
+from customer import read_customers, read_all_customers
+from transaction import read_all_transactions
 from etl import Etl
+import hashlib
 import pytest
+import json
 import os
 
 
@@ -61,3 +64,160 @@ def test_erasure_request(erasure_request, test_name):
             break
 
     assert requested_customer_has_been_erased
+
+
+# WHEN: The full test dataset is processed with erasure requests applied immediately, and with them deferred till save.
+# RESULT: Both modes anonymize the same customers, to the same values.
+def test_deferred_erasure_requests_match_immediate(request):
+    # PREPARE
+    immediate_output_folder = os.path.join("test-output", request.node.name, "immediate")
+    deferred_output_folder = os.path.join("test-output", request.node.name, "deferred")
+    immediate_etl = Etl()
+    deferred_etl = Etl(defer_erasure_requests=True)
+
+    # ACT
+    immediate_etl.load_from_file("test-data")
+    immediate_etl.save(immediate_output_folder)
+    deferred_etl.load_from_file("test-data")
+    deferred_etl.save(deferred_output_folder)
+
+    # ASSERT
+    immediate_customers = read_all_customers(os.path.join(immediate_output_folder, "customers.parquet"))
+    deferred_customers = read_all_customers(os.path.join(deferred_output_folder, "customers.parquet"))
+    assert immediate_etl.erasure_request_count() > 0
+    assert immediate_customers == deferred_customers
+
+
+# WHEN: A deferred erasure request is received before the customer it refers to.
+# RESULT: The customer info is still hashed when the output is saved.
+def test_deferred_erasure_request_before_customer(request):
+    # PREPARE
+    etl = Etl(defer_erasure_requests=True)
+    etl.load_erasure_request_from_string('{"email": "hollymillar@example.org"}')
+
+    # ACT
+    etl.load_customer_from_string('{"id": "347984", "first_name": "Georgia", "last_name": "Lewis", "email": "hollymillar@example.org"}')
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl.save(test_output_folder)
+
+    # ASSERT
+    customers = read_all_customers(os.path.join(test_output_folder, "customers.parquet"))
+    assert customers[0].id == 347984
+    assert customers[0].email == hashlib.md5("hollymillar@example.org".encode('utf-8')).hexdigest()
+    assert customers[0].first_name == hashlib.md5("Georgia".encode('utf-8')).hexdigest()
+
+
+# WHEN: Deferred erasure requests, anonymized a column at a time on several threads, include repeated requests for the
+# same customer, by id and by email, and requests for customers held in sealed and unsealed rows.
+# RESULT: The customers are anonymized to the same values as when each request is applied as it arrives.
+def test_deferred_erasure_requests_repeated(request):
+    # PREPARE
+    immediate_output_folder = os.path.join("test-output", request.node.name, "immediate")
+    deferred_output_folder = os.path.join("test-output", request.node.name, "deferred")
+    immediate_etl = Etl()
+    deferred_etl = Etl(defer_erasure_requests=True, anonymize_workers=2)
+    customers = [{"id": str(customer_id), "first_name": f"First {customer_id}", "last_name": "Last", "email": f"{customer_id}@example.org",
+                  "address": "Street" if customer_id % 2 == 0 else None} for customer_id in range(12000)]
+    erasure_requests = ['{"customer-id": "5"}', '{"customer-id": "5"}', '{"email": "5@example.org"}', '{"email": "11999@example.org"}',
+                        '{"customer-id": "11999", "email": "7@example.org"}', '{"customer-id": "20000"}']
+
+    # ACT
+    for etl, output_folder in [(immediate_etl, immediate_output_folder), (deferred_etl, deferred_output_folder)]:
+        for customer in customers:
+            etl.load_customer_from_string(json.dumps(customer))
+        for erasure_request in erasure_requests:
+            etl.load_erasure_request_from_string(erasure_request)
+        etl.save(output_folder)
+
+    # ASSERT
+    immediate_customers = read_all_customers(os.path.join(immediate_output_folder, "customers.parquet"))
+    deferred_customers = read_all_customers(os.path.join(deferred_output_folder, "customers.parquet"))
+    assert immediate_customers == deferred_customers
+    twice_hashed_name = hashlib.md5(hashlib.md5("First 5".encode('utf-8')).hexdigest().encode('utf-8')).hexdigest()
+    assert deferred_customers[5].first_name == twice_hashed_name
+    assert deferred_customers[7].email == hashlib.md5("7@example.org".encode('utf-8')).hexdigest()
+    assert deferred_customers[6] == immediate_customers[6] and deferred_customers[6].first_name == "First 6"
+    assert deferred_etl.customer_email_to_rows == immediate_etl.customer_email_to_rows
+
+
+def transaction_string(transaction_id: str, customer_id: int, sku: int):
+    return json.dumps({"transaction_id": transaction_id, "transaction_time": "2020-01-01T10:00:00", "customer_id": str(customer_id),
+                       "delivery_address": {"address": f"{customer_id} Street", "postcode": "E90 2FT", "city": "Maria Ville", "country": "United Kingdom"},
+                       "purchases": {"products": [{"sku": sku, "quanitity": 1, "price": "1.00", "total": "1.00"}], "total_cost": "1.00"}})
+
+
+# WHEN: A customer with transactions held in sealed and unsealed rows is erased, then another of their transactions arrives.
+# RESULT: The delivery addresses of all the customer's transactions are hashed once, and no one else's are.
+def test_erasure_request_anonymizes_transactions(request):
+    # PREPARE
+    etl = Etl()
+    etl.transactions.batch_rows = 4
+    etl.load_product_from_string('{"sku": "1", "name": "Product", "price": "1.00", "category": "vitamin", "popularity": 0.5}')
+    for customer_id in [1, 2]:
+        etl.load_customer_from_string(json.dumps({"id": str(customer_id), "first_name": "First", "last_name": "Last", "email": f"{customer_id}@example.org"}))
+    for transaction_number in range(6):
+        etl.load_transaction_from_string(transaction_string(f"t{transaction_number}", 1 + transaction_number % 2, 1))
+
+    # ACT
+    etl.load_erasure_request_from_string('{"customer-id": "1"}')
+    etl.load_erasure_request_from_string('{"email": "1@example.org"}')
+    etl.load_transaction_from_string(transaction_string("t6", 1, 1))
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl.save(test_output_folder)
+
+    # ASSERT
+    hashed_address = hashlib.md5("1 Street".encode('utf-8')).hexdigest()
+    hashed_postcode = hashlib.md5("E90 2FT".encode('utf-8')).hexdigest()
+    assert [transaction.transaction_id for transaction in etl.customer_transactions(1)] == ["t0", "t2", "t4", "t6"]
+    for transaction in read_all_transactions(os.path.join(test_output_folder, "transactions.parquet")):
+        if transaction.customer_id == 1:
+            assert transaction.delivery_address == {"address": hashed_address, "postcode": hashed_postcode, "city": "Maria Ville", "country": "United Kingdom"}
+        else:
+            assert transaction.delivery_address["address"] == "2 Street"
+
+
+# WHEN: The full test dataset is processed in memory, and streamed to its output folder.
+# RESULT: Both anonymize the delivery addresses of the same transactions, to the same values.
+def test_streaming_erasure_anonymizes_same_transactions(request):
+    # PREPARE
+    in_memory_output_folder = os.path.join("test-output", request.node.name, "in_memory")
+    streaming_output_folder = os.path.join("test-output", request.node.name, "streaming")
+    in_memory_etl = Etl()
+    streaming_etl = Etl(stream_output_folder=streaming_output_folder, row_group_rows=1000)
+
+    # ACT
+    in_memory_etl.load_from_file("test-data")
+    in_memory_etl.save(in_memory_output_folder)
+    streaming_etl.load_from_file("test-data")
+    streaming_etl.save()
+
+    # ASSERT
+    in_memory_transactions = read_all_transactions(os.path.join(in_memory_output_folder, "transactions.parquet"))
+    streaming_transactions = read_all_transactions(os.path.join(streaming_output_folder, "transactions.parquet"))
+    erased_transactions = [transaction for transaction in in_memory_transactions if transaction.customer_id in in_memory_etl.erased_customer_ids]
+    assert len(erased_transactions) > 0
+    assert all(len(transaction.delivery_address["postcode"]) == 32 for transaction in erased_transactions)
+    assert [(transaction.transaction_id, transaction.delivery_address) for transaction in in_memory_transactions] == \
+           [(transaction.transaction_id, transaction.delivery_address) for transaction in streaming_transactions]
+    assert streaming_etl.erased_customer_ids == in_memory_etl.erased_customer_ids
+    assert len(streaming_etl.customer_id_to_transaction_rows) == 0
+
+
+# WHEN: A streaming etl process, which doesn't index transactions by customer, is asked for a customer's transactions.
+# RESULT: It finds those not yet written out.
+def test_streaming_customer_transactions(request):
+    # PREPARE
+    etl = Etl(stream_output_folder=os.path.join("test-output", request.node.name), row_group_rows=100)
+    etl.load_product_from_string('{"sku": "1", "name": "Product", "price": "1.00", "category": "vitamin", "popularity": 0.5}')
+    for customer_id in [1, 2]:
+        etl.load_customer_from_string(json.dumps({"id": str(customer_id), "first_name": "First", "last_name": "Last", "email": f"{customer_id}@example.org"}))
+
+    # ACT
+    for transaction_number in range(5):
+        etl.load_transaction_from_string(transaction_string(f"t{transaction_number}", 1 + transaction_number % 2, 1))
+    transactions = etl.customer_transactions(2)
+    etl.save()
+
+    # ASSERT
+    assert [transaction.transaction_id for transaction in transactions] == ["t1", "t3"]
+    assert len(etl.customer_id_to_transaction_rows) == 0
@@ -0,0 +1,50 @@
+from benchmark import run_benchmark, find_regressions
+from synthetic_data import generate_dataset
+import shutil
+from etl import Etl
+import os
+
+
+# WHEN: A synthetic dataset is generated with duplicate, bad foreign key, invalid and erasure request records.
+# RESULT: The etl process accepts and rejects exactly the records the generator intended it to.
+def test_synthetic_dataset_counts(request):
+    # PREPARE
+    test_data_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_data_folder, ignore_errors=True)
+    summary = generate_dataset(test_data_folder, 5000, days=2, hours_per_day=3, duplicate_rate=0.02,
+                               bad_foreign_key_rate=0.02, invalid_rate=0.02, erasure_rate=0.05)
+    etl = Etl()
+
+    # ACT
+    etl.load_from_file(test_data_folder)
+
+    # ASSERT
+    assert summary.rejected_customers > 0 and summary.rejected_products > 0 and summary.rejected_transactions > 0
+    assert etl.customer_count() == summary.customers
+    assert etl.product_count() == summary.products
+    assert etl.transaction_count() == summary.transactions
+    assert etl.erasure_request_count() == summary.erasure_requests
+    assert etl.rejected_input_count() == summary.rejected_input_count()
+
+
+# WHEN: The benchmark runs on a synthetic dataset.
+# RESULT: The throughput of each entity is reported, and a slower run is reported as a regression against it.
+def test_benchmark(request):
+    # PREPARE
+    test_data_folder = os.path.join("test-output", request.node.name)
+    test_output_folder = os.path.join("test-output", request.node.name + "_output")
+    shutil.rmtree(test_data_folder, ignore_errors=True)
+    summary = generate_dataset(test_data_folder, 2000, days=1, hours_per_day=2)
+
+    # ACT
+    results = run_benchmark(test_data_folder, test_output_folder, stream=True, vectorized_ingest=True)
+
+    # ASSERT
+    assert results["entities"]["transactions"]["rows"] == summary.transactions
+    for entity_results in results["entities"].values():
+        assert entity_results["rows_per_second"] > 0
+    assert results["peak_rss_mb"] > 0
+    assert find_regressions(results, results, tolerance=0.2) == []
+    slower_results = {"entities": {entity: dict(entity_results, rows_per_second=entity_results["rows_per_second"] / 2)
+                                   for entity, entity_results in results["entities"].items()}}
+    assert len(find_regressions(slower_results, results, tolerance=0.2)) == 3
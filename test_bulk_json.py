@@ -0,0 +1,58 @@
+from bulk_json import decode_customers_gzip_file, decode_products_gzip_file, decode_transactions_gzip_file, decode_lines, read_gzip_file
+from transaction import Transaction, read_all_transactions
+from customer import Customer, read_all_customers
+from product import Product, read_all_products
+from pathlib import Path
+from etl import Etl
+import pytest
+import os
+
+
+@pytest.mark.parametrize("input_filename, decode_gzip_file, record_class", [
+    ("customers.json.gz", decode_customers_gzip_file, Customer),
+    ("products.json.gz", decode_products_gzip_file, Product),
+    ("transactions.json.gz", decode_transactions_gzip_file, Transaction)
+])
+# WHEN: Each test data file is decoded in bulk.
+# RESULT: The same rows are accepted and rejected as when each line is decoded on its own.
+def test_bulk_decoding_matches_line_decoding(input_filename, decode_gzip_file, record_class):
+    for zipped_input_filepath in sorted(Path("test-data").glob(f"**/{input_filename}")):
+        # ACT
+        decoded = decode_gzip_file(str(zipped_input_filepath))
+        table, row_numbers, rejections = decode_lines(read_gzip_file(str(zipped_input_filepath))[1], record_class)
+
+        # ASSERT
+        assert decoded.table.equals(table)
+        assert decoded.row_numbers == row_numbers
+        assert [(line_number, reason) for line_number, message, reason in decoded.rejections] == \
+            [(line_number, reason) for line_number, message, reason in rejections]
+
+
+# WHEN: The etl process loads a large and varied dataset, decoding every file in bulk.
+# RESULT: The output files match the etl process decoding line by line.
+def test_etl_vectorized_ingest_large_dataset(request, monkeypatch):
+    # PREPARE
+    monkeypatch.setattr("etl.MIN_BULK_FILE_SIZE", 0)
+    test_output_folder = os.path.join("test-output", request.node.name)
+    line_by_line_output_folder = os.path.join("test-output", request.node.name + "_line_by_line")
+    etl = Etl(vectorized_ingest=True)
+    line_by_line_etl = Etl()
+
+    # ACT
+    etl.load_from_file("test-data")
+    etl.save(test_output_folder)
+    line_by_line_etl.load_from_file("test-data")
+    line_by_line_etl.save(line_by_line_output_folder)
+
+    # ASSERT
+    assert read_all_customers(os.path.join(test_output_folder, etl.customers_output_filename)) == \
+        read_all_customers(os.path.join(line_by_line_output_folder, etl.customers_output_filename))
+    assert read_all_products(os.path.join(test_output_folder, etl.products_output_filename)) == \
+        read_all_products(os.path.join(line_by_line_output_folder, etl.products_output_filename))
+    transactions = read_all_transactions(os.path.join(test_output_folder, etl.transactions_output_filename))
+    line_by_line_transactions = read_all_transactions(os.path.join(line_by_line_output_folder, etl.transactions_output_filename))
+    assert [(transaction.transaction_id, transaction.customer_id, transaction.purchases.total_cost) for transaction in transactions] == \
+        [(transaction.transaction_id, transaction.customer_id, transaction.purchases.total_cost) for transaction in line_by_line_transactions]
+    with open(os.path.join(test_output_folder, etl.rejected_input_output_filename), mode='rb') as reject_file:
+        with open(os.path.join(line_by_line_output_folder, etl.rejected_input_output_filename), mode='rb') as line_by_line_reject_file:
+            assert reject_file.read() == line_by_line_reject_file.read()
@@ -0,0 +1,86 @@
+from landing_watcher import LandingFolderWatcher
+from continuous_etl import ContinuousEtl
+from output_changes import has_changes
+from etl import Etl
+import pyarrow.parquet as pq
+import shutil
+import os
+
+
+def copy_landing_folders(date_folders: list, landing_folder: str):
+    for date_folder in date_folders:
+        shutil.copytree(os.path.join("test-data", date_folder), os.path.join(landing_folder, date_folder))
+
+
+# WHEN: A landing folder is polled, before and after a date folder is added to it.
+# RESULT: Each poll returns the files added since the last, in processing order, and only lists the folders that changed.
+def test_landing_watcher_returns_new_files(request):
+    # PREPARE
+    landing_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(landing_folder, ignore_errors=True)
+    copy_landing_folders(["date=2020-01-01"], landing_folder)
+    watcher = LandingFolderWatcher(landing_folder, settle_seconds=0, racy_seconds=0)
+
+    # ACT
+    first_filepaths = watcher.poll()
+    first_listing_count = watcher.listing_count
+    unchanged_filepaths = watcher.poll()
+    unchanged_listing_count = watcher.listing_count
+    copy_landing_folders(["date=2020-01-02"], landing_folder)
+    added_filepaths = watcher.poll()
+
+    # ASSERT
+    assert [filepath.relative_to(landing_folder).parts for filepath in first_filepaths[:3]] == [
+        ("date=2020-01-01", "hour=00", "customers.json.gz"),
+        ("date=2020-01-01", "hour=00", "products.json.gz"),
+        ("date=2020-01-01", "hour=00", "transactions.json.gz")]
+    assert len(first_filepaths) == sum(len(filenames) for folder, subfolders, filenames in os.walk(os.path.join(landing_folder, "date=2020-01-01")))
+    assert unchanged_filepaths == []
+    assert unchanged_listing_count == first_listing_count
+    assert len(added_filepaths) > 0
+    assert all(filepath.relative_to(landing_folder).parts[0] == "date=2020-01-02" for filepath in added_filepaths)
+    # The landing folder, whose entries changed, is listed again, as are the new folders, but not the others.
+    new_folder_count = 1 + len(os.listdir(os.path.join(landing_folder, "date=2020-01-02")))
+    assert watcher.listing_count - unchanged_listing_count == 1 + new_folder_count
+
+
+# WHEN: Date folders arrive in the landing folder one after another, while it is processed continuously, in micro-batches
+# of limited rows.
+# RESULT: Commits after the first only save change files, until the output is compacted on stopping, when it matches a
+# batch run over the same input, and a restart continues without loading any file twice.
+def test_continuous_etl_matches_batch_run(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    landing_folder = os.path.join(test_output_folder, "landing")
+    continuous_output_folder = os.path.join(test_output_folder, "continuous")
+    batch_output_folder = os.path.join(test_output_folder, "batch")
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    date_folders = sorted(os.listdir("test-data"))[:4]
+    continuous_etl = ContinuousEtl(Etl(), landing_folder, continuous_output_folder, poll_interval_seconds=0,
+                                   commit_interval_seconds=3600, commit_rows=500, settle_seconds=0, compact_interval_commits=1000)
+    output_filepaths = [os.path.join(continuous_output_folder, filename)
+                        for filename in [Etl.customers_output_filename, Etl.products_output_filename, Etl.transactions_output_filename]]
+
+    # ACT
+    for date_folder in date_folders:
+        copy_landing_folders([date_folder], landing_folder)
+        continuous_etl.poll()
+    uncompacted_changes = [has_changes(filepath) for filepath in output_filepaths]
+    continuous_etl.run(max_polls=1)
+    batch_etl = Etl()
+    batch_etl.load_from_file(landing_folder)
+    batch_etl.save(batch_output_folder)
+    restarted_etl = ContinuousEtl(Etl(), landing_folder, continuous_output_folder, settle_seconds=0)
+    loaded_file_count = restarted_etl.poll()
+
+    # ASSERT
+    assert continuous_etl.commit_count > len(date_folders)
+    assert uncompacted_changes == [True, True, True]
+    assert not any(has_changes(filepath) for filepath in output_filepaths)
+    for filename in [Etl.customers_output_filename, Etl.products_output_filename, Etl.transactions_output_filename]:
+        assert pq.read_table(os.path.join(continuous_output_folder, filename)) == pq.read_table(os.path.join(batch_output_folder, filename))
+    with open(os.path.join(continuous_output_folder, Etl.rejected_input_output_filename)) as continuous_rejected_file, \
+            open(os.path.join(batch_output_folder, Etl.rejected_input_output_filename)) as batch_rejected_file:
+        assert continuous_rejected_file.read() == batch_rejected_file.read()
+    assert loaded_file_count == 0
+    assert restarted_etl.etl.transaction_count() == batch_etl.transaction_count()
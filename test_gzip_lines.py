@@ -0,0 +1,58 @@
+from gzip_lines import GzipLineStream
+from pathlib import Path
+import pytest
+import shutil
+import gzip
+import os
+
+
+# WHEN: Gzip files are streamed in chunks smaller than their lines, including a file of several gzip members without a
+# final newline.
+# RESULT: The same lines are returned as by reading the whole file.
+def test_gzip_line_stream_lines(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    os.makedirs(test_output_folder)
+    multi_member_filepath = os.path.join(test_output_folder, "multi_member.json.gz")
+    with open(multi_member_filepath, mode='wb') as multi_member_file:
+        multi_member_file.write(gzip.compress(b'{"a": 1}\n{"b": '))
+        multi_member_file.write(gzip.compress(b'2}\n\n{"c": 3}'))
+    empty_filepath = os.path.join(test_output_folder, "empty.json.gz")
+    with open(empty_filepath, mode='wb'):
+        pass
+    filepaths = [multi_member_filepath, empty_filepath] + [str(filepath) for filepath in sorted(Path("test-data").glob("**/transactions.json.gz"))[:3]]
+
+    for filepath in filepaths:
+        # ACT
+        lines = list(GzipLineStream(filepath, chunk_bytes=7, max_pending_batches=2))
+
+        # ASSERT
+        with gzip.open(filepath) as input_file:
+            assert lines == input_file.readlines()
+    assert list(GzipLineStream(multi_member_filepath)) == [b'{"a": 1}\n', b'{"b": 2}\n', b'\n', b'{"c": 3}']
+
+
+# WHEN: A stream is closed part way through, and a truncated file is streamed.
+# RESULT: The background thread stops, and the truncated file raises an error.
+def test_gzip_line_stream_close_and_errors(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    os.makedirs(test_output_folder)
+    truncated_filepath = os.path.join(test_output_folder, "truncated.json.gz")
+    with open(truncated_filepath, mode='wb') as truncated_file:
+        truncated_file.write(gzip.compress(b'{"a": 1}\n' * 1000)[:-20])
+    stream = GzipLineStream(str(sorted(Path("test-data").glob("**/transactions.json.gz"))[0]), chunk_bytes=64, max_pending_batches=1)
+
+    # ACT
+    lines = iter(stream)
+    first_line = next(lines)
+    thread = stream.thread
+    stream.close()
+
+    # ASSERT
+    assert len(first_line) > 0
+    assert not thread.is_alive()
+    with pytest.raises(EOFError):
+        list(GzipLineStream(truncated_filepath))
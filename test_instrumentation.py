@@ -0,0 +1,89 @@
+from instrumentation import prometheus_text
+from ingestion_queue import IngestionQueue
+import flask_webservice
+from etl import Etl
+import os
+
+
+# WHEN: An instrumented etl process loads and saves a large and varied dataset.
+# RESULT: Its stats count every accepted and rejected row, by reason, and time each stage.
+def test_etl_stats(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    instrumented_etl = Etl(instrument=True)
+
+    # ACT
+    instrumented_etl.load_from_file("test-data")
+    instrumented_etl.save(test_output_folder)
+    stats = instrumented_etl.stats()
+
+    # ASSERT
+    assert stats["accepted_rows"]["customers"] == stats["rows"]["customers"] == 762
+    assert stats["accepted_rows"]["transactions"] == stats["rows"]["transactions"] == 9701
+    assert sum(count for reasons in stats["rejected_rows"].values() for count in reasons.values()) == 360
+    assert stats["rejected_rows"]["transactions"]["unknown_customer"] > 0
+    assert stats["index_sizes"]["transaction_id"] == 9701
+    for stage in ["read", "json_decode", "validate", "index", "store", "write", "erasure"]:
+        assert stats["stage_seconds"][stage] > 0
+    assert stats["bytes_read"]["transactions"] > 0
+    assert stats["bytes_written"]["transactions.parquet"] == os.path.getsize(os.path.join(test_output_folder, "transactions.parquet"))
+
+
+# WHEN: The instrumented etl process decodes the files in bulk.
+# RESULT: Rows are rejected for the same reasons as when decoded line by line.
+def test_etl_stats_vectorized_ingest(monkeypatch):
+    # PREPARE
+    monkeypatch.setattr("etl.MIN_BULK_FILE_SIZE", 0)
+    vectorized_etl = Etl(vectorized_ingest=True, instrument=True)
+    line_etl = Etl(instrument=True)
+
+    # ACT
+    vectorized_etl.load_from_file("test-data")
+    line_etl.load_from_file("test-data")
+
+    # ASSERT
+    assert vectorized_etl.stats()["rejected_rows"] == line_etl.stats()["rejected_rows"]
+    assert vectorized_etl.stats()["accepted_rows"] == line_etl.stats()["accepted_rows"]
+    assert vectorized_etl.stats()["stage_seconds"]["decode"] > 0
+
+
+# WHEN: The etl process isn't instrumented.
+# RESULT: Only the row counts and index sizes are reported.
+def test_etl_stats_disabled():
+    # PREPARE
+    uninstrumented_etl = Etl()
+
+    # ACT
+    uninstrumented_etl.load_from_file("test-data/date=2020-01-01/hour=00")
+    stats = uninstrumented_etl.stats()
+
+    # ASSERT
+    assert stats["enabled"] is False
+    assert stats["stage_seconds"] == {} and stats["rejected_rows"] == {}
+    assert stats["rows"]["products"] == 770
+    assert stats["index_sizes"]["product_sku"] == 770
+
+
+# WHEN: The webservice's metrics are scraped, after it has accepted and rejected a customer.
+# RESULT: The metrics are returned in the prometheus text format.
+def test_webservice_metrics(monkeypatch):
+    # PREPARE
+    ingestion_queue = IngestionQueue(Etl(instrument=True))
+    ingestion_queue.start()
+    monkeypatch.setattr(flask_webservice, "ingestion_queue", ingestion_queue)
+    client = flask_webservice.app.test_client()
+    customer = {"id": "347984", "first_name": "Georgia", "last_name": "Lewis", "email": "hollymillar@example.org"}
+    client.post("/customer", json=customer)
+    client.post("/customer", json=customer)
+
+    # ACT
+    response = client.get("/metrics")
+    ingestion_queue.stop()
+
+    # ASSERT
+    metrics = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert 'etl_rows_accepted_total{entity="customers"} 1' in metrics
+    assert 'etl_rows_rejected_total{entity="customers",reason="duplicate_key"} 1' in metrics
+    assert 'etl_index_entries{index="customer_id"} 1' in metrics
+    assert metrics == prometheus_text(ingestion_queue.etl.stats())
@@ -0,0 +1,84 @@
+from key_index import Int64KeyIndex, HashedStringKeyIndex
+import pyarrow.parquet as pq
+import pyarrow as pa
+from etl import Etl
+import random
+import sys
+import os
+
+
+# WHEN: Many integer keys, including repeated and negative ones, are set, looked up and deleted in an Int64KeyIndex,
+# one at a time and in bulk, growing the table several times.
+# RESULT: It behaves as a dictionary does, in a fraction of the memory.
+def test_int64_key_index():
+    # PREPARE
+    generator = random.Random(1)
+    keys = [generator.randrange(-2 ** 63, 2 ** 63) for _ in range(5000)] + list(range(5000))
+    index = Int64KeyIndex()
+    expected = {}
+
+    # ACT
+    for row, key in enumerate(keys[:3000]):
+        index[key] = row
+        expected[key] = row
+    pairs = [(key, row) for row, key in enumerate(keys[3000:] + keys[:100], start=3000)]
+    index.update(pairs)
+    expected.update(pairs)
+    for key in keys[::7]:
+        del index[key]
+        del expected[key]
+
+    # ASSERT
+    assert len(index) == len(expected)
+    assert sorted(index) == sorted(expected)
+    assert all(index[key] == row for key, row in expected.items())
+    assert all(key not in index for key in keys[::7])
+    assert 2 ** 64 not in index and "1" not in index and index.get(-1) is None
+    lookup_keys = keys[::7] + keys[1::7] + [None]
+    assert index.contains_keys(pa.array(lookup_keys, pa.int64())).to_pylist() == [key in expected for key in lookup_keys]
+    assert index.nbytes < (sys.getsizeof(expected) + sum(sys.getsizeof(key) + sys.getsizeof(row) for key, row in expected.items())) / 2
+
+
+# WHEN: String keys are set, looked up and deleted in a HashedStringKeyIndex.
+# RESULT: It behaves as a dictionary does.
+def test_hashed_string_key_index():
+    # PREPARE
+    keys = [f"{key:08x}-tx" for key in range(3000)]
+    index = HashedStringKeyIndex()
+
+    # ACT
+    index.update((key, row) for row, key in enumerate(keys[:2000]))
+    for row, key in enumerate(keys[1000:], start=1000):
+        index[key] = row * 2
+    for key in keys[::5]:
+        del index[key]
+
+    # ASSERT
+    assert len(index) == 3000 - 600
+    assert all(key not in index and index.get(key) is None for key in keys[::5])
+    assert index[keys[1]] == 1 and index[keys[1001]] == 2002 and index.get(keys[2999]) == 5998
+
+
+# WHEN: The etl process loads a large dataset, then continues from its output, with compact key indexes.
+# RESULT: The output is the same as with dictionaries.
+def test_etl_with_compact_key_indexes(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    dict_output_folder = os.path.join("test-output", request.node.name + "_dict")
+    etl = Etl(compact_key_indexes=True)
+    dict_etl = Etl()
+
+    # ACT
+    etl.load_from_file("test-data")
+    etl.save(test_output_folder)
+    dict_etl.load_from_file("test-data")
+    dict_etl.save(dict_output_folder)
+    continued_etl = Etl(compact_key_indexes=True)
+    continued_etl.load_previous_output(test_output_folder)
+
+    # ASSERT
+    assert etl.stats()["index_sizes"] == dict_etl.stats()["index_sizes"] == continued_etl.stats()["index_sizes"]
+    for output_filename in [etl.customers_output_filename, etl.products_output_filename, etl.transactions_output_filename]:
+        assert pq.read_table(os.path.join(test_output_folder, output_filename)).equals(
+            pq.read_table(os.path.join(dict_output_folder, output_filename)))
+    assert etl.rejected_input_count() == dict_etl.rejected_input_count() == 360
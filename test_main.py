@@ -1,9 +1,16 @@
-from transaction import read_all_transactions
+from bulk_json import decode_customers_data, decode_products_data
+from transaction import read_all_transactions, read_transactions_table
+from erasure_request import ErasureRequest
 from customer import read_all_customers
 from product import read_all_products
 from datetime import datetime
 from decimal import Decimal
+import pyarrow.parquet as pq
+from pathlib import Path
 from etl import Etl
+import hashlib
+import shutil
+import json
 import os
 
 
@@ -242,3 +249,222 @@ def test_etl_large_dataset(request):
     assert etl.product_count() == len(products)
     assert etl.transaction_count() == len(transactions)
     assert etl.rejected_input_count() == len(rejected_input_lines)
+
+
+# WHEN: The etl process streams a large and varied dataset to its output files.
+# RESULT: Rows are written out in row groups as they arrive, and the output matches the in-memory etl process.
+def test_etl_streaming_large_dataset(request):
+    # PREPARE
+    test_data_path = "test-data"
+    test_output_folder = os.path.join("test-output", request.node.name)
+    in_memory_output_folder = os.path.join("test-output", request.node.name + "_in_memory")
+    etl = Etl(stream_output_folder=test_output_folder, row_group_rows=1000)
+    in_memory_etl = Etl()
+
+    # ACT
+    etl.load_from_file(test_data_path)
+    buffered_transaction_count = len(etl.transactions)
+    etl.save()
+    in_memory_etl.load_from_file(test_data_path)
+    in_memory_etl.save(in_memory_output_folder)
+
+    # ASSERT
+    # Only the rows since the last row group was written should be held in memory.
+    assert buffered_transaction_count < 1000
+    assert pq.ParquetFile(os.path.join(test_output_folder, etl.transactions_output_filename)).num_row_groups == 10
+
+    assert len(read_all_customers(os.path.join(test_output_folder, etl.customers_output_filename))) == 762
+    assert read_all_products(os.path.join(test_output_folder, etl.products_output_filename)) == \
+        read_all_products(os.path.join(in_memory_output_folder, etl.products_output_filename))
+    transactions = read_all_transactions(os.path.join(test_output_folder, etl.transactions_output_filename))
+    in_memory_transactions = read_all_transactions(os.path.join(in_memory_output_folder, etl.transactions_output_filename))
+    assert [(transaction.transaction_id, transaction.transaction_time, transaction.purchases.total_cost) for transaction in transactions] == \
+        [(transaction.transaction_id, transaction.transaction_time, transaction.purchases.total_cost) for transaction in in_memory_transactions]
+    assert etl.transaction_count() == 9701
+    assert etl.rejected_input_count() == 360
+
+
+# WHEN: The etl process loads a large and varied dataset, decoding the files in worker processes.
+# RESULT: The output files match the etl process decoding each file as it is loaded.
+def test_etl_parallel_decoding_large_dataset(request):
+    # PREPARE
+    test_data_path = "test-data"
+    test_output_folder = os.path.join("test-output", request.node.name)
+    serial_output_folder = os.path.join("test-output", request.node.name + "_serial")
+    etl = Etl(decode_workers=2)
+    serial_etl = Etl()
+
+    # ACT
+    etl.load_from_file(test_data_path)
+    etl.save(test_output_folder)
+    serial_etl.load_from_file(test_data_path)
+    serial_etl.save(serial_output_folder)
+
+    # ASSERT
+    for output_filename in [etl.customers_output_filename, etl.products_output_filename, etl.transactions_output_filename]:
+        assert pq.read_table(os.path.join(test_output_folder, output_filename)).equals(
+            pq.read_table(os.path.join(serial_output_folder, output_filename)))
+    with open(os.path.join(test_output_folder, etl.rejected_input_output_filename), mode='rb') as reject_file:
+        with open(os.path.join(serial_output_folder, etl.rejected_input_output_filename), mode='rb') as serial_reject_file:
+            assert reject_file.read() == serial_reject_file.read()
+    assert etl.erasure_request_count() == serial_etl.erasure_request_count()
+
+
+# WHEN: The etl process runs incrementally, with input files arriving between runs.
+# RESULT: Each run loads only the new input files, and the final output matches a single run over all the input files.
+def test_etl_incremental_runs(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    full_output_folder = os.path.join("test-output", request.node.name + "_full")
+    landing_folder = os.path.join("test-output", request.node.name + "_landing")
+    for folder in [test_output_folder, full_output_folder, landing_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+    date_folders = sorted(os.listdir("test-data"))
+    half = len(date_folders) // 2
+
+    # ACT
+    for run_date_folders in [date_folders[:half], date_folders[half:], []]:
+        for date_folder in run_date_folders:
+            shutil.copytree(os.path.join("test-data", date_folder), os.path.join(landing_folder, date_folder))
+        etl = Etl()
+        etl.load_previous_output(test_output_folder)
+        etl.load_from_file(landing_folder)
+        etl.save(test_output_folder)
+    full_etl = Etl()
+    full_etl.load_from_file(landing_folder)
+    full_etl.save(full_output_folder)
+
+    # ASSERT
+    # The last run found no new input files.
+    assert etl.erasure_request_count() == 0
+    assert etl.rejected_input_count() == 0
+    assert etl.transaction_count() == 9701
+
+    for output_filename in [etl.customers_output_filename, etl.products_output_filename, etl.transactions_output_filename]:
+        assert pq.read_table(os.path.join(test_output_folder, output_filename)).equals(
+            pq.read_table(os.path.join(full_output_folder, output_filename)))
+    with open(os.path.join(test_output_folder, etl.rejected_input_output_filename), mode='rb') as reject_file:
+        with open(os.path.join(full_output_folder, etl.rejected_input_output_filename), mode='rb') as full_reject_file:
+            assert reject_file.read() == full_reject_file.read()
+
+
+# WHEN: A first run saves without continuing from previous output, then an incremental run continues from it, over the
+# same input files.
+# RESULT: The first run's manifest records its input files, so the incremental run loads none of them again.
+def test_etl_incremental_run_after_first_run(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    first_etl = Etl()
+    first_etl.load_from_file("test-data/date=2020-01-01")
+    first_etl.save(test_output_folder)
+
+    # ACT
+    etl = Etl()
+    etl.load_previous_output(test_output_folder)
+    etl.load_from_file("test-data/date=2020-01-01")
+    etl.save(test_output_folder)
+
+    # ASSERT
+    assert os.path.isfile(os.path.join(test_output_folder, etl.input_manifest_output_filename))
+    assert etl.rejected_input_count() == 0
+    assert etl.transaction_count() == first_etl.transaction_count()
+
+
+# WHEN: Customers and products are loaded in upsert mode, line by line and decoded in bulk, with updates of rows
+# already loaded, including a stale customer update and an update of an erased customer.
+# RESULT: Each row holds its latest version, stale updates are rejected, and the erased customer stays anonymized.
+def test_etl_upsert(request):
+    # PREPARE
+    def customer(id, first_name, email, last_change):
+        return {"id": id, "first_name": first_name, "last_name": "Smith", "email": email, "last_change": last_change}
+
+    customer_data = "\n".join(json.dumps(record) for record in [
+        customer(1, "Ann", "ann@example.com", "2020-01-02"),
+        customer(2, "Bob", "bob@example.com", "2020-01-02"),
+        customer(1, "Annie", "annie@example.com", "2020-01-03"),
+        customer(2, "Robert", "robert@example.com", "2020-01-01"),
+        customer(3, "Cat", "cat@example.com", "2020-01-02")
+    ]).encode() + b"\n"
+    customer_update_data = (json.dumps(customer(3, "Cathy", "cathy@example.com", "2020-01-04")) + "\n").encode()
+    product_data = "\n".join(json.dumps({"sku": sku, "name": name, "price": price, "category": "food", "popularity": 0.5})
+                             for sku, name, price in [(1, "Apple", "1.00"), (2, "Pear", "2.00"), (1, "Green apple", "1.25")]).encode() + b"\n"
+
+    # ACT
+    etls = []
+    for bulk in [False, True]:
+        test_output_folder = os.path.join("test-output", request.node.name, "bulk" if bulk else "lines")
+        etl = Etl(upsert=True)
+        if bulk:
+            etl.load_decoded_customers(decode_customers_data("customers", customer_data, vectorized=True))
+            etl.load_decoded_products(decode_products_data("products", product_data, vectorized=True))
+        else:
+            etl.load_customers_from_data(customer_data, "customers")
+            etl.load_products_from_data(product_data, "products")
+        etl.load_erasure_request(ErasureRequest(customer_id=3))
+        etl.load_customers_from_data(customer_update_data, "customer updates")
+        etl.save(test_output_folder)
+        etls.append((etl, test_output_folder))
+
+    # ASSERT
+    for etl, test_output_folder in etls:
+        assert etl.customer_count() == 3
+        assert etl.product_count() == 2
+        assert etl.rejected_input_count() == 1
+        assert set(etl.customer_email_to_rows) == {"annie@example.com", "bob@example.com", hashlib.md5(b"cathy@example.com").hexdigest()}
+        customers = read_all_customers(os.path.join(test_output_folder, etl.customers_output_filename))
+        assert [(customer.id, customer.first_name, customer.last_change) for customer in customers] == [
+            (1, "Annie", "2020-01-03"), (2, "Bob", "2020-01-02"), (3, hashlib.md5(b"Cathy").hexdigest(), "2020-01-04")]
+        products = read_all_products(os.path.join(test_output_folder, etl.products_output_filename))
+        assert [(product.sku, product.name, product.price) for product in products] == [(1, "Green apple", Decimal("1.25")), (2, "Pear", Decimal("2.00"))]
+        with open(os.path.join(test_output_folder, etl.rejected_input_details_output_filename)) as details_file:
+            assert [json.loads(line)["reason"] for line in details_file] == ["stale_record"]
+
+
+# WHEN: Transactions are saved as partitions by incremental runs, and by a streaming run.
+# RESULT: Each run only rewrites the partitions it has new transactions for, and all runs save the same transactions.
+def test_etl_partitioned_transactions(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    stream_output_folder = os.path.join("test-output", request.node.name + "_stream")
+    landing_folder = os.path.join("test-output", request.node.name + "_landing")
+    for folder in [test_output_folder, stream_output_folder, landing_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+    date_folders = sorted(os.listdir("test-data"))
+    transactions_folder = os.path.join(test_output_folder, Etl.transactions_output_dirname)
+
+    # ACT
+    for date_folder in date_folders[:-3]:
+        shutil.copytree(os.path.join("test-data", date_folder), os.path.join(landing_folder, date_folder))
+    etl = Etl(partition_transactions=True)
+    etl.load_from_file(landing_folder)
+    etl.save(test_output_folder)
+    first_run_files = {filepath: filepath.stat().st_mtime_ns for filepath in Path(transactions_folder).rglob("*.parquet")}
+
+    for date_folder in date_folders[-3:]:
+        shutil.copytree(os.path.join("test-data", date_folder), os.path.join(landing_folder, date_folder))
+    etl = Etl(partition_transactions=True)
+    etl.load_previous_output(test_output_folder)
+    etl.load_from_file(landing_folder)
+    etl.save(test_output_folder)
+    second_run_files = {filepath: filepath.stat().st_mtime_ns for filepath in Path(transactions_folder).rglob("*.parquet")}
+
+    stream_etl = Etl(partition_transactions=True, stream_output_folder=stream_output_folder, row_group_rows=1000)
+    stream_etl.load_from_file("test-data")
+    stream_etl.save()
+
+    # ASSERT
+    assert etl.transaction_count() == stream_etl.transaction_count() == 9701
+    rewritten_files = [filepath for filepath in first_run_files if second_run_files[filepath] != first_run_files[filepath]]
+    new_files = [filepath for filepath in second_run_files if filepath not in first_run_files]
+    # Earlier partitions are only rewritten to anonymize the transactions of customers erased by the second run.
+    assert len(rewritten_files) < len(first_run_files)
+    assert all(set(pq.read_table(filepath, columns=["customer_id"]).column("customer_id").to_pylist()) & etl.erased_customer_ids
+               for filepath in rewritten_files)
+    assert len(new_files) > 0
+    assert all(filepath.parts[-3] in date_folders[-3:] for filepath in new_files)
+
+    transactions = read_transactions_table(transactions_folder).sort_by("transaction_id")
+    stream_transactions = read_transactions_table(os.path.join(stream_output_folder, Etl.transactions_output_dirname)).sort_by("transaction_id")
+    assert transactions.num_rows == 9701
+    assert transactions.equals(stream_transactions)
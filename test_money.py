@@ -0,0 +1,81 @@
+from money import PRODUCT_PRICE_SCALE, money_array, parse_money, money_to_decimal, decimal_to_unscaled_int64
+from transaction import Transaction
+from dataclasses import asdict
+from product import Product
+from decimal import Decimal
+import pyarrow as pa
+import pytest
+import json
+
+
+# WHEN: Money amounts are parsed from the forms json input and parquet hold them.
+# RESULT: Each is held as an exact integer count of units at the scale.
+def test_parse_money():
+    # ACT
+    # ASSERT
+    assert parse_money("16.99") == 1699
+    assert parse_money("-0.5") == -50
+    assert parse_money(" 3 ") == 300
+    assert parse_money("16.990") == 1699
+    assert parse_money("1e2") == 10000
+    assert parse_money(25) == 2500
+    assert parse_money(16.99) == 1699
+    assert parse_money(Decimal("16.99")) == 1699
+    assert parse_money("1.005", PRODUCT_PRICE_SCALE) == 1005
+    assert money_to_decimal(1699) == Decimal("16.99")
+
+
+# WHEN: Money amounts are not numbers, carry more decimal places than the scale, or are too large.
+# RESULT: They are refused rather than rounded.
+@pytest.mark.parametrize("value", ["1.005", "16.99x", "", "NaN", True, None, "1000000000000.00"])
+def test_parse_money_refuses_invalid_amounts(value):
+    # ACT
+    # ASSERT
+    with pytest.raises(ValueError):
+        parse_money(value)
+
+
+# WHEN: A decimal128 array is built from integer units.
+# RESULT: It matches the array arrow builds from the Decimal values, and converts back to the same units.
+def test_money_array():
+    # PREPARE
+    units = [0, 1699, -50, 99999999999, -99999999999]
+    decimal_type = pa.decimal128(12, 2)
+
+    # ACT
+    array = money_array(units, decimal_type)
+
+    # ASSERT
+    assert array.equals(pa.array([money_to_decimal(unit) for unit in units], type=decimal_type))
+    assert decimal_to_unscaled_int64(array).tolist() == units
+    assert decimal_to_unscaled_int64(array.slice(1, 2)).tolist() == [1699, -50]
+
+
+# WHEN: A transaction's purchases don't add up, by a fraction of a cent.
+# RESULT: The transaction is refused, for the price carrying more decimal places than cents.
+def test_transaction_money_scale_is_checked():
+    # PREPARE
+    transaction = {"transaction_id": "1", "customer_id": 1, "transaction_time": "2022-07-01T16:05:08",
+                   "purchases": {"products": [{"sku": 1, "quantity": 1, "price": "1.005", "total": "1.005"}], "total_cost": "1.01"}}
+
+    # ACT
+    # ASSERT
+    with pytest.raises(ValueError, match="decimal places"):
+        Transaction.from_string(json.dumps(transaction))
+
+
+# WHEN: A product is built from a price already in thousandths, then rebuilt from itself, and from its fields.
+# RESULT: Each holds the same price, as a Decimal and in thousandths, rather than scaling it again.
+def test_product_from_units_is_not_scaled_again():
+    # PREPARE
+    product = Product.from_units(sku=1, name="Apple", price_units=1250, category="food", popularity=0.5)
+
+    # ACT
+    rebuilt_product = Product(**asdict(product))
+    product.__post_init__()
+
+    # ASSERT
+    for held_product in [product, rebuilt_product]:
+        assert held_product.price == Decimal("1.25")
+        assert held_product.price_units == 1250
+        assert held_product.to_parquet_row()[2] == 1250
@@ -0,0 +1,107 @@
+from parquet_erasure import erase_customers, erase_transactions, parquet_filepaths
+from output_changes import change_filepaths
+from erasure_request import ErasureRequest
+from transaction import read_transactions_table
+from customer import read_customers_table
+from product import read_products_table
+from etl import Etl
+import shutil
+import json
+import os
+
+
+def customer_line(customer_id: int, first_name: str, last_change: str):
+    return json.dumps({"id": str(customer_id), "first_name": first_name, "last_name": "Smith", "email": f"{customer_id}@example.org",
+                       "last_change": last_change})
+
+
+def transaction_line(transaction_id: str, customer_id: int):
+    return json.dumps({"transaction_id": transaction_id, "transaction_time": "2020-01-01T10:00:00", "customer_id": str(customer_id),
+                       "delivery_address": {"address": f"{customer_id} Street", "postcode": "E90 2FT", "city": "Maria Ville", "country": "United Kingdom"},
+                       "purchases": {"products": [{"sku": 1, "quanitity": 1, "price": "1.00", "total": "1.00"}], "total_cost": "1.00"}})
+
+
+# WHEN: An etl process saves, then updates, erases and adds rows, and saves back to the same folder without compacting.
+# RESULT: Only change files are written, the output read with them holds the same rows as a full save, and a later run
+# continues from it. Compacting then rewrites the output files, and removes the change files.
+def test_save_changes_without_compacting(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    full_output_folder = os.path.join("test-output", request.node.name + "_full")
+    for folder in [test_output_folder, full_output_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+    customers_filepath = os.path.join(test_output_folder, Etl.customers_output_filename)
+    products_filepath = os.path.join(test_output_folder, Etl.products_output_filename)
+    transactions_filepath = os.path.join(test_output_folder, Etl.transactions_output_filename)
+    etl = Etl(upsert=True)
+    etl.load_products_from_data(b'{"sku": 1, "name": "Apple", "price": "1.00", "category": "food", "popularity": 0.5}\n', "products")
+    etl.load_customers_from_data("\n".join(customer_line(customer_id, "First", "2020-01-01") for customer_id in range(5)).encode() + b"\n", "customers")
+    etl.load_transactions_from_data("\n".join(transaction_line(f"t{customer_id}", customer_id) for customer_id in range(5)).encode() + b"\n", "transactions")
+    etl.save(test_output_folder)
+    saved_mtimes = [os.stat(filepath).st_mtime_ns for filepath in [customers_filepath, products_filepath, transactions_filepath]]
+
+    # ACT
+    etl.load_products_from_data(b'{"sku": 1, "name": "Green apple", "price": "1.25", "category": "food", "popularity": 0.5}\n', "products")
+    etl.load_customers_from_data((customer_line(1, "Updated", "2020-01-02") + "\n" + customer_line(5, "New", "2020-01-02") + "\n").encode(), "customers")
+    etl.load_erasure_request_from_string('{"customer-id": "3"}')
+    etl.load_transactions_from_data((transaction_line("t5", 3) + "\n").encode(), "transactions")
+    etl.save(test_output_folder, compact=False)
+    changed_mtimes = [os.stat(filepath).st_mtime_ns for filepath in [customers_filepath, products_filepath, transactions_filepath]]
+    change_file_counts = [len(change_filepaths(filepath)) for filepath in [customers_filepath, products_filepath, transactions_filepath]]
+    etl.save(full_output_folder)
+    changed_tables = [read_customers_table(customers_filepath), read_products_table(products_filepath), read_transactions_table(transactions_filepath)]
+    continued_etl = Etl(upsert=True)
+    continued_etl.load_previous_output(test_output_folder)
+    continued_etl.save(test_output_folder)
+
+    # ASSERT
+    assert changed_mtimes == saved_mtimes
+    assert change_file_counts == [1, 1, 1]
+    full_tables = [read_customers_table(os.path.join(full_output_folder, Etl.customers_output_filename)),
+                   read_products_table(os.path.join(full_output_folder, Etl.products_output_filename)),
+                   read_transactions_table(os.path.join(full_output_folder, Etl.transactions_output_filename))]
+    assert changed_tables == full_tables
+    assert changed_tables[0].column("first_name").to_pylist()[:2] == ["First", "Updated"]
+    assert changed_tables[0].num_rows == 6
+    assert read_customers_table(customers_filepath, ids=[1]).column("first_name").to_pylist() == ["Updated"]
+    assert [read_customers_table(customers_filepath), read_products_table(products_filepath), read_transactions_table(transactions_filepath)] == full_tables
+    assert [len(change_filepaths(filepath)) for filepath in [customers_filepath, products_filepath, transactions_filepath]] == [0, 0, 0]
+
+
+# WHEN: Erasure requests are applied to saved output, for customers whose rows, and transactions, are partly or only in
+# the change files saved without compacting.
+# RESULT: The output read with its change files is erased as the etl process erases the same customers in memory.
+def test_erasure_of_saved_changes(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    erased_output_folder = os.path.join("test-output", request.node.name + "_erased")
+    for folder in [test_output_folder, erased_output_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+    customers_filepath = os.path.join(test_output_folder, Etl.customers_output_filename)
+    transactions_filepath = os.path.join(test_output_folder, Etl.transactions_output_filename)
+    etl = Etl(upsert=True)
+    etl.load_products_from_data(b'{"sku": 1, "name": "Apple", "price": "1.00", "category": "food", "popularity": 0.5}\n', "products")
+    etl.load_customers_from_data("\n".join(customer_line(customer_id, "First", "2020-01-01") for customer_id in range(3)).encode() + b"\n", "customers")
+    etl.load_transactions_from_data((transaction_line("t1", 1) + "\n").encode(), "transactions")
+    etl.save(test_output_folder)
+    etl.load_customers_from_data((customer_line(1, "Updated", "2020-01-02") + "\n" + customer_line(3, "New", "2020-01-02") + "\n").encode(), "customers")
+    etl.load_transactions_from_data((transaction_line("t2", 1) + "\n" + transaction_line("t3", 3) + "\n").encode(), "transactions")
+    etl.save(test_output_folder, compact=False)
+    erasure_requests = [ErasureRequest(customer_id=3), ErasureRequest(email="1@example.org")]
+
+    # ACT
+    erased_customer_ids = erase_customers(customers_filepath, erasure_requests)
+    erase_transactions(transactions_filepath, erased_customer_ids)
+    for erasure_request in erasure_requests:
+        etl.load_erasure_request(erasure_request)
+    etl.save(erased_output_folder)
+    # An output file with no rows is saved empty, and holds nothing to erase.
+    with open(os.path.join(erased_output_folder, "empty.parquet"), mode='w'):
+        pass
+
+    # ASSERT
+    assert sorted(erased_customer_ids) == [1, 3]
+    assert read_customers_table(customers_filepath) == read_customers_table(os.path.join(erased_output_folder, Etl.customers_output_filename))
+    assert read_transactions_table(transactions_filepath) == read_transactions_table(os.path.join(erased_output_folder, Etl.transactions_output_filename))
+    assert "Updated" not in read_customers_table(customers_filepath).column("first_name").to_pylist()
+    assert len(parquet_filepaths(test_output_folder)) == len(parquet_filepaths(erased_output_folder)) + 2
@@ -0,0 +1,93 @@
+from parquet_erasure import erase_customers, candidate_row_groups
+from erasure_request import ErasureRequest
+from customer import read_all_customers
+import pyarrow.parquet as pq
+from etl import Etl
+import shutil
+import json
+import os
+
+
+# WHEN: Erasure requests are applied to a customers file already saved, by id and by email.
+# RESULT: Only the row groups the requests match are read, and the customers are anonymized as the etl process would.
+def test_erase_saved_customers(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    erased_output_folder = os.path.join("test-output", request.node.name + "_erased")
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    etl = Etl()
+    etl.load_from_file("test-data")
+    customers = etl.customers.to_table().sort_by("id")
+    customers_filepath = os.path.join(test_output_folder, etl.customers_output_filename)
+    os.makedirs(test_output_folder)
+    pq.write_table(customers, customers_filepath, row_group_size=100)
+    first_customer, last_customer = customers.slice(0, 1).to_pylist()[0], customers.slice(customers.num_rows - 1, 1).to_pylist()[0]
+    erasure_requests = [ErasureRequest(customer_id=first_customer["id"]), ErasureRequest(email=last_customer["email"])]
+
+    # ACT
+    candidates = candidate_row_groups(pq.ParquetFile(customers_filepath), [first_customer["id"]], [])
+    anonymized_ids = erase_customers(customers_filepath, erasure_requests)
+    for erasure_request in erasure_requests:
+        etl.load_erasure_request(erasure_request)
+    erased_customers = etl.customers.to_table().sort_by("id")
+
+    # ASSERT
+    assert candidates == [0]
+    assert first_customer["id"] in anonymized_ids and last_customer["id"] in anonymized_ids
+    assert pq.ParquetFile(customers_filepath).num_row_groups == 8
+    assert pq.read_table(customers_filepath).equals(erased_customers)
+    assert not os.path.exists(customers_filepath + ".tmp")
+    assert erase_customers(customers_filepath, [ErasureRequest(customer_id=-1)]) == []
+
+
+# WHEN: A streaming etl process receives erasure requests for customers it has already written out.
+# RESULT: The customers are anonymized in the saved file, as the in-memory etl process anonymizes them.
+def test_etl_streaming_erasure_of_flushed_customers(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    in_memory_output_folder = os.path.join("test-output", request.node.name + "_in_memory")
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    etl = Etl(stream_output_folder=test_output_folder, row_group_rows=100)
+    in_memory_etl = Etl()
+
+    # ACT
+    etl.load_from_file("test-data")
+    flushed_erasure_count = etl.stats()["rows"]["flushed_customers_to_anonymize"]
+    etl.save()
+    in_memory_etl.load_from_file("test-data")
+    in_memory_etl.save(in_memory_output_folder)
+
+    # ASSERT
+    assert flushed_erasure_count > 0
+    assert etl.stats()["rows"]["flushed_customers_to_anonymize"] == 0
+    assert read_all_customers(os.path.join(test_output_folder, etl.customers_output_filename)) == \
+        read_all_customers(os.path.join(in_memory_output_folder, etl.customers_output_filename))
+
+
+# WHEN: A streaming etl process receives several erasure requests for a customer it has already written out.
+# RESULT: The customer is anonymized in the saved file once for each request, as the in-memory etl process anonymizes it.
+def test_etl_streaming_repeated_erasure_of_flushed_customer(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    in_memory_output_folder = os.path.join("test-output", request.node.name + "_in_memory")
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    customers_data = "\n".join(json.dumps({"id": str(customer_id), "first_name": "First", "last_name": "Smith", "email": f"{customer_id}@example.org",
+                                           "last_change": "2020-01-01"}) for customer_id in range(6)).encode() + b"\n"
+    erasure_requests = [ErasureRequest(customer_id=1), ErasureRequest(customer_id=2), ErasureRequest(customer_id=1), ErasureRequest(customer_id=1)]
+    etl = Etl(stream_output_folder=test_output_folder, row_group_rows=2)
+    in_memory_etl = Etl()
+
+    # ACT
+    for each_etl in [etl, in_memory_etl]:
+        each_etl.load_customers_from_data(customers_data, "customers")
+        for erasure_request in erasure_requests:
+            each_etl.load_erasure_request(erasure_request)
+    flushed_erasure_count = etl.stats()["rows"]["flushed_customers_to_anonymize"]
+    etl.save()
+    in_memory_etl.save(in_memory_output_folder)
+
+    # ASSERT
+    assert flushed_erasure_count == 2
+    customers = read_all_customers(os.path.join(test_output_folder, etl.customers_output_filename))
+    assert customers == read_all_customers(os.path.join(in_memory_output_folder, etl.customers_output_filename))
+    assert len(set(customer.email for customer in customers)) == 6
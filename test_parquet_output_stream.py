@@ -0,0 +1,68 @@
+from parquet_output_stream import PartitionedParquetOutputStream
+import pyarrow.parquet as pq
+import pyarrow as pa
+from pathlib import Path
+import shutil
+import os
+
+
+# WHEN: More rows than a row group holds are streamed into one partition, flushed a row group at a time, with a limit on
+# the rows of each file.
+# RESULT: The partition's file is kept open across flushes, with a row group per flush, and rolled over once full.
+def test_partitioned_output_stream_rolls_files(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    schema = pa.schema([pa.field("id", pa.int64())])
+    stream = PartitionedParquetOutputStream(test_output_folder, schema, pa.schema([pa.field("bucket", pa.string())]),
+                                            lambda table: table.append_column("bucket", pa.array(["a"] * table.num_rows)),
+                                            row_group_rows=20, file_rows=100)
+
+    # ACT
+    buffered_ids = []
+    for row_id in range(250):
+        buffered_ids.append(row_id)
+        if stream.should_flush(len(buffered_ids)):
+            stream.write(pa.table({"id": buffered_ids}, schema=schema))
+            buffered_ids = []
+    stream.write(pa.table({"id": buffered_ids}, schema=schema))
+    stream.close()
+
+    # ASSERT
+    filepaths = sorted(Path(test_output_folder).rglob("*.parquet"))
+    assert [filepath.relative_to(test_output_folder).parts for filepath in filepaths] == \
+        [("bucket=a", f"part-{file_number}.parquet") for file_number in range(3)]
+    assert [pq.ParquetFile(filepath).metadata.num_row_groups for filepath in filepaths] == [5, 5, 3]
+    assert [pq.ParquetFile(filepath).metadata.num_rows for filepath in filepaths] == [100, 100, 50]
+    assert pa.concat_tables([pq.read_table(filepath) for filepath in filepaths]).column("id").to_pylist() == list(range(250))
+    assert stream.flushed_rows == 250
+
+
+# WHEN: Rows are streamed into more partitions than files may be kept open, returning to a partition after it was closed.
+# RESULT: No more files are open at once than allowed, and the partition continues in a new file, with its rows in order.
+def test_partitioned_output_stream_limits_open_files(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    schema = pa.schema([pa.field("id", pa.int64())])
+    # Ids are written to bucket a, b or c by their tens.
+    stream = PartitionedParquetOutputStream(test_output_folder, schema, pa.schema([pa.field("bucket", pa.string())]),
+                                            lambda table: table.append_column("bucket", pa.array(
+                                                ["abc"[row_id // 10 % 3] for row_id in table.column("id").to_pylist()])),
+                                            row_group_rows=20, file_rows=100, max_open_files=2)
+
+    # ACT
+    open_file_counts = []
+    for write_number in range(5):
+        stream.write(pa.table({"id": [write_number * 10 + i for i in range(10)]}, schema=schema))
+        open_file_counts.append(len(stream.partition_writers))
+    stream.close()
+
+    # ASSERT
+    assert max(open_file_counts) == 2
+    filepaths = sorted(Path(test_output_folder).rglob("*.parquet"))
+    assert [filepath.relative_to(test_output_folder).parts for filepath in filepaths] == [
+        ("bucket=a", "part-0.parquet"), ("bucket=a", "part-1.parquet"), ("bucket=b", "part-0.parquet"), ("bucket=b", "part-1.parquet"),
+        ("bucket=c", "part-0.parquet")]
+    assert pa.concat_tables([pq.read_table(filepath) for filepath in filepaths[:2]]).column("id").to_pylist() == \
+        list(range(0, 10)) + list(range(30, 40))
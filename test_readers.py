@@ -0,0 +1,113 @@
+from transaction import read_transactions_table, read_all_transactions, transaction_filter, Transaction
+from product import read_products_table, read_all_products
+from customer import read_customers_table
+from datetime import datetime
+import pyarrow.dataset as ds
+import pyarrow as pa
+from etl import Etl
+import os
+
+
+# WHEN: Transactions are read with a column projection and a time range filter.
+# RESULT: Only the requested columns and matching rows are returned, and row groups outside the range are skipped.
+def test_read_transactions_table_filters(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl = Etl(stream_output_folder=test_output_folder, row_group_rows=1000)
+    etl.load_from_file("test-data")
+    etl.save()
+    transactions_filepath = os.path.join(test_output_folder, etl.transactions_output_filename)
+    start_time = datetime(2020, 1, 3)
+    end_time = datetime(2020, 1, 4)
+
+    # ACT
+    table = read_transactions_table(transactions_filepath, columns=["transaction_id", "transaction_time"],
+                                    start_time=start_time, end_time=end_time)
+
+    # ASSERT
+    expected_ids = [transaction.transaction_id for transaction in read_all_transactions(transactions_filepath)
+                    if start_time <= transaction.transaction_time < end_time]
+    assert table.column_names == ["transaction_id", "transaction_time"]
+    assert table.column("transaction_id").to_pylist() == expected_ids
+    assert len(expected_ids) > 0
+
+    # Transactions arrive in time order, so most row groups fall outside the range, and are pruned by their statistics.
+    dataset = ds.dataset(transactions_filepath, schema=pa.schema(Transaction.parquet_struct()), format="parquet")
+    fragment = next(dataset.get_fragments())
+    matching_row_groups = fragment.split_by_row_group(transaction_filter(start_time, end_time))
+    assert 0 < len(list(matching_row_groups)) < fragment.num_row_groups
+
+
+# WHEN: Products and customers are read with key and category filters.
+# RESULT: Only the matching rows are returned, and the object readers agree with the table readers.
+def test_read_products_and_customers_filters(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl = Etl()
+    etl.load_customers_from_gzip_file("test-data/date=2020-01-01/hour=00/customers.json.gz")
+    etl.load_products_from_gzip_file("test-data/date=2020-01-01/hour=00/products.json.gz")
+    etl.save(test_output_folder)
+    products_filepath = os.path.join(test_output_folder, etl.products_output_filename)
+    customers_filepath = os.path.join(test_output_folder, etl.customers_output_filename)
+    all_products = read_all_products(products_filepath)
+    category = all_products[0].category
+    customer_ids = read_customers_table(customers_filepath, columns=["id"]).column("id").to_pylist()[:3]
+
+    # ACT
+    category_products = read_products_table(products_filepath, category=category)
+    sku_products = read_all_products(products_filepath, skus=[all_products[1].sku])
+    customers = read_customers_table(customers_filepath, columns=["id", "email"], ids=customer_ids)
+
+    # ASSERT
+    assert category_products.column("sku").to_pylist() == [product.sku for product in all_products if product.category == category]
+    assert [product.sku for product in sku_products] == [all_products[1].sku]
+    assert customers.column("id").to_pylist() == customer_ids
+    assert customers.column_names == ["id", "email"]
+
+
+# WHEN: An empty output file is read.
+# RESULT: An empty table with the requested columns is returned.
+def test_read_empty_output(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl = Etl()
+    etl.save(test_output_folder)
+
+    # ACT
+    table = read_transactions_table(os.path.join(test_output_folder, etl.transactions_output_filename), columns=["customer_id"])
+
+    # ASSERT
+    assert table.num_rows == 0
+    assert table.column_names == ["customer_id"]
+
+
+# WHEN: Transactions are saved as a partitioned dataset, and read with a time range filter.
+# RESULT: Partitions outside the range are not read, and the same transactions are read as from a single file.
+def test_read_partitioned_transactions(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    single_file_output_folder = os.path.join("test-output", request.node.name + "_single_file")
+    etl = Etl(partition_transactions=True)
+    etl.load_from_file("test-data")
+    etl.save(test_output_folder)
+    single_file_etl = Etl()
+    single_file_etl.load_from_file("test-data")
+    single_file_etl.save(single_file_output_folder)
+    transactions_folder = os.path.join(test_output_folder, etl.transactions_output_dirname)
+    transactions_filepath = os.path.join(single_file_output_folder, etl.transactions_output_filename)
+    start_time = datetime(2020, 1, 3, 5, 30)
+    end_time = datetime(2020, 1, 3, 7)
+    # Partitions outside the range can't be read once corrupted.
+    for partition_folder in ["date=2020-01-02/hour=23", "date=2020-01-03/hour=07"]:
+        with open(os.path.join(transactions_folder, partition_folder, "part-0.parquet"), mode='wb') as partition_file:
+            partition_file.write(b"not parquet")
+
+    # ACT
+    table = read_transactions_table(transactions_folder, start_time=start_time, end_time=end_time)
+
+    # ASSERT
+    assert sorted(os.listdir(os.path.join(transactions_folder, "date=2020-01-03")))[:2] == ["hour=00", "hour=01"]
+    assert table.schema == pa.schema(Transaction.parquet_struct())
+    expected = read_transactions_table(transactions_filepath, start_time=start_time, end_time=end_time)
+    assert table.num_rows > 0
+    assert table.sort_by("transaction_id").equals(expected.sort_by("transaction_id"))
@@ -0,0 +1,102 @@
+from transaction import Purchases, PurchasesColumn, ProductPurchase
+from record_store import RecordStore
+from decimal import Decimal
+import pyarrow as pa
+import pytest
+
+
+SCHEMA = pa.schema([pa.field('id', pa.int64()), pa.field('name', pa.string())])
+
+
+# WHEN: Rows are appended past the batch size.
+# RESULT: The full rows are sealed into record batches, and all rows are kept in order.
+def test_record_store_seals_batches():
+    # PREPARE
+    store = RecordStore(SCHEMA, batch_rows=2)
+
+    # ACT
+    for id in range(5):
+        store.append([id, f"name-{id}"])
+
+    # ASSERT
+    assert len(store) == 5
+    assert len(store.batches) == 2
+    assert store.get(1, "name") == "name-1"
+    assert store.get(4, "name") == "name-4"
+    assert store.to_table().column("id").to_pylist() == [0, 1, 2, 3, 4]
+
+
+# WHEN: Values are changed in rows that have, and have not, been sealed.
+# RESULT: The changed values are read back, and are included in the table.
+def test_record_store_set_values():
+    # PREPARE
+    store = RecordStore(SCHEMA, batch_rows=2)
+    for id in range(3):
+        store.append([id, f"name-{id}"])
+
+    # ACT
+    store.set(1, "name", "changed-1")
+    store.set(2, "name", "changed-2")
+
+    # ASSERT
+    assert store.row(1) == {"id": 1, "name": "changed-1"}
+    assert store.row(2) == {"id": 2, "name": "changed-2"}
+    assert store.to_table().column("name").to_pylist() == ["name-0", "changed-1", "changed-2"]
+    assert store.get(1, "name") == "changed-1"
+
+
+# WHEN: Transactions are stored, and one's purchases changed before and after its row is sealed.
+# RESULT: The purchases column matches arrow's own conversion of the purchase values, and the stored Purchases objects
+# are left unchanged.
+def test_record_store_purchases_column():
+    # PREPARE
+    purchases_type = Purchases.parquet_struct()
+    purchase_dicts = [
+        {"total_cost": "3.50", "products": [{"sku": 1, "quantity": 1, "price": "1.50", "total": "1.50"},
+                                            {"sku": 2, "quantity": 2, "price": "1.00", "total": "2.00"}]},
+        {"total_cost": "0", "products": []},
+        {"total_cost": "-4.99", "products": [{"sku": 3, "quanitity": None, "price": "-4.99", "total": "-4.99"}]}
+    ]
+    store = RecordStore(pa.schema([pa.field('purchases', purchases_type)]), batch_rows=2,
+                        column_converters={'purchases': PurchasesColumn()})
+    purchases_list = [Purchases(purchase_dict) for purchase_dict in purchase_dicts]
+
+    # ACT
+    for purchases in purchases_list:
+        store.append([purchases])
+    store.set(2, "purchases", purchases_list[0])
+    store.set(0, "purchases", purchases_list[2])
+    table = store.to_table()
+
+    # ASSERT
+    expected_dicts = [purchase_dicts[2], purchase_dicts[1], purchase_dicts[0]]
+    expected = [{"total_cost": Decimal(purchase_dict["total_cost"]),
+                 "products": [{"sku": product["sku"], "quantity": product.get("quantity"), "price": Decimal(product["price"]),
+                               "total": Decimal(product["total"])} for product in purchase_dict["products"]]}
+                for purchase_dict in expected_dicts]
+    assert table.column("purchases").combine_chunks().equals(pa.array(expected, type=purchases_type))
+    assert store.get(0, "purchases").total_cost == Decimal("-4.99")
+    assert store.get(2, "purchases").products[1].total == Decimal("2.00")
+    assert all(isinstance(product, ProductPurchase) for product in purchases_list[0].products)
+
+
+# WHEN: A row whose value its column can't hold is appended, completing a batch.
+# RESULT: The seal fails, and the row is taken back out, leaving the rows before it to be sealed with the next row.
+def test_record_store_failed_seal_keeps_rows():
+    # PREPARE
+    store = RecordStore(pa.schema([pa.field('purchases', Purchases.parquet_struct())]), batch_rows=2,
+                        column_converters={'purchases': PurchasesColumn()})
+    purchases_list = [Purchases({"total_cost": "1.00", "products": [{"sku": sku, "quantity": 1, "price": "1.00", "total": "1.00"}]})
+                      for sku in range(3)]
+    purchases_list[1].products[0].quantity = "2"
+    store.append([purchases_list[0]])
+
+    # ACT
+    with pytest.raises(Exception):
+        store.append([purchases_list[1]])
+    store.append([purchases_list[2]])
+
+    # ASSERT
+    assert len(store) == 2
+    assert len(store.batches) == 1
+    assert [product["sku"] for purchases in store.to_table().column("purchases").to_pylist() for product in purchases["products"]] == [0, 2]
@@ -0,0 +1,70 @@
+from rejected_input_sink import RejectedInputSink
+from etl import Etl
+import json
+import gzip
+import os
+
+
+# WHEN: The etl process loads a large and varied dataset.
+# RESULT: Each rejected line is saved with its source file, line number and rejection reason.
+def test_rejected_input_details(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl = Etl()
+
+    # ACT
+    etl.load_from_file("test-data")
+    etl.save(test_output_folder)
+
+    # ASSERT
+    with open(os.path.join(test_output_folder, etl.rejected_input_output_filename), mode='rb') as reject_file:
+        rejected_input_lines = reject_file.readlines()
+    with open(os.path.join(test_output_folder, etl.rejected_input_details_output_filename)) as details_file:
+        details = [json.loads(line) for line in details_file]
+    assert len(rejected_input_lines) == len(details) == 360
+    for rejected_input_line, rejection in zip(rejected_input_lines, details):
+        with gzip.open(rejection["source"]) as input_file:
+            input_line = input_file.readlines()[rejection["line_number"] - 1]
+        assert rejected_input_line == bytes(rejection["source"] + ": ", 'utf-8') + input_line
+    assert {rejection["reason"] for rejection in details} == {"invalid_record", "duplicate_key", "unknown_customer", "unknown_product"}
+
+
+# WHEN: Many lines are rejected for the same reason.
+# RESULT: The first rejection is logged in full, and the rest only as a count.
+def test_rejection_logging_is_rate_limited():
+    # PREPARE
+    log_lines = []
+    sink = RejectedInputSink(log_interval_seconds=3600, log=log_lines.append)
+
+    # ACT
+    for line_number in range(1, 1001):
+        sink.reject("products", "products.json.gz", line_number, b'{"sku": 1}\n', "invalid_record", "Product name is mandatory.")
+    sink.reject("customers", "customers.json.gz", 1, b'{"id": 1}\n', "duplicate_key", "Duplicate.")
+    sink.log_counts()
+
+    # ASSERT
+    assert log_lines == [
+        "Rejected products line 1 of products.json.gz (invalid_record): Product name is mandatory.",
+        "Rejected customers line 1 of customers.json.gz (duplicate_key): Duplicate.",
+        "Rejected 999 more products (invalid_record), 1000 in total."
+    ]
+    assert sink.count == 1001
+
+
+# WHEN: A streaming etl process rejects input.
+# RESULT: The rejected input is written to the output folder as it is rejected, before saving.
+def test_streaming_rejected_input(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    etl = Etl(stream_output_folder=test_output_folder)
+
+    # ACT
+    etl.load_products_from_gzip_file("test-data/date=2020-01-07/hour=00/products.json.gz")
+    etl.rejected_input.input_file.flush()
+    written_before_save = os.path.getsize(os.path.join(test_output_folder, etl.rejected_input_output_filename))
+    etl.save()
+
+    # ASSERT
+    assert written_before_save > 0
+    with open(os.path.join(test_output_folder, etl.rejected_input_output_filename), mode='rb') as reject_file:
+        assert len(reject_file.readlines()) == etl.rejected_input_count() == 2
@@ -0,0 +1,108 @@
+from state_store import MemoryStateStore, SqliteStateStore, MemoryRowsStateStore, SqliteRowsStateStore, open_state_store
+import pyarrow.parquet as pq
+import pyarrow as pa
+from etl import Etl
+import shutil
+import os
+
+
+# WHEN: Keys are set, overwritten, deleted and looked up in an sqlite state store whose cache holds fewer keys.
+# RESULT: It behaves as the in-memory store does, whether keys are read from the cache, the pending writes or disk.
+def test_sqlite_state_store(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    os.makedirs(test_output_folder)
+    stores = [MemoryStateStore(), SqliteStateStore(os.path.join(test_output_folder, "state.sqlite"), cache_keys=3, write_batch_keys=4)]
+
+    # ACT
+    for store in stores:
+        for key in range(10):
+            store[key] = key * 10
+        store[2] = 200
+        del store[3]
+        store.flush()
+        store[4] = 400
+        del store[5]
+
+    # ASSERT
+    for store in stores:
+        assert len(store) == 8
+        assert sorted(store) == [0, 1, 2, 4, 6, 7, 8, 9]
+        assert store[2] == 200 and store[4] == 400 and store[9] == 90
+        assert 3 not in store and 5 not in store and 10 not in store
+        assert store.get(5) is None
+        assert store.contains_keys(pa.array([0, 3, 4, 5, 10, 9, 0], pa.int64())).to_pylist() == [True, False, True, False, False, True, True]
+    stores[1].close()
+
+
+# WHEN: Rows are added to and removed from the keys of an sqlite rows state store whose cache holds fewer keys.
+# RESULT: It holds the same rows as the in-memory store, deleting keys left without rows.
+def test_sqlite_rows_state_store(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    os.makedirs(test_output_folder)
+    stores = [MemoryRowsStateStore(), SqliteRowsStateStore(os.path.join(test_output_folder, "state.sqlite"), cache_keys=2, write_batch_keys=3)]
+
+    # ACT
+    for store in stores:
+        for row in range(10):
+            store.add_row(f"{row % 4}@example.org", row)
+        store.remove_row("0@example.org", 4)
+        store.remove_row("3@example.org", 3)
+        store.remove_row("3@example.org", 7)
+        store.flush()
+        store.add_row("3@example.org", 10)
+
+    # ASSERT
+    for store in stores:
+        assert sorted(store.items()) == [("0@example.org", [0, 8]), ("1@example.org", [1, 5, 9]), ("2@example.org", [2, 6]),
+                                         ("3@example.org", [10])]
+        assert store.get("4@example.org", []) == []
+    stores[1].close()
+
+
+# WHEN: An on-disk state store is reopened, with and without `clear`.
+# RESULT: Its keys are only kept when it isn't cleared.
+def test_state_store_clear(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    store = open_state_store("index", test_output_folder)
+    store[1] = 10
+    store.close()
+
+    # ACT
+    kept_store = open_state_store("index", test_output_folder)
+    kept_keys = list(kept_store)
+    kept_store.close()
+    cleared_store = open_state_store("index", test_output_folder, clear=True)
+
+    # ASSERT
+    assert kept_keys == [1]
+    assert len(cleared_store) == 0
+    cleared_store.close()
+
+
+# WHEN: The etl process loads a large dataset, with its key indexes in an sqlite state store.
+# RESULT: The output is the same as with the indexes in memory.
+def test_etl_with_sqlite_state_store(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    memory_output_folder = os.path.join("test-output", request.node.name + "_memory")
+    etl = Etl(state_store_folder=os.path.join(test_output_folder, "state"), state_store_cache_keys=100)
+    memory_etl = Etl()
+
+    # ACT
+    etl.load_from_file("test-data")
+    etl.save(test_output_folder)
+    memory_etl.load_from_file("test-data")
+    memory_etl.save(memory_output_folder)
+
+    # ASSERT
+    assert etl.stats()["index_sizes"] == memory_etl.stats()["index_sizes"]
+    for output_filename in [etl.customers_output_filename, etl.products_output_filename, etl.transactions_output_filename]:
+        assert pq.read_table(os.path.join(test_output_folder, output_filename)).equals(
+            pq.read_table(os.path.join(memory_output_folder, output_filename)))
+    assert etl.rejected_input_count() == memory_etl.rejected_input_count() == 360
@@ -0,0 +1,66 @@
+from transaction_id_history import TransactionIdHistory
+import transaction_id_history
+from etl import Etl
+import shutil
+import os
+
+
+# WHEN: Ids are added to a transaction id history over several commits, spilling and merging run files, and it is
+# reopened, after more ids are added without a commit.
+# RESULT: The committed ids are found, including in run files merged a chunk at a time, and the uncommitted ones are not.
+def test_transaction_id_history(request, monkeypatch):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    monkeypatch.setattr(transaction_id_history, "MERGE_CHUNK_IDS", 7)
+    ids = [f"transaction-{i}" for i in range(1000)]
+    history = TransactionIdHistory(test_output_folder, expected_ids=100, spill_ids=50)
+
+    # ACT
+    for commit_start in range(0, 900, 150):
+        for transaction_id in ids[commit_start:commit_start + 150]:
+            history.add(transaction_id)
+        history.commit()
+    for transaction_id in ids[900:]:
+        history.add(transaction_id)
+    in_memory_found = [transaction_id in history for transaction_id in ids]
+    reopened_history = TransactionIdHistory(test_output_folder, expected_ids=100, spill_ids=50)
+    reopened_found = [transaction_id in reopened_history for transaction_id in ids]
+
+    # ASSERT
+    assert all(in_memory_found)
+    assert reopened_found == [True] * 900 + [False] * 100
+    assert len(reopened_history) == 900
+    run_filenames = [filename for filename in os.listdir(test_output_folder) if filename.startswith("run-")]
+    assert 1 < len(run_filenames) <= 5
+    assert not any(filename.startswith("pending-") for filename in os.listdir(test_output_folder))
+    assert not any(f"other-{i}" in reopened_history for i in range(1000))
+
+
+# WHEN: Two separate streaming runs, neither continuing from the other's output, share a transaction id history, and the
+# second loads all the data the first did again.
+# RESULT: The second run rejects the transactions the first saved as duplicates, and accepts all the others.
+def test_etl_with_transaction_id_history(request):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    landing_folder = os.path.join("test-output", request.node.name + "_landing")
+    history_folder = os.path.join(test_output_folder, "history")
+    for folder in [test_output_folder, landing_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+    date_folders = sorted(os.listdir("test-data"))
+    for date_folder in date_folders[:len(date_folders) // 2]:
+        shutil.copytree(os.path.join("test-data", date_folder), os.path.join(landing_folder, date_folder))
+
+    # ACT
+    first_etl = Etl(stream_output_folder=os.path.join(test_output_folder, "first"), transaction_id_history_folder=history_folder)
+    first_etl.load_from_file(landing_folder)
+    first_etl.save()
+    second_etl = Etl(stream_output_folder=os.path.join(test_output_folder, "second"), transaction_id_history_folder=history_folder)
+    second_etl.load_from_file("test-data")
+    second_etl.save()
+
+    # ASSERT
+    assert 0 < first_etl.transaction_count() < 9701
+    assert first_etl.transaction_count() + second_etl.transaction_count() == 9701
+    assert len(second_etl.transaction_id_to_row) == 0
+    assert second_etl.stats()["index_sizes"]["transaction_id_history"] == 9701
@@ -545,3 +545,25 @@ def test_transaction_totals_must_sum_to_total_cost():
     """
     with pytest.raises(Exception):
         Transaction.from_string(transaction_json)
+
+
+# Reject any transaction with a quantity that isn't an integer, as it is parsed, rather than when its rows are stored.
+def test_transaction_quantity_must_be_integer():
+    # PREPARE
+    etl = Etl()
+    etl.load_customers_from_data(b'{"id": "1", "first_name": "Ann", "last_name": "Smith", "email": "ann@example.org", "last_change": "2020-01-01"}\n', "customers")
+    etl.load_products_from_data(b'{"sku": 1, "name": "Apple", "price": "1.00", "category": "food", "popularity": 0.5}\n', "products")
+    transaction_lines = [
+        '{"transaction_id": "t%d", "transaction_time": "2020-01-01T10:00:00", "customer_id": "1", '
+        '"delivery_address": {"address": "1 Street", "postcode": "E90 2FT", "city": "Maria Ville", "country": "United Kingdom"}, '
+        '"purchases": {"products": [{"sku": 1, "quantity": %s, "price": "1.00", "total": "1.00"}], "total_cost": "1.00"}}' % (number, quantity)
+        for number, quantity in enumerate(["1", '"2"', "1.5", "true", "3"])]
+
+    # ACT
+    etl.load_transactions_from_data("\n".join(transaction_lines).encode() + b"\n", "transactions")
+
+    # ASSERT
+    assert etl.rejected_input_count() == 3
+    assert etl.transactions.to_table().column("transaction_id").to_pylist() == ["t0", "t4"]
+    with pytest.raises(Exception):
+        Transaction.from_string(transaction_lines[1])
@@ -0,0 +1,186 @@
+from ingestion_queue import IngestionQueue
+import flask_webservice
+import threading
+from etl import Etl
+import json
+
+
+# Serve the webservice requests from an ingestion queue loading into the given etl process.
+def start_ingestion_queue(monkeypatch, etl: Etl, max_pending_records: int = 10000):
+    ingestion_queue = IngestionQueue(etl, max_pending_records=max_pending_records)
+    ingestion_queue.start()
+    monkeypatch.setattr(flask_webservice, "ingestion_queue", ingestion_queue)
+    return ingestion_queue
+
+
+# WHEN: A bulk request posts newline delimited customers, including a duplicate and a malformed record.
+# RESULT: The valid customers are loaded, and the response reports each record as accepted or rejected.
+def test_bulk_customers(monkeypatch):
+    # PREPARE
+    ingestion_queue = start_ingestion_queue(monkeypatch, Etl())
+    client = flask_webservice.app.test_client()
+    customer = {"id": "347984", "first_name": "Georgia", "last_name": "Lewis", "email": "hollymillar@example.org"}
+    other_customer = dict(customer, id="347985")
+    body = "\n".join([json.dumps(customer), json.dumps(other_customer), json.dumps(customer), "{not json"]) + "\n"
+
+    # ACT
+    response = client.post("/customers", data=body, content_type="application/x-ndjson")
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert response.status_code == 200
+    assert response.json["accepted"] == 2
+    assert response.json["rejected"] == 2
+    assert [result["status"] for result in response.json["results"]] == ["accepted", "accepted", "rejected", "rejected"]
+    assert response.json["results"][2]["reason"] == "duplicate_key"
+    assert response.json["results"][3]["reason"] == "malformed_json"
+    assert ingestion_queue.etl.customer_count() == 2
+    assert ingestion_queue.etl.rejected_input_count() == 2
+
+
+# WHEN: Bulk requests post gzipped input files, decoded in bulk.
+# RESULT: The same records are accepted and rejected as when loading the files.
+def test_bulk_gzip_requests(monkeypatch):
+    # PREPARE
+    monkeypatch.setattr("etl.MIN_BULK_DATA_SIZE", 0)
+    ingestion_queue = start_ingestion_queue(monkeypatch, Etl(vectorized_ingest=True))
+    client = flask_webservice.app.test_client()
+    file_etl = Etl()
+    test_data_folder = "test-data/date=2020-01-01/hour=00"
+    file_etl.load_from_file(test_data_folder)
+
+    # ACT
+    responses = []
+    for path, filename in [("/customers", "customers.json.gz"), ("/products", "products.json.gz"), ("/transactions", "transactions.json.gz")]:
+        with open(f"{test_data_folder}/{filename}", mode='rb') as input_file:
+            responses.append(client.post(path, data=input_file.read(), content_type="application/x-ndjson",
+                                         headers={"Content-Encoding": "gzip"}))
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert sum(response.json["rejected"] for response in responses) == file_etl.rejected_input_count()
+    assert ingestion_queue.etl.customer_count() == file_etl.customer_count()
+    assert ingestion_queue.etl.product_count() == file_etl.product_count()
+    assert ingestion_queue.etl.transaction_count() == file_etl.transaction_count()
+    assert ingestion_queue.etl.transactions.to_table().equals(file_etl.transactions.to_table())
+
+
+# WHEN: A bulk request claims a gzip body which isn't gzipped.
+# RESULT: The request is rejected.
+def test_bulk_invalid_gzip(monkeypatch):
+    # PREPARE
+    ingestion_queue = start_ingestion_queue(monkeypatch, Etl())
+    client = flask_webservice.app.test_client()
+
+    # ACT
+    response = client.post("/erasure-requests", data=b'{"email": "a@example.org"}\n', headers={"Content-Encoding": "gzip"})
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert response.status_code == 400
+    assert ingestion_queue.etl.erasure_request_count() == 0
+
+
+# WHEN: Many request threads post customers at once.
+# RESULT: The writer thread loads every customer, and rejects every duplicate, keeping the indexes consistent.
+def test_concurrent_requests(monkeypatch):
+    # PREPARE
+    ingestion_queue = start_ingestion_queue(monkeypatch, Etl())
+    statuses = []
+
+    def post_customers(thread_number: int):
+        client = flask_webservice.app.test_client()
+        for customer_number in range(50):
+            # Every customer is posted by two threads.
+            customer_id = (thread_number // 2) * 50 + customer_number
+            customer = {"id": str(customer_id), "first_name": "Georgia", "last_name": "Lewis", "email": f"{customer_id}@example.org"}
+            statuses.append(client.post("/customer", json=customer).status_code)
+
+    # ACT
+    threads = [threading.Thread(target=post_customers, args=(thread_number,)) for thread_number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert statuses.count(200) == 200
+    assert statuses.count(400) == 200
+    assert ingestion_queue.etl.customer_count() == 200
+    assert sorted(ingestion_queue.etl.customer_id_to_row.values()) == list(range(200))
+
+
+# WHEN: Records are posted while the ingestion queue is full.
+# RESULT: The request is refused with status 429, until the writer catches up.
+def test_full_ingestion_queue(monkeypatch):
+    # PREPARE
+    ingestion_queue = start_ingestion_queue(monkeypatch, Etl(), max_pending_records=1)
+    client = flask_webservice.app.test_client()
+    writer_blocked = threading.Event()
+    release_writer = threading.Event()
+
+    def block_writer(etl: Etl):
+        writer_blocked.set()
+        release_writer.wait()
+
+    ingestion_queue.submit(block_writer, 0)
+    writer_blocked.wait()
+    queued = ingestion_queue.submit(lambda etl: None, 1)
+    customer = {"id": "347984", "first_name": "Georgia", "last_name": "Lewis", "email": "hollymillar@example.org"}
+
+    # ACT
+    full_response = client.post("/customer", json=customer)
+    release_writer.set()
+    queued.result()
+    response = client.post("/customer", json=customer)
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert full_response.status_code == 429
+    assert response.status_code == 200
+    assert ingestion_queue.etl.customer_count() == 1
+
+
+# WHEN: Records time out waiting for the writer, first while still queued, then after the writer has taken them.
+# RESULT: The queued record is taken off the queue, and refused with status 503, so it isn't loaded. The record the
+# writer has taken is still loaded, and answered with status 202.
+def test_load_timeout(monkeypatch):
+    # PREPARE
+    etl = Etl()
+    ingestion_queue = start_ingestion_queue(monkeypatch, etl)
+    monkeypatch.setattr(flask_webservice, "LOAD_TIMEOUT_SECONDS", 0.1)
+    client = flask_webservice.app.test_client()
+    writer_blocked = threading.Event()
+    release_writer = threading.Event()
+    release_load = threading.Event()
+    load_customer = etl.load_customer
+
+    def block_writer(etl: Etl):
+        writer_blocked.set()
+        release_writer.wait()
+
+    def block_load_customer(customer, byte_count: int):
+        release_load.wait()
+        load_customer(customer, byte_count)
+
+    ingestion_queue.submit(block_writer, 0)
+    writer_blocked.wait()
+    customers = [{"id": str(customer_id), "first_name": "Georgia", "last_name": "Lewis", "email": f"{customer_id}@example.org"}
+                 for customer_id in range(2)]
+
+    # ACT
+    queued_response = client.post("/customer", json=customers[0])
+    pending_records = ingestion_queue.pending_records
+    etl.load_customer = block_load_customer
+    release_writer.set()
+    taken_response = client.post("/customer", json=customers[1])
+    release_load.set()
+    ingestion_queue.stop()
+
+    # ASSERT
+    assert queued_response.status_code == 503
+    assert pending_records == 0
+    assert taken_response.status_code == 202
+    assert list(etl.customer_id_to_row) == [1]
@@ -0,0 +1,124 @@
+from write_ahead_log import WriteAheadLog, SNAPSHOT_PREFIX
+from ingestion_queue import IngestionQueue, IngestionStopped
+import flask_webservice
+import filecmp
+import shutil
+import pytest
+import json
+from etl import Etl
+import os
+
+OUTPUT_FILENAMES = [Etl.customers_output_filename, Etl.products_output_filename, Etl.transactions_output_filename,
+                    Etl.rejected_input_output_filename, Etl.rejected_input_details_output_filename, Etl.erased_customer_ids_output_filename]
+
+
+def assert_same_output(output_folder: str, other_output_folder: str):
+    for filename in OUTPUT_FILENAMES:
+        assert filecmp.cmp(os.path.join(output_folder, filename), os.path.join(other_output_folder, filename), shallow=False), filename
+
+
+@pytest.mark.parametrize("compact_key_indexes", [False, True])
+# WHEN: An etl process is snapshotted, restored from the snapshot, and both then load the same records.
+# RESULT: The restored process holds the same rows and key indexes, so rejects the same duplicates, and saves the same output.
+def test_snapshot_restores_etl_state(request, compact_key_indexes):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    etl = Etl(compact_key_indexes=compact_key_indexes)
+    etl.load_from_file("test-data/date=2020-01-01")
+    etl.load_erasure_request_from_string('{"email": "hollymillar@example.org"}')
+
+    # ACT
+    etl.save_snapshot(os.path.join(test_output_folder, "snapshot"))
+    restored_etl = Etl(compact_key_indexes=compact_key_indexes)
+    restored_etl.load_snapshot(os.path.join(test_output_folder, "snapshot"))
+    for loading_etl in [etl, restored_etl]:
+        loading_etl.load_from_file("test-data/date=2020-01-01/hour=00")
+        loading_etl.load_from_file("test-data/date=2020-01-02")
+    etl.save(os.path.join(test_output_folder, "original"))
+    restored_etl.save(os.path.join(test_output_folder, "restored"))
+
+    # ASSERT
+    assert restored_etl.stats()["rows"] == etl.stats()["rows"]
+    assert restored_etl.stats()["index_sizes"] == etl.stats()["index_sizes"]
+    assert_same_output(os.path.join(test_output_folder, "original"), os.path.join(test_output_folder, "restored"))
+
+
+# WHEN: The webservice loads records with a write-ahead log, which snapshots the etl process once, then crashes partway
+# through writing a log entry.
+# RESULT: A new etl process recovers from the snapshot and the entries logged since, to the state of the crashed one.
+def test_write_ahead_log_recovers_after_crash(request, monkeypatch):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    wal_folder = os.path.join(test_output_folder, "wal")
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    etl = Etl()
+    write_ahead_log = WriteAheadLog(wal_folder, snapshot_log_bytes=1000)
+    write_ahead_log.recover(etl)
+    ingestion_queue = IngestionQueue(etl, write_ahead_log=write_ahead_log)
+    ingestion_queue.start()
+    monkeypatch.setattr(flask_webservice, "ingestion_queue", ingestion_queue)
+    client = flask_webservice.app.test_client()
+    customers = [{"id": str(customer_id), "first_name": "First", "last_name": "Last", "email": f"{customer_id}@example.org"}
+                 for customer_id in range(20)]
+    transaction = {"transaction_id": "t1", "transaction_time": "2020-01-01T10:00:00", "customer_id": "3",
+                   "delivery_address": {"address": "3 Street", "postcode": "E90 2FT", "city": "Maria Ville", "country": "United Kingdom"},
+                   "purchases": {"products": [{"sku": 1, "quanitity": 1, "price": "1.00", "total": "1.00"}], "total_cost": "1.00"}}
+
+    # ACT
+    client.post("/customers", data="\n".join(json.dumps(customer) for customer in customers + customers[:1]), content_type="application/x-ndjson")
+    client.post("/product", json={"sku": "1", "name": "Product", "price": "1.00", "category": "vitamin", "popularity": 0.5})
+    client.post("/transaction", json=transaction)
+    client.post("/transaction", json=transaction)
+    client.post("/erasure-requests", data='{"customer-id": "3"}\n', content_type="application/x-ndjson")
+    ingestion_queue.stop()
+    # A crash while writing an entry leaves it cut short.
+    with open(write_ahead_log.segment_path(write_ahead_log.segment_number), mode='ab') as segment_file:
+        segment_file.write(b"\x40\x00\x00\x00\x00\x00\x00\x00customers\n{\"id\": ")
+    recovered_etl = Etl()
+    replayed_count = WriteAheadLog(wal_folder).recover(recovered_etl)
+    etl.save(os.path.join(test_output_folder, "original"))
+    recovered_etl.save(os.path.join(test_output_folder, "recovered"))
+
+    # ASSERT
+    assert len([filename for filename in os.listdir(wal_folder) if filename.startswith(SNAPSHOT_PREFIX)]) == 1
+    assert replayed_count == 3
+    assert recovered_etl.stats()["rows"] == etl.stats()["rows"]
+    assert recovered_etl.customer_transactions(3)[0].delivery_address["address"] != "3 Street"
+    assert_same_output(os.path.join(test_output_folder, "original"), os.path.join(test_output_folder, "recovered"))
+
+
+# WHEN: Writing a batch to the write-ahead log fails, after the batch was loaded into the etl process.
+# RESULT: The batch isn't acknowledged, the queue refuses further work, and recovery holds only the records acknowledged.
+def test_write_ahead_log_failure_stops_ingestion(request, monkeypatch):
+    # PREPARE
+    test_output_folder = os.path.join("test-output", request.node.name)
+    shutil.rmtree(test_output_folder, ignore_errors=True)
+    write_ahead_log = WriteAheadLog(test_output_folder)
+    write_ahead_log.recover(Etl())
+    ingestion_queue = IngestionQueue(Etl(), write_ahead_log=write_ahead_log)
+    ingestion_queue.start()
+
+    def submit_customer(customer_id: int):
+        line = json.dumps({"id": str(customer_id), "first_name": "First", "last_name": "Last", "email": f"{customer_id}@example.org"})
+        return ingestion_queue.submit(lambda etl: etl.load_customer_from_string(line), 1, lambda result: ("customers", line.encode('utf-8') + b"\n"))
+
+    def fail_append(entity: str, data: bytes):
+        raise OSError("No space left on device")
+
+    # ACT
+    submit_customer(1).result()
+    monkeypatch.setattr(write_ahead_log, "append", fail_append)
+    failed_future = submit_customer(2)
+    with pytest.raises(IngestionStopped):
+        failed_future.result()
+    with pytest.raises(IngestionStopped):
+        submit_customer(3)
+    ingestion_queue.stop()
+    recovered_etl = Etl()
+    WriteAheadLog(test_output_folder).recover(recovered_etl)
+
+    # ASSERT
+    assert ingestion_queue.etl.customer_count() == 2
+    assert recovered_etl.customer_count() == 1
+    assert 1 in recovered_etl.customer_id_to_row
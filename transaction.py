@@ -1,39 +1,61 @@
 from dataclasses import dataclass, field, InitVar
-from pyarrow import ArrowInvalid
-from datetime import datetime
-import pyarrow.parquet as pq
-from decimal import Decimal
+from datetime import datetime, timedelta
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+import parquet_reader
+from money import PURCHASE_SCALE, money_array, money_to_decimal, parse_money
+from customer import anonymize_array
 from typing import Optional
 import pyarrow as pa
+import numpy as np
+import hashlib
 import json
+import os
+
+
+# Money amounts are held as integer counts of cents, in the `_units` attributes, and read as Decimals, see money.py.
+# Check the quantity is an integer the int32 quantity column can hold, as bulk_json.py requires, so a line with any
+# other value, eg "2", is rejected as it is parsed, rather than failing the batch it is sealed with, see record_store.py.
+# A null quantity is kept.
+def parse_quantity(value):
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError(f"Quantity {value!r} is not an integer.")
+    if not -2 ** 31 <= value < 2 ** 31:
+        raise ValueError(f"Quantity {value} is out of range.")
+    return value
 
 
 class ProductPurchase:
     def __init__(self, product_purchase_json: dict):
         self.sku = int(product_purchase_json["sku"])
         if "quantity" in product_purchase_json:
-            self.quantity = product_purchase_json["quantity"]
+            self.quantity = parse_quantity(product_purchase_json["quantity"])
         else:
-            self.quantity = product_purchase_json["quanitity"]
-        self.price = Decimal(product_purchase_json["price"])
-        self.total = Decimal(product_purchase_json["total"])
+            self.quantity = parse_quantity(product_purchase_json["quanitity"])
+        self.price_units = parse_money(product_purchase_json["price"], PURCHASE_SCALE)
+        self.total_units = parse_money(product_purchase_json["total"], PURCHASE_SCALE)
+
+    @property
+    def price(self):
+        return money_to_decimal(self.price_units)
+
+    @property
+    def total(self):
+        return money_to_decimal(self.total_units)
 
 
 class Purchases:
     def __init__(self, purchase_json: dict):
         self.products = [ProductPurchase(product_purchase_dict) for product_purchase_dict in purchase_json["products"]]
-        self.total_cost = Decimal(purchase_json["total_cost"])
-        cost_sum = sum([product.total for product in self.products])
-        assert self.total_cost == cost_sum, "`total_cost` should match the total amount that all products purchased total up to."
-
-    # Returns this object as a parquet data object ready to be saved to file.
-    def to_parquet_data(self):
-        purchase_dict = vars(self)
-        product_dicts = []
-        for product_object in purchase_dict['products']:
-            product_dicts.append(vars(product_object))
-        purchase_dict['products'] = product_dicts
-        return purchase_dict
+        self.total_cost_units = parse_money(purchase_json["total_cost"], PURCHASE_SCALE)
+        cost_sum = sum([product.total_units for product in self.products])
+        assert self.total_cost_units == cost_sum, "`total_cost` should match the total amount that all products purchased total up to."
+
+    @property
+    def total_cost(self):
+        return money_to_decimal(self.total_cost_units)
 
     @staticmethod
     # Returns the parquet structure to save this object to file.
@@ -55,6 +77,94 @@ class Purchases:
         return purchases_schema
 
 
+# Converts the purchases column of a RecordStore between the Purchases objects rows hold and its arrow array.
+# Unsealed rows are held by a PurchasesBuilder, rather than as objects.
+class PurchasesColumn:
+    def __init__(self):
+        self.type = Purchases.parquet_struct()
+
+    def new_column(self):
+        return PurchasesBuilder(self.type)
+
+    def to_arrow(self, column):
+        if not isinstance(column, PurchasesBuilder):
+            purchases_list = column
+            column = self.new_column()
+            for purchases in purchases_list:
+                column.append(purchases)
+        return column.to_arrow()
+
+    def to_python(self, array: pa.Array):
+        return [Purchases(purchase_dict) for purchase_dict in array.to_pylist()]
+
+
+# Accumulates the purchases of transactions straight into the child columns of the purchases array: the total cost of
+# each transaction, the offsets of its products in the product purchase columns, and those columns.
+# Sealing them into arrow arrays then needs no dictionary per row, and leaves the Purchases objects unchanged.
+class PurchasesBuilder:
+    def __init__(self, purchases_type: pa.StructType):
+        self.type = purchases_type
+        self.products_type = purchases_type.field('products').type
+        self.product_purchase_type = self.products_type.value_type
+
+        self.total_costs = []
+        self.offsets = [0]
+        self.skus = []
+        self.quantities = []
+        self.prices = []
+        self.totals = []
+
+    def __len__(self):
+        return len(self.total_costs)
+
+    def append(self, purchases: Purchases):
+        self.total_costs.append(purchases.total_cost_units)
+        for product in purchases.products:
+            self.skus.append(product.sku)
+            self.quantities.append(product.quantity)
+            self.prices.append(product.price_units)
+            self.totals.append(product.total_units)
+        self.offsets.append(len(self.skus))
+
+    # Remove the last row.
+    def pop(self):
+        start = self.offsets[-2]
+        del self.skus[start:], self.quantities[start:], self.prices[start:], self.totals[start:]
+        del self.offsets[-1], self.total_costs[-1]
+
+    def __getitem__(self, row: int):
+        products = [{"sku": self.skus[index], "quantity": self.quantities[index], "price": money_to_decimal(self.prices[index]),
+                     "total": money_to_decimal(self.totals[index])}
+                    for index in range(self.offsets[row], self.offsets[row + 1])]
+        return Purchases({"total_cost": money_to_decimal(self.total_costs[row]), "products": products})
+
+    def __setitem__(self, row: int, purchases: Purchases):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        self.total_costs[row] = purchases.total_cost_units
+        self.skus[start:end] = [product.sku for product in purchases.products]
+        self.quantities[start:end] = [product.quantity for product in purchases.products]
+        self.prices[start:end] = [product.price_units for product in purchases.products]
+        self.totals[start:end] = [product.total_units for product in purchases.products]
+        shift = len(purchases.products) - (end - start)
+        if shift != 0:
+            self.offsets[row + 1:] = [offset + shift for offset in self.offsets[row + 1:]]
+
+    def to_arrow(self):
+        product_purchases = pa.StructArray.from_arrays(
+            [
+                pa.array(np.asarray(self.skus, dtype=np.int64)),
+                pa.array(self.quantities, type=pa.int32()),
+                money_array(self.prices, self.product_purchase_type.field('price').type),
+                money_array(self.totals, self.product_purchase_type.field('total').type)
+            ],
+            fields=list(self.product_purchase_type))
+        products = pa.ListArray.from_arrays(pa.array(np.asarray(self.offsets, dtype=np.int32)), product_purchases,
+                                            type=self.products_type)
+        return pa.StructArray.from_arrays(
+            [money_array(self.total_costs, self.type.field('total_cost').type), products],
+            fields=list(self.type))
+
+
 @dataclass
 class Transaction:
     transaction_id: str
@@ -89,7 +199,15 @@ class Transaction:
 
     @classmethod
     def from_string(cls, transaction_string: str):
-        transaction_json = json.loads(transaction_string)
+        return cls.from_json(cls.decode_json(transaction_string))
+
+    @staticmethod
+    def decode_json(transaction_string: str):
+        return json.loads(transaction_string)
+
+    # Construct from the dictionary decoded from the json string.
+    @classmethod
+    def from_json(cls, transaction_json: dict):
 
         transaction_id = transaction_json.get("transaction_id")
         customer_id = transaction_json.get("customer_id")
@@ -102,6 +220,10 @@ class Transaction:
                           delivery_address=delivery_address, purchases_json=purchases_json)
         return transaction
 
+    # Returns this object's values in the column order of its parquet structure.
+    def to_parquet_row(self):
+        return [self.transaction_id, self.customer_id, self.delivery_address, self.transaction_time, self.purchases]
+
     @staticmethod
     # Returns the parquet structure to save this object to file.
     def parquet_struct():
@@ -125,25 +247,112 @@ class Transaction:
         )
         return transactions_struct
 
+    @staticmethod
+    # Returns the converters of columns whose rows don't hold the values arrow converts to, see RecordStore.
+    def column_converters():
+        return {'purchases': PurchasesColumn()}
+
+    # Hash the personal identifying information of the delivery address, as Customer.anonymize does for the customer's.
+    def anonymize(self):
+        self.delivery_address = anonymize_delivery_address(self.delivery_address)
+
+
+# The delivery address fields Transaction.anonymize hashes. The city and country are kept, as for customers.
+ANONYMIZED_DELIVERY_ADDRESS_FIELDS = ["address", "postcode"]
+
+
+def anonymize_delivery_address(delivery_address: dict):
+    if delivery_address is None:
+        return None
+    delivery_address = dict(delivery_address)
+    for field_name in ANONYMIZED_DELIVERY_ADDRESS_FIELDS:
+        if delivery_address.get(field_name) is not None:
+            delivery_address[field_name] = hashlib.md5(delivery_address[field_name].encode('utf-8')).hexdigest()
+    return delivery_address
+
+
+# Returns the transactions, a table or record batch, with the delivery addresses of the rows of the boolean mask
+# anonymized as Transaction.anonymize does, a whole column at a time, see customer.anonymize_customers.
+def anonymize_transactions(transactions, mask):
+    mask = pa.array(mask, pa.bool_())
+    index = transactions.schema.get_field_index("delivery_address")
+    delivery_addresses = transactions.column(index)
+    if isinstance(delivery_addresses, pa.ChunkedArray):
+        delivery_addresses = delivery_addresses.combine_chunks()
+    fields = list(delivery_addresses.type)
+    arrays = [pc.struct_field(delivery_addresses, [field_index]) for field_index in range(len(fields))]
+    for field_index, field in enumerate(fields):
+        if field.name in ANONYMIZED_DELIVERY_ADDRESS_FIELDS:
+            arrays[field_index] = anonymize_array(arrays[field_index], mask)
+    columns = list(transactions.columns)
+    columns[index] = pa.StructArray.from_arrays(arrays, fields=fields, mask=delivery_addresses.is_null())
+    return type(transactions).from_arrays(columns, schema=transactions.schema)
+
+
+# Transactions can be saved as a hive partitioned dataset, in a folder per date and hour of their transaction_time,
+# eg `date=2020-01-01/hour=00`, as the input data is laid out.
+TRANSACTION_PARTITION_SCHEMA = pa.schema([pa.field('date', pa.string()), pa.field('hour', pa.string())])
+
+
+# Returns the table with the date and hour partition columns of its transactions.
+def with_transaction_partitions(table: pa.Table):
+    transaction_time = table.column("transaction_time")
+    return table.append_column("date", pc.strftime(transaction_time, "%Y-%m-%d")).append_column("hour", pc.strftime(transaction_time, "%H"))
+
+
+# Transactions can be filtered to a time range, from `start_time` up to but excluding `end_time`.
+# The transactions output may be a file, or a folder of partitions, whose partitions outside the range are skipped.
+def read_transactions_table(filepath: str, columns: list = None, start_time: datetime = None, end_time: datetime = None,
+                            customer_ids=None, filter: ds.Expression = None):
+    partitioned = os.path.isdir(filepath)
+    return parquet_reader.read_table(filepath, pa.schema(Transaction.parquet_struct()), columns,
+                                     transaction_filter(start_time, end_time, customer_ids, filter, partitioned),
+                                     TRANSACTION_PARTITION_SCHEMA if partitioned else None)
+
+
+def iter_transaction_batches(filepath: str, columns: list = None, start_time: datetime = None, end_time: datetime = None,
+                             customer_ids=None, filter: ds.Expression = None, batch_size: int = 1000):
+    partitioned = os.path.isdir(filepath)
+    return parquet_reader.iter_batches(filepath, pa.schema(Transaction.parquet_struct()), columns,
+                                       transaction_filter(start_time, end_time, customer_ids, filter, partitioned), batch_size,
+                                       TRANSACTION_PARTITION_SCHEMA if partitioned else None)
+
+
+def transaction_filter(start_time: datetime = None, end_time: datetime = None, customer_ids=None, filter: ds.Expression = None,
+                       partitioned: bool = False):
+    return parquet_reader.all_of(transaction_partition_filter(start_time, end_time) if partitioned else None,
+                                 parquet_reader.in_range("transaction_time", start_time, end_time),
+                                 parquet_reader.is_in("customer_id", customer_ids, pa.int64()), filter)
+
+
+# Filters on the partitions holding the hours from `start_time` up to `end_time`. The range may start or end part way
+# through an hour, so the filter on transaction_time is still needed within the first and last partitions.
+def transaction_partition_filter(start_time: datetime = None, end_time: datetime = None):
+    date = ds.field("date")
+    hour = ds.field("hour")
+    start_filter = None
+    end_filter = None
+    if start_time is not None:
+        start_date, start_hour = start_time.strftime("%Y-%m-%d"), start_time.strftime("%H")
+        start_filter = (date > start_date) | ((date == start_date) & (hour >= start_hour))
+    if end_time is not None:
+        # The last time in the range is a microsecond before the end, the resolution of transaction_time.
+        last_time = end_time - timedelta(microseconds=1)
+        end_date, end_hour = last_time.strftime("%Y-%m-%d"), last_time.strftime("%H")
+        end_filter = (date < end_date) | ((date == end_date) & (hour <= end_hour))
+    return parquet_reader.all_of(start_filter, end_filter)
+
+
+def read_transactions(filepath: str, start_time: datetime = None, end_time: datetime = None, customer_ids=None,
+                      filter: ds.Expression = None):
+    for record_batch in iter_transaction_batches(filepath, start_time=start_time, end_time=end_time, customer_ids=customer_ids, filter=filter):
+        for transaction_dict in record_batch.to_pylist():
+            transaction_dict["transaction_time_datetime"] = transaction_dict.pop("transaction_time")
+            transaction_dict["purchases_json"] = transaction_dict.pop("purchases")
+            # Pass dictionary as keyword arguments
+            yield Transaction(**transaction_dict)
+
 
-def read_transactions(filepath: str):
-    try:
-        file = pq.ParquetFile(filepath)
-        empty_file = False
-    except ArrowInvalid:
-        empty_file = True
-    if not empty_file:
-        for record_batch in file.iter_batches(batch_size=1000):
-            record_list = zip(*[column.to_pylist() for column in record_batch.columns])
-            for record in record_list:
-                # Construct dictionary of transaction parameters
-                transaction_dict = {column_name: value for (column_name, value) in zip(record_batch.column_names, record)}
-                transaction_dict["transaction_time_datetime"] = transaction_dict.pop("transaction_time")
-                transaction_dict["purchases_json"] = transaction_dict.pop("purchases")
-                # Pass dictionary as keyword arguments
-                transaction = Transaction(**transaction_dict)
-                yield transaction
-
-
-def read_all_transactions(filepath: str):
-    return list(read_transactions(filepath))
+def read_all_transactions(filepath: str, start_time: datetime = None, end_time: datetime = None, customer_ids=None,
+                          filter: ds.Expression = None):
+    return list(read_transactions(filepath, start_time, end_time, customer_ids, filter))
@@ -0,0 +1,227 @@
+from key_index import HashedStringKeyIndex, string_key_words
+import numpy as np
+import json
+import os
+
+# Ids held in memory before they are spilled to a run file.
+SPILL_IDS = 1000000
+# Ids the bloom filter is first sized for. It is rebuilt at twice the size whenever more ids are added.
+EXPECTED_IDS = 10000000
+# With 10 bits per id and 7 hashes, about 1% of ids not in the history pass the bloom filter.
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 7
+# Ids read from each run file at a time when merging them.
+MERGE_CHUNK_IDS = 1000000
+
+RUN_PREFIX = "run-"
+PENDING_RUN_PREFIX = "pending-"
+BLOOM_FILTER_FILENAME = "bloom_filter.bin"
+BLOOM_FILTER_INFO_FILENAME = "bloom_filter.json"
+
+
+# The transaction ids of every run of the etl process, kept in a folder, so that transactions can be checked for
+# uniqueness against all earlier runs, without holding their ids in memory or loading their output.
+# Each id is held as a 128 bit hash of it, see key_index.py. Ids added by this run are held in memory, and once there are
+# `spill_ids` of them, written to a run file of ids sorted by hash, which is searched in place by binary search.
+# A bloom filter of all ids, in memory, answers for most ids not in the history without reading any run file.
+# Ids added since the last commit() are discarded when the history is next opened, as the output they were loaded into
+# wasn't saved. Committing merges the newest run files whenever one is no bigger than the one before, so a history of n
+# ids is held in at most about log2(n / spill_ids) files, and each id is rewritten about as many times.
+class TransactionIdHistory:
+    def __init__(self, folder: str, expected_ids: int = EXPECTED_IDS, spill_ids: int = SPILL_IDS):
+        self.folder = folder
+        self.spill_ids = spill_ids
+        os.makedirs(folder, exist_ok=True)
+
+        run_numbers = []
+        for filename in os.listdir(folder):
+            if filename.startswith(PENDING_RUN_PREFIX) or filename.endswith(".tmp"):
+                os.remove(os.path.join(folder, filename))
+            elif filename.startswith(RUN_PREFIX):
+                run_numbers.append(int(filename[len(RUN_PREFIX):-len(".npy")]))
+        self.runs = [(self.open_run(RUN_PREFIX, number), number) for number in sorted(run_numbers)]
+        self.pending_runs = []
+        self.next_run_number = max(run_numbers, default=-1) + 1
+        self.committed_count = sum(run.shape[1] for run, number in self.runs)
+        self.recent = HashedStringKeyIndex()
+        self.count = self.committed_count
+
+        if not self.load_bloom_filter(expected_ids):
+            self.build_bloom_filter(max(expected_ids, 2 * self.count))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, transaction_id):
+        high, low = string_key_words(transaction_id)
+        if not self.bloom_filter_contains(high, low):
+            return False
+        if self.recent.find((high, low))[1]:
+            return True
+        return any(run_contains(run, high, low) for run, number in reversed(self.runs + self.pending_runs))
+
+    # Add an id not yet in the history.
+    def add(self, transaction_id):
+        high, low = string_key_words(transaction_id)
+        self.recent.set_row((high, low), 0)
+        self.count += 1
+        self.bloom_filter_add(high, low)
+        if len(self.recent) >= self.spill_ids:
+            self.spill()
+        if self.count > self.bloom_filter_capacity:
+            self.build_bloom_filter(2 * self.count)
+
+    # Make the ids added so far part of the history when it is next opened.
+    def commit(self):
+        self.spill()
+        for run, number in self.pending_runs:
+            os.replace(self.run_path(PENDING_RUN_PREFIX, number), self.run_path(RUN_PREFIX, number))
+            self.runs.append((self.open_run(RUN_PREFIX, number), number))
+        self.pending_runs = []
+        while len(self.runs) >= 2 and self.runs[-2][0].shape[1] <= self.runs[-1][0].shape[1]:
+            self.merge_last_runs()
+        self.committed_count = self.count
+        self.save_bloom_filter()
+
+    # Write the ids held in memory to a pending run file.
+    def spill(self):
+        if len(self.recent) == 0:
+            return
+        highs = self.recent.key_words[0][self.recent.used]
+        lows = self.recent.key_words[1][self.recent.used]
+        order = np.lexsort((lows, highs))
+        number = self.new_run_number()
+        write_run(self.run_path(PENDING_RUN_PREFIX, number), len(order), [(highs[order], lows[order])])
+        self.pending_runs.append((self.open_run(PENDING_RUN_PREFIX, number), number))
+        self.recent = HashedStringKeyIndex()
+
+    def merge_last_runs(self):
+        merged_runs = self.runs[-2:]
+        number = self.new_run_number()
+        write_run(self.run_path(RUN_PREFIX, number), sum(run.shape[1] for run, run_number in merged_runs),
+                  merge_sorted_runs([run for run, run_number in merged_runs]))
+        self.runs[-2:] = [(self.open_run(RUN_PREFIX, number), number)]
+        for run, run_number in merged_runs:
+            os.remove(self.run_path(RUN_PREFIX, run_number))
+
+    def new_run_number(self):
+        self.next_run_number += 1
+        return self.next_run_number - 1
+
+    def run_path(self, prefix: str, number: int):
+        return os.path.join(self.folder, f"{prefix}{number:012d}.npy")
+
+    # Returns the run file, memory mapped, as a 2 x n array of the high and low words of the hashes of its ids.
+    def open_run(self, prefix: str, number: int):
+        return np.load(self.run_path(prefix, number), mmap_mode='r')
+
+    # The bloom filter is a bytearray, as its bits are set and tested one id at a time faster than a numpy array's. It has
+    # a power of 2 number of bits, so that bit positions are taken from the low bits of sums of the words of an id's hash,
+    # the same whether computed with python integers or wrapping uint64 arrays.
+    def bloom_filter_positions(self, high: int, low: int):
+        return [(high + i * low) & (self.bloom_filter_bit_count - 1) for i in range(BLOOM_HASHES)]
+
+    def bloom_filter_contains(self, high: int, low: int):
+        bits = self.bloom_filter
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.bloom_filter_positions(high, low))
+
+    def bloom_filter_add(self, high: int, low: int):
+        bits = self.bloom_filter
+        for position in self.bloom_filter_positions(high, low):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def bloom_filter_add_many(self, highs: np.ndarray, lows: np.ndarray):
+        highs = np.asarray(highs).view(np.uint64)
+        lows = np.asarray(lows).view(np.uint64)
+        mask = np.uint64(self.bloom_filter_bit_count - 1)
+        bits = np.frombuffer(self.bloom_filter, dtype=np.uint8)
+        for i in range(BLOOM_HASHES):
+            positions = (highs + np.uint64(i) * lows) & mask
+            np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp),
+                             (np.uint64(1) << (positions & np.uint64(7))).astype(np.uint8))
+
+    # Build a bloom filter for `capacity` ids, from the run files, read a chunk at a time, and the ids in memory.
+    def build_bloom_filter(self, capacity: int):
+        bit_count = 8 * 1024
+        while bit_count < capacity * BLOOM_BITS_PER_ID:
+            bit_count *= 2
+        self.bloom_filter_bit_count = bit_count
+        self.bloom_filter_capacity = bit_count // BLOOM_BITS_PER_ID
+        self.bloom_filter = bytearray(bit_count // 8)
+        for run, number in self.runs + self.pending_runs:
+            for start in range(0, run.shape[1], MERGE_CHUNK_IDS):
+                self.bloom_filter_add_many(run[0, start:start + MERGE_CHUNK_IDS], run[1, start:start + MERGE_CHUNK_IDS])
+        self.bloom_filter_add_many(self.recent.key_words[0][self.recent.used], self.recent.key_words[1][self.recent.used])
+
+    # Load the bloom filter saved by the last commit, if it holds the ids of the run files and is big enough.
+    # Returns whether it was loaded.
+    def load_bloom_filter(self, expected_ids: int):
+        info_path = os.path.join(self.folder, BLOOM_FILTER_INFO_FILENAME)
+        if not os.path.isfile(info_path):
+            return False
+        with open(info_path) as info_file:
+            info = json.load(info_file)
+        if info["ids"] != self.committed_count or info["bit_count"] < expected_ids * BLOOM_BITS_PER_ID:
+            return False
+        self.bloom_filter_bit_count = info["bit_count"]
+        self.bloom_filter_capacity = self.bloom_filter_bit_count // BLOOM_BITS_PER_ID
+        with open(os.path.join(self.folder, BLOOM_FILTER_FILENAME), "rb") as filter_file:
+            self.bloom_filter = bytearray(filter_file.read())
+        return True
+
+    def save_bloom_filter(self):
+        filter_path = os.path.join(self.folder, BLOOM_FILTER_FILENAME)
+        info_path = os.path.join(self.folder, BLOOM_FILTER_INFO_FILENAME)
+        with open(filter_path + ".tmp", "wb") as filter_file:
+            filter_file.write(self.bloom_filter)
+        os.replace(filter_path + ".tmp", filter_path)
+        with open(info_path + ".tmp", "w") as info_file:
+            json.dump({"ids": self.committed_count, "bit_count": self.bloom_filter_bit_count}, info_file)
+        os.replace(info_path + ".tmp", info_path)
+
+
+# Returns whether the sorted run holds the hash, by binary search of its high words.
+def run_contains(run: np.ndarray, high: int, low: int):
+    start = np.searchsorted(run[0], high, side='left')
+    end = np.searchsorted(run[0], high, side='right')
+    return bool(np.any(run[1, start:end] == low))
+
+
+# Write `total` hashes, given as chunks of their sorted high and low words, to a run file, through a temporary file, so
+# it is never seen incomplete.
+def write_run(path: str, total: int, chunks):
+    run = np.lib.format.open_memmap(path + ".tmp", mode='w+', dtype=np.int64, shape=(2, total))
+    written = 0
+    for highs, lows in chunks:
+        run[0, written:written + len(highs)] = highs
+        run[1, written:written + len(highs)] = lows
+        written += len(highs)
+    run.flush()
+    del run
+    os.replace(path + ".tmp", path)
+
+
+# Yields the sorted high and low words of the runs' hashes, a chunk at a time.
+# Each round merges the next chunk of every run, up to the smallest last hash of the chunks of the runs not exhausted by
+# them, so every hash merged is smaller than any left, and memory is bounded by the chunk size.
+def merge_sorted_runs(runs: list):
+    positions = [0] * len(runs)
+    while any(position < run.shape[1] for run, position in zip(runs, positions)):
+        chunks = [run[:, position:position + MERGE_CHUNK_IDS] for run, position in zip(runs, positions)]
+        bound = None
+        for run, position, chunk in zip(runs, positions, chunks):
+            if position + chunk.shape[1] < run.shape[1]:
+                last = (int(chunk[0, -1]), int(chunk[1, -1]))
+                bound = last if bound is None or last < bound else bound
+        taken = []
+        for index, chunk in enumerate(chunks):
+            count = chunk.shape[1]
+            if bound is not None:
+                start = np.searchsorted(chunk[0], bound[0], side='left')
+                end = np.searchsorted(chunk[0], bound[0], side='right')
+                count = int(start + np.searchsorted(chunk[1, start:end], bound[1], side='right'))
+            taken.append(chunk[:, :count])
+            positions[index] += count
+        merged = np.concatenate(taken, axis=1)
+        order = np.lexsort((merged[1], merged[0]))
+        yield merged[0][order], merged[1][order]
@@ -0,0 +1,132 @@
+from time import monotonic
+from etl import Etl
+import shutil
+import struct
+import zlib
+import os
+
+# Bytes logged, or seconds passed, since the last snapshot, after which snapshot_due() is true.
+SNAPSHOT_LOG_BYTES = 256 * 1024 * 1024
+SNAPSHOT_INTERVAL_SECONDS = 600.0
+
+SEGMENT_PREFIX = "wal-"
+SNAPSHOT_PREFIX = "snapshot-"
+# Each entry is its payload's length and crc32, then the payload: the entity, a newline, and the entity's records as
+# newline delimited json.
+ENTRY_HEADER = struct.Struct("<II")
+
+
+# An append-only log of the records an etl process accepts, so that its state can be recovered after a crash, rather
+# than only existing in memory until the output is saved.
+# Records are appended once loaded, and made durable with commit(), which flushes and fsyncs the log once for all the
+# records appended since, so that many records share the cost of a disk sync (group commit). They must only be
+# acknowledged once committed. Only accepted records are logged, so replaying them loads them all again, the same way.
+# The log is split into numbered segment files, and periodically compacted by snapshot(), which writes the etl state to a
+# snapshot folder numbered after the segments it holds, see Etl.save_snapshot, then deletes those segments and any older
+# snapshots. recover() loads the latest snapshot, then replays the segments logged since. An entry whose write was cut
+# short by a crash fails its length or checksum, and ends the replay of its segment. Recovery starts a new segment, so
+# later entries are never appended after a torn one.
+class WriteAheadLog:
+    def __init__(self, folder: str, snapshot_log_bytes: int = SNAPSHOT_LOG_BYTES,
+                 snapshot_interval_seconds: float = SNAPSHOT_INTERVAL_SECONDS):
+        self.folder = folder
+        self.snapshot_log_bytes = snapshot_log_bytes
+        self.snapshot_interval_seconds = snapshot_interval_seconds
+        os.makedirs(folder, exist_ok=True)
+        self.segment_file = None
+        self.segment_number = None
+        self.logged_bytes = 0
+        self.last_snapshot_time = monotonic()
+
+    # Restore the etl process from the latest snapshot and the segments logged since, then start a new segment.
+    # Returns the number of entries replayed.
+    def recover(self, etl: Etl):
+        for filename in os.listdir(self.folder):
+            if filename.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.folder, filename))
+        snapshot_numbers = self.numbers(SNAPSHOT_PREFIX)
+        first_segment_number = 0
+        if len(snapshot_numbers) > 0:
+            first_segment_number = snapshot_numbers[-1]
+            etl.load_snapshot(self.snapshot_path(first_segment_number))
+
+        segment_numbers = [number for number in self.numbers(SEGMENT_PREFIX) if number >= first_segment_number]
+        replayed_count = 0
+        for number in segment_numbers:
+            for entity, data in read_segment(self.segment_path(number)):
+                getattr(etl, f"load_{entity}_from_data")(data, "write-ahead log")
+                replayed_count += 1
+        self.open_segment(max(segment_numbers + [first_segment_number - 1]) + 1)
+        return replayed_count
+
+    # Append the records of an entity, as newline delimited json. They are durable once committed.
+    def append(self, entity: str, data: bytes):
+        payload = entity.encode('utf-8') + b"\n" + data
+        self.segment_file.write(ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self.segment_file.write(payload)
+        self.logged_bytes += ENTRY_HEADER.size + len(payload)
+
+    # Make the records appended so far durable.
+    def commit(self):
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+
+    def snapshot_due(self):
+        return self.logged_bytes >= self.snapshot_log_bytes or \
+            (self.logged_bytes > 0 and monotonic() - self.last_snapshot_time >= self.snapshot_interval_seconds)
+
+    # Snapshot the etl process, which must hold exactly the records logged, then delete the segments it holds.
+    # The snapshot is written to a temporary folder, then renamed, so a crash never leaves an incomplete snapshot.
+    def snapshot(self, etl: Etl):
+        self.commit()
+        self.segment_file.close()
+        number = self.segment_number + 1
+        temporary_path = self.snapshot_path(number) + ".tmp"
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        etl.save_snapshot(temporary_path)
+        os.replace(temporary_path, self.snapshot_path(number))
+        self.open_segment(number)
+
+        for old_number in self.numbers(SEGMENT_PREFIX):
+            if old_number < number:
+                os.remove(self.segment_path(old_number))
+        for old_number in self.numbers(SNAPSHOT_PREFIX):
+            if old_number < number:
+                shutil.rmtree(self.snapshot_path(old_number))
+        self.logged_bytes = 0
+        self.last_snapshot_time = monotonic()
+
+    def close(self):
+        if self.segment_file is not None:
+            self.commit()
+            self.segment_file.close()
+            self.segment_file = None
+
+    def open_segment(self, number: int):
+        self.segment_number = number
+        self.segment_file = open(self.segment_path(number), mode='ab')
+
+    def numbers(self, prefix: str):
+        return sorted(int(filename[len(prefix):].split(".")[0]) for filename in os.listdir(self.folder)
+                      if filename.startswith(prefix) and not filename.endswith(".tmp"))
+
+    def segment_path(self, number: int):
+        return os.path.join(self.folder, f"{SEGMENT_PREFIX}{number:012d}.log")
+
+    def snapshot_path(self, number: int):
+        return os.path.join(self.folder, f"{SNAPSHOT_PREFIX}{number:012d}")
+
+
+# Yields the (entity, data) of each entry of a segment file, up to the first torn entry.
+def read_segment(filepath: str):
+    with open(filepath, mode='rb') as segment_file:
+        while True:
+            header = segment_file.read(ENTRY_HEADER.size)
+            if len(header) < ENTRY_HEADER.size:
+                return
+            length, checksum = ENTRY_HEADER.unpack(header)
+            payload = segment_file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            entity, data = payload.split(b"\n", 1)
+            yield entity.decode('utf-8'), data